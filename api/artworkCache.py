@@ -0,0 +1,88 @@
+import collections
+import os
+import threading
+
+import api.utils as utils
+import api.imageStore as imageStore
+
+
+# maps songs to their embedded artwork, kept in a content addressed image store under
+# <blob path>/artwork. the mapping lives in the songArtwork table, validated against st_mtime
+# and st_size, so a song's tags are parsed at most once per change.
+class artworkCache:
+    def __init__(self, db, storeRoot, sizes: tuple = imageStore.variantSizes, capacity: int = 4096) -> None:
+        self.db = db
+        self.images = imageStore.imageStore(storeRoot, 'artwork', sizes)
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        self._songs = collections.OrderedDict()
+        self._stats = {'memoryHits': 0, 'tableHits': 0, 'extracted': 0, 'noArtwork': 0}
+
+    def resolve(self, digest: str, size: int = None):
+        return self.images.resolve(digest, size)
+
+    def storeFile(self, path: str):
+        return self.images.storeFile(path)
+
+    def _remember(self, path, stat, digest):
+        with self._lock:
+            self._songs[path] = (stat, digest)
+            self._songs.move_to_end(path)
+            while len(self._songs) > self.capacity:
+                self._songs.popitem(last=False)
+
+    def forSong(self, path: str):
+        # returns the artwork hash of an audio file, None when it has no embedded artwork
+        path = os.path.normpath(path)
+        st = os.stat(path)
+        stat = (st.st_mtime, st.st_size)
+
+        with self._lock:
+            entry = self._songs.get(path)
+            if entry is not None and entry[0] == stat:
+                self._songs.move_to_end(path)
+                self._stats['memoryHits'] += 1
+                return entry[1]
+
+        row = self.db.query(
+            "select mtime, size, hash from songArtwork where path = ?", (path, ), one=True)
+        if row is not None and (row['mtime'], row['size']) == stat and \
+                (row['hash'] is None or self.images.exists(row['hash'])):
+            self._remember(path, stat, row['hash'])
+            with self._lock:
+                self._stats['tableHits'] += 1
+            return row['hash']
+
+        try:
+            artwork = utils.getSongArtwork(path)['artwork']
+        except Exception:
+            artwork = None
+        digest = self.images.store(artwork) if artwork is not None else None
+        with self._lock:
+            self._stats['extracted' if digest is not None else 'noArtwork'] += 1
+
+        self._remember(path, stat, digest)
+        self.db.execute("""
+            insert into songArtwork (path, mtime, size, hash) values (?, ?, ?, ?)
+            on conflict (path) do update set mtime = excluded.mtime, size = excluded.size, hash = excluded.hash
+        """, (path, *stat, digest))
+        return digest
+
+    def invalidate(self, path: str):
+        # drops the file itself and everything below it when it is a directory.
+        # stored images stay, other songs may share them.
+        path = os.path.normpath(path)
+        prefix = path + os.sep
+        with self._lock:
+            for i in [i for i in self._songs if i == path or i.startswith(prefix)]:
+                del self._songs[i]
+        self.db.execute(
+            "delete from songArtwork where path = ? or (path >= ? and path < ?)",
+            (path, prefix, path + chr(ord(os.sep) + 1)))
+
+    def queryStats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['cached'] = len(self._songs)
+        stats.update(self.images.queryStats())
+        return stats
@@ -1,55 +1,93 @@
 import sqlite3
 import api.utils as utils
+import api.migrations as migrations
+import api.playCounter as playCounter
+import api.metadataCache as metadataCache
+import api.libraryScanner as libraryScanner
+import api.artworkCache as artworkCache
+import api.imageStore as imageStore
+import api.uploadSessions as uploadSessions
+import api.dedupStore as dedupStore
+import api.dirLister as dirLister
+import api.driveBatch as driveBatch
+import api.driveIndex as driveIndex
+import api.driveReconciler as driveReconciler
+import api.driveUsage as driveUsage
+import api.fileTree as fileTree
+import api.taskExecutor as taskExecutor
+import api.taskLogs as taskLogs
+import api.taskStream as taskStream
+import concurrent.futures
 import logging
 import os
 import mimetypes
+import subprocess
 import time
 import json
 import sys
 import threading
+import urllib.parse
 from typing import Any
+from api.database import databaseObject
 
 
 def getCurrentTime():
     return time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(time.time()))
 
 
-class databaseObject:
-    def __init__(self, dbPath: str) -> None:
-        self.db = sqlite3.connect(dbPath, check_same_thread=False)
-
-    def query(self, query, args=(), one=False):
-        cur = self.db.execute(query, args)
-        rv = [dict((cur.description[idx][0], value)
-                   for idx, value in enumerate(row)) for row in cur.fetchall()]
-        lastrowid = cur.lastrowid
-        cur.close()
-        if query.startswith('insert'):
-            return lastrowid
-        else:
-            return (rv[0] if rv else None) if one else rv
-
-    def runScript(self, query: str):
-        self.db.executescript(query)
-        self.db.commit()
-        return None
-
-    def close(self):
-        self.db.close()
+def emptySongInfo():
+    return {
+        'title': '',
+        'album': '',
+        'artist': '',
+        'composer': '',
+        'length': 0
+    }
 
 
 class dataManager:
     class taskInfo:
-        def __init__(self, dbObject: databaseObject, taskId: int):
+        def __init__(self, dbObject: databaseObject, taskId: int, logs: taskLogs.taskLogStore):
             self.db = dbObject
             self.id = taskId
+            self.logs = logs
+            self.cancelled = threading.Event()
+            self.failed = False
+            self._lock = threading.Lock()
+            self._processes = []
 
         def setLogText(self, text: str):
-            self.db.query(
-                "update taskList set logText = ? where id = ?", (text, self.id))
+            self.logs.replace(self.id, text)
+
+        def appendLog(self, text: str):
+            self.logs.append(self.id, text)
+
+        def setProgress(self, progress: dict):
+            # structured progress for followers of the task stream, e.g. {'done': 3, 'total': 10}
+            self.logs.setProgress(self.id, progress)
+
+        def fail(self, text: str):
+            self.failed = True
+            self.appendLog(text)
+
+        def popen(self, *args, **kwargs):
+            # every child leads its own process group, cancelling the task kills all of it
+            with self._lock:
+                if self.cancelled.is_set():
+                    raise RuntimeError("task cancelled")
+                process = subprocess.Popen(*args, start_new_session=True, **kwargs)
+                self._processes.append(process)
+            return process
+
+        def cancel(self):
+            with self._lock:
+                self.cancelled.set()
+                processes = list(self._processes)
+            for i in processes:
+                taskExecutor.killProcessGroup(i)
 
         def ended(self):
-            self.db.query(
+            self.db.execute(
                 "update taskList set endTime = ? where id = ?", (getCurrentTime(), self.id))
 
     def __init__(self, dbObject: databaseObject, appRoot: str, pluginsPath: str, enabledModule) -> None:
@@ -60,12 +98,94 @@ class dataManager:
             data = i.registry()
             self.plugins[data['name']] = {'info': data, 'handlers': i.handlers}
 
+        # config snapshot and uid -> drive path cache, dropped whenever config or users change
+        self._cacheLock = threading.Lock()
+        self._cacheGeneration = 0
+        self._configSnapshot = None
+        self._userDrivePaths = {}
+        self._cacheStats = {'hits': 0, 'misses': 0, 'invalidations': 0}
+        self.playCounter = playCounter.playCounter(self.db)
+        self.songMetadata = metadataCache.songMetadataCache(self.db)
+        self.libraryScanner = libraryScanner.libraryScanner(self.db)
+        self.artwork = artworkCache.artworkCache(
+            self.db, lambda: utils.catchError(self.logger(), self.getXmsBlobPath()))
+        self.userImages = imageStore.imageStore(
+            lambda: utils.catchError(self.logger(), self.getXmsBlobPath()), 'images')
+        self.uploadSessions = uploadSessions.uploadSessionManager(
+            self.db, lambda: utils.catchError(self.logger(), self.getXmsBlobPath()))
+        self.dedup = dedupStore.dedupStore(
+            lambda: utils.catchError(self.logger(), self.getXmsBlobPath()),
+            lambda: utils.catchError(self.logger(), self.getXmsDriveDedupHardlinks()))
+        self.dirListing = dirLister.dirListCache()
+        self.driveIndex = driveIndex.driveIndex(
+            self.db, lambda: utils.catchError(self.logger(), self.getXmsDrivePath()))
+        self.reconciler = driveReconciler.driveReconciler(self.db, self.driveIndex)
+        self.reconciler.subscribe(self.applyDriveEvents)
+        self.reconciler.listen(self.invalidateDriveEvents)
+        self.driveUsage = driveUsage.driveUsage(self.db, self.driveIndex, self.reconciler)
+        self.fileTree = fileTree.fileTree(self.db)
+        self.taskExecutor = taskExecutor.taskExecutor(self.db)
+        self.taskLogs = taskLogs.taskLogStore(self.db)
+        self.taskExecutor.listen(self.followTaskState)
+        for name, plugin in self.plugins.items():
+            if 'concurrency' in plugin['info']:
+                self.taskExecutor.pluginLimits[name] = plugin['info']['concurrency']
+
     def logger(self) -> logging.Logger:
         return self._logger
 
+    def _countCacheLookup(self, hit: bool):
+        with self._cacheLock:
+            self._cacheStats['hits' if hit else 'misses'] += 1
+
+    def invalidateCache(self):
+        # wait for pending writes so a concurrent miss can't reload the old rows
+        self.db.flush().result()
+        with self._cacheLock:
+            self._cacheGeneration += 1
+            self._configSnapshot = None
+            self._userDrivePaths = {}
+            self._cacheStats['invalidations'] += 1
+
+    def getConfigSnapshot(self):
+        config = self._configSnapshot
+        if config is not None:
+            self._countCacheLookup(True)
+            return config
+
+        self._countCacheLookup(False)
+        generation = self._cacheGeneration
+        config = self.db.query("select * from config", one=True)
+        with self._cacheLock:
+            if config is not None and generation == self._cacheGeneration:
+                self._configSnapshot = config
+        return config
+
+    def queryCacheStats(self):
+        with self._cacheLock:
+            stats = dict(self._cacheStats)
+            stats['cachedUsers'] = len(self._userDrivePaths)
+        return stats
+
+    def queryMetrics(self):
+        return utils.makeResult(True, {
+            'cache': self.queryCacheStats(),
+            'playCounter': self.playCounter.queryStats(),
+            'songMetadata': self.songMetadata.queryStats(),
+            'artwork': self.artwork.queryStats(),
+            'userImages': self.userImages.queryStats(),
+            'dedup': self.dedup.queryStats(),
+            'dirListing': self.dirListing.queryStats(),
+            'driveIndex': self.driveIndex.queryStats(),
+            'reconciler': self.reconciler.queryStats(),
+            'driveUsage': self.driveUsage.queryStats(),
+            'tasks': self.taskExecutor.queryStats(),
+            'taskLogs': self.taskLogs.queryStats()
+        })
+
     def getXmsBlobPath(self):
         try:
-            d = self.db.query("select xmsBlobPath from config", one=True)
+            d = self.getConfigSnapshot()
             if d is None:
                 return utils.makeResult(False, "uninitialized")
             else:
@@ -77,7 +197,7 @@ class dataManager:
 
     def getXmsRootPath(self):
         try:
-            d = self.db.query("select xmsRootPath from config", one=True)
+            d = self.getConfigSnapshot()
             if d is None:
                 return utils.makeResult(False, "uninitialized")
             else:
@@ -87,7 +207,7 @@ class dataManager:
 
     def getXmsDrivePath(self):
         try:
-            d = self.db.query("select xmsDrivePath from config", one=True)
+            d = self.getConfigSnapshot()
             if d is None:
                 return utils.makeResult(False, "uninitialized")
             else:
@@ -98,7 +218,7 @@ class dataManager:
 
     def getXmsHost(self):
         try:
-            d = self.db.query("select host from config", one=True)
+            d = self.getConfigSnapshot()
             if d is None:
                 return utils.makeResult(False, "uninitialized")
             else:
@@ -108,7 +228,7 @@ class dataManager:
 
     def getXmsPort(self):
         try:
-            d = self.db.query("select port from config", one=True)
+            d = self.getConfigSnapshot()
             if d is None:
                 return utils.makeResult(False, "uninitialized")
             else:
@@ -116,6 +236,62 @@ class dataManager:
         except sqlite3.Error as e:
             return utils.makeResult(False, str(e))
 
+    def getXmsFileOffload(self):
+        try:
+            d = self.getConfigSnapshot()
+            if d is None:
+                return utils.makeResult(False, "uninitialized")
+            else:
+                return utils.makeResult(True, {"mode": d['fileOffloadMode'], "prefix": d['fileOffloadPrefix']})
+        except sqlite3.Error as e:
+            return utils.makeResult(False, str(e))
+
+    def getXmsDriveQuota(self):
+        try:
+            d = self.getConfigSnapshot()
+            if d is None:
+                return utils.makeResult(False, "uninitialized")
+            else:
+                return utils.makeResult(True, d['driveQuota'])
+        except sqlite3.Error as e:
+            return utils.makeResult(False, str(e))
+
+    def getXmsDriveDedup(self):
+        try:
+            d = self.getConfigSnapshot()
+            if d is None:
+                return utils.makeResult(False, "uninitialized")
+            else:
+                return utils.makeResult(True, bool(d['driveDedup']))
+        except sqlite3.Error as e:
+            return utils.makeResult(False, str(e))
+
+    def getXmsDriveDedupHardlinks(self):
+        try:
+            d = self.getConfigSnapshot()
+            if d is None:
+                return utils.makeResult(False, "uninitialized")
+            else:
+                return utils.makeResult(True, bool(d['driveDedupHardlinks']))
+        except sqlite3.Error as e:
+            return utils.makeResult(False, str(e))
+
+    def queryFileOffload(self, path: str):
+        # where the front proxy finds a file, None when the bytes are served by this process
+        offload = utils.catchError(self.logger(), self.getXmsFileOffload())
+        if offload['mode'] == 'X-Sendfile':
+            return utils.makeResult(True, ('X-Sendfile', os.path.abspath(path)))
+        elif offload['mode'] == 'X-Accel-Redirect':
+            root = os.path.abspath(utils.catchError(self.logger(), self.getXmsRootPath()))
+            path = os.path.abspath(path)
+            if os.path.commonpath([root, path]) != root:
+                return utils.makeResult(True, None)
+            location = offload['prefix'].rstrip('/') + '/' + \
+                urllib.parse.quote(os.path.relpath(path, root).replace(os.sep, '/'))
+            return utils.makeResult(True, ('X-Accel-Redirect', location))
+        else:
+            return utils.makeResult(True, None)
+
     def executeInitScript(self, scriptPath: str = './scripts/init.sql'):
         try:
             self.logger().debug(
@@ -123,58 +299,102 @@ class dataManager:
             with open(scriptPath, 'r') as file:
                 try:
                     self.db.runScript(file.read())
-                    return utils.makeResult(True, "success")
+                    self.invalidateCache()
                 except sqlite3.Error as e:
                     return utils.makeResult(False, str(e))
+            return self.upgradeSchema()
         except Exception as e:
             return utils.makeResult(False, str(e))
 
+    def getSchemaVersion(self):
+        try:
+            return utils.makeResult(True, self.db.transaction(migrations.getSchemaVersion))
+        except sqlite3.Error as e:
+            return utils.makeResult(False, str(e))
+
+    def upgradeSchema(self):
+        try:
+            if self.getConfigSnapshot() is None:
+                return utils.makeResult(False, "uninitialized")
+        except sqlite3.Error:
+            return utils.makeResult(False, "uninitialized")
+
+        try:
+            applied = self.db.transaction(migrations.applyMigrations)
+            self.db.flush().result()
+            for i in applied:
+                self.logger().info(f"applied schema migration {i}")
+            return utils.makeResult(True, {"version": migrations.latestVersion, "applied": applied})
+        except (sqlite3.Error, OSError) as e:
+            return utils.makeResult(False, f"schema migration failed: {str(e)}")
+
     def updateXmsRootPath(self, newRootPath: str):
         try:
-            self.db.query("update config set xmsRootPath = ?", (newRootPath, ))
+            self.db.execute("update config set xmsRootPath = ?", (newRootPath, ))
+            self.invalidateCache()
             return utils.makeResult(True, "success")
         except sqlite3.Error as e:
             return utils.makeResult(False, str(e))
 
     def updateXmsBlobPath(self, newBlobPath: str):
         try:
-            self.db.query("update config set xmsBlobPath = ?", (newBlobPath, ))
+            self.db.execute("update config set xmsBlobPath = ?", (newBlobPath, ))
+            self.invalidateCache()
             return utils.makeResult(True, "success")
         except sqlite3.Error as e:
             return utils.makeResult(False, str(e))
 
     def updateXmsDrivePath(self, newDrivePath: str):
         try:
-            self.db.query("update config set xmsDrivePath = ?",
-                          (newDrivePath, ))
+            self.db.execute("update config set xmsDrivePath = ?",
+                            (newDrivePath, ))
+            self.invalidateCache()
             return utils.makeResult(True, "success")
         except sqlite3.Error as e:
             return utils.makeResult(False, str(e))
 
     def updateXmsHost(self, newHost: str):
         try:
-            self.db.query("update config set host = ?", (newHost, ))
+            self.db.execute("update config set host = ?", (newHost, ))
+            self.invalidateCache()
             return utils.makeResult(True, "success")
         except sqlite3.Error as e:
             return utils.makeResult(False, str(e))
 
     def updateXmsPort(self, newPort: int):
         try:
-            self.db.query("update config set port = ?", (newPort, ))
+            self.db.execute("update config set port = ?", (newPort, ))
+            self.invalidateCache()
             return utils.makeResult(True, "success")
         except sqlite3.Error as e:
             return utils.makeResult(False, str(e))
 
     def getXmsConfig(self):
-        return utils.makeResult(True, self.db.query("select * from config", one=True))
+        config = self.getConfigSnapshot()
+        return utils.makeResult(True, dict(config) if config is not None else None)
 
     def updateXmsConfig(self, config):
+        if config.get('fileOffloadMode', 'None') not in ['None', 'X-Sendfile', 'X-Accel-Redirect']:
+            return utils.makeResult(False, "invalid request: unknown fileOffloadMode")
+        # settings added after the first release are optional for older clients
+        try:
+            current = self.getConfigSnapshot()
+        except sqlite3.Error as e:
+            return utils.makeResult(False, str(e))
+        if current is None:
+            return utils.makeResult(False, "uninitialized")
         try:
-            self.db.query("update config set serverId = ?, xmsRootPath = ?, xmsBlobPath = ?, xmsDrivePath = ?, host = ?, port = ?, proxyType = ?, proxyUrl = ?, allowRegister = ?, enableInviteCode = ?, inviteCode = ?",
-                          (config['serverId'], config['xmsRootPath'], config['xmsBlobPath'], config['xmsDrivePath'], config['host'], config['port'], config['proxyType'], config['proxyUrl'], config['allowRegister'], config['enableInviteCode'], config['inviteCode']))
+            self.db.execute("update config set serverId = ?, xmsRootPath = ?, xmsBlobPath = ?, xmsDrivePath = ?, host = ?, port = ?, proxyType = ?, proxyUrl = ?, allowRegister = ?, enableInviteCode = ?, inviteCode = ?, fileOffloadMode = ?, fileOffloadPrefix = ?, driveDedup = ?, driveDedupHardlinks = ?, driveQuota = ?",
+                            (config['serverId'], config['xmsRootPath'], config['xmsBlobPath'], config['xmsDrivePath'], config['host'], config['port'], config['proxyType'], config['proxyUrl'], config['allowRegister'], config['enableInviteCode'], config['inviteCode'],
+                             config.get('fileOffloadMode', current['fileOffloadMode']), config.get('fileOffloadPrefix', current['fileOffloadPrefix']),
+                             config.get('driveDedup', current['driveDedup']), config.get('driveDedupHardlinks', current['driveDedupHardlinks']),
+                             config.get('driveQuota', current['driveQuota'])))
+            self.invalidateCache()
             return utils.makeResult(True, "success")
         except KeyError as e:
             return utils.makeResult(False, f"invalid request: missing {e}")
+        except sqlite3.Error as e:
+            return utils.makeResult(False, str(e))
 
     # use username instead of uid because system don't know uid when creating user
     # update: done some tricks to query function, now it will return lastRowId a.k.a uid
@@ -193,6 +413,7 @@ class dataManager:
         else:
             try:
                 utils.rmdir(f"{drivePath}/{uid}")
+                self.driveIndex.remove(f"{drivePath}/{uid}")
                 return utils.makeResult(True, "success")
             except OSError as e:
                 return utils.makeResult(False, f"unable to delete user drive: {str(e)}")
@@ -206,46 +427,55 @@ class dataManager:
 
         try:
             # 0 is user, 1 is admin, 2 is superadmin
-            with open(utils.catchError(self.logger(), self.getXmsBlobPath()) + "/avatar.jpg", "rb+") as a:
-                with open(utils.catchError(self.logger(), self.getXmsBlobPath()) + "/headImage.jpg", "rb+") as b:
-                    uid = self.db.query("insert into users (name, slogan, level, passwordMd5, avatar, headImage) values (?,?,?,?,?,?)",
-                                        (userName, userSlogan, level, utils.makePasswordMd5(userPassword), a.read(), b.read()))
-                    return self.createUserDrive(uid)
+            blobPath = utils.catchError(self.logger(), self.getXmsBlobPath())
+            avatar = self.userImages.storeFile(f"{blobPath}/avatar.jpg")
+            headImage = self.userImages.storeFile(f"{blobPath}/headImage.jpg")
+            uid = self.db.executeInsert("insert into users (name, slogan, level, passwordMd5, avatarHash, avatarMime, headImageHash, headImageMime) values (?,?,?,?,?,?,?,?)",
+                                        (userName, userSlogan, level, utils.makePasswordMd5(userPassword),
+                                         avatar, self.userImages.resolve(avatar)[1], headImage, self.userImages.resolve(headImage)[1]))
+            self.invalidateCache()
+            return self.createUserDrive(uid)
         except Exception as e:
             return utils.makeResult(False, str(e))
 
     def getUserDrivePath(self, uid: int):
+        path = self._userDrivePaths.get(uid)
+        if path is not None:
+            self._countCacheLookup(True)
+            return utils.makeResult(True, path)
+
+        generation = self._cacheGeneration
         if self.checkIfUserExistById(uid) is None:
             return utils.makeResult(False, "user not exist")
 
-        drivePath = utils.catchError(self.logger(), self.getXmsDrivePath())
-        return utils.makeResult(True, f"{drivePath}/{uid}")
+        path = f"{utils.catchError(self.logger(), self.getXmsDrivePath())}/{uid}"
+        with self._cacheLock:
+            if generation == self._cacheGeneration:
+                self._userDrivePaths[uid] = path
+        return utils.makeResult(True, path)
 
-    def getUserDriveDirInfo(self, uid: int, path: str):
+    def getUserDriveDirInfo(self, uid: int, path: str, sort: str = 'name', order: str = 'asc', limit: int = None, cursor: str = None):
         # in this step, we can make sure that the uid is valid
-        filesCnt = 0
         files = []
         base = self.getUserDrivePath(uid)
         if base['ok']:
             base = f"{base['data']}/{path}"
             try:
-                dir = os.listdir(base)
-                for i in dir:
-                    fullPath = os.path.join(base, i)
-                    fileInfo = utils.getPathInfo(fullPath)
-                    fileInfo["path"] = os.path.join(path, i)
-                    files.append(fileInfo)
-                    filesCnt += int(fileInfo["type"] == "file")
-                return utils.makeResult(True, {
-                    "list": files,
-                    "info": {
-                        "total": len(files),
-                        "files": filesCnt,
-                        "dirs": len(files) - filesCnt
-                    }
-                })
+                page, info, nextCursor = self.dirListing.list(base, sort, order, limit, cursor)
+            except (ValueError, TypeError) as e:
+                return utils.makeResult(False, f"invalid request: {str(e)}")
             except Exception as e:
                 return utils.makeResult(False, str(e))
+
+            for i in page:
+                fileInfo = dict(i)
+                fileInfo["path"] = os.path.join(path, i['filename'])
+                files.append(fileInfo)
+            return utils.makeResult(True, {
+                "list": files,
+                "info": info,
+                "nextCursor": nextCursor
+            })
         else:
             return base
 
@@ -255,26 +485,29 @@ class dataManager:
             base = f"{base['data']}/{path}"
             try:
                 os.makedirs(base, 0o777)
+                self.dirListing.invalidate(base)
+                self.driveIndex.update(base)
                 return utils.makeResult(True, "success")
             except OSError as e:
                 return utils.makeResult(False, str(e))
         else:
             return base
 
-    def updateSongPathInSongList(self, oldPath: str, newPath: str):
-        self.db.query(
-            "update songlist set path = ? where path = ?", (newPath, oldPath))
-
     def renameInUserDrive(self, uid: int, path: str, newName: str):
         base = self.getUserDrivePath(uid)
         if base['ok']:
             base = f"{base['data']}/{path}"
             newPath = os.path.join(os.path.dirname(base), newName)
             try:
-                mime = mimetypes.guess_type(base)[0]
-                if mime is not None and mime.startswith('audio/'):
-                    self.updateSongPathInSongList(base, newPath)
                 os.rename(base, newPath)
+                self.db.transaction(lambda conn: self.fileTree.move(
+                    conn, uid, path, os.path.join(os.path.dirname(driveBatch.normalizePath(path)), newName)))
+                self.songMetadata.invalidate(base)
+                self.artwork.invalidate(base)
+                self.dirListing.invalidate(base)
+                self.dirListing.invalidate(newPath)
+                self.driveIndex.remove(base)
+                self.driveIndex.update(newPath)
             except OSError as e:
                 return utils.makeResult(False, str(e))
 
@@ -286,10 +519,17 @@ class dataManager:
         base = self.getUserDrivePath(uid)
         if base['ok']:
             newBase = f"{base['data']}/{path}"
-            newPath = f"{base['data']}/{newPath}/{os.path.basename(newBase)}"
+            target = f"{newPath}/{os.path.basename(newBase)}"
+            newPath = f"{base['data']}/{target}"
             try:
-                self.updateSongPathInSongList(newBase, newPath)
                 utils.move(newBase, newPath)
+                self.db.transaction(lambda conn: self.fileTree.move(conn, uid, path, target))
+                self.songMetadata.invalidate(newBase)
+                self.artwork.invalidate(newBase)
+                self.dirListing.invalidate(newBase)
+                self.dirListing.invalidate(newPath)
+                self.driveIndex.remove(newBase)
+                self.driveIndex.update(newPath)
             except utils.shutil.Error as e:
                 return utils.makeResult(False, str(e))
 
@@ -302,10 +542,18 @@ class dataManager:
         if base['ok']:
             newBase = f"{base['data']}/{path}"
             newPath = f"{base['data']}/{newPath}/{os.path.basename(newBase)}"
+            quota = self.checkDriveQuota(uid, self.driveUsage.queryTreeSize(uid, '/' + os.path.normpath(path).lstrip('/')))
+            if not quota['ok']:
+                return quota
 
             try:
-                utils.copy(newBase, newPath)
-            except utils.shutil.Error as e:
+                if utils.catchError(self.logger(), self.getXmsDriveDedup()):
+                    self.dedup.copy(newBase, newPath)
+                else:
+                    utils.copy(newBase, newPath)
+                self.dirListing.invalidate(newPath)
+                self.driveIndex.update(newPath)
+            except (utils.shutil.Error, OSError) as e:
                 return utils.makeResult(False, str(e))
 
             return utils.makeResult(True, "success")
@@ -318,11 +566,14 @@ class dataManager:
             base = f"{base['data']}/{path}"
             try:
                 if os.path.isfile(base):
-                    self.db.query("delete from playCount where path = ?", (path, ))
-                    self.db.query("delete from songList where path = ?", (path, ))
                     os.remove(base)
                 else:
                     utils.rmdir(base)
+                self.db.transaction(lambda conn: self.fileTree.remove(conn, uid, path))
+                self.songMetadata.invalidate(base)
+                self.artwork.invalidate(base)
+                self.dirListing.invalidate(base)
+                self.driveIndex.remove(base)
 
                 return utils.makeResult(True, "success")
             except OSError as e:
@@ -330,6 +581,104 @@ class dataManager:
         else:
             return base
 
+    def _runDriveStep(self, base: str, step: dict):
+        path = f"{base}{step['path']}"
+        target = f"{base}{step['target']}" if step['target'] is not None else None
+        try:
+            if step['op'] == 'delete':
+                if os.path.isdir(path) and not os.path.islink(path):
+                    utils.rmdir(path)
+                else:
+                    os.remove(path)
+            elif step['op'] == 'copy':
+                if utils.catchError(self.logger(), self.getXmsDriveDedup()):
+                    self.dedup.copy(path, target)
+                elif os.path.isdir(path):
+                    utils.shutil.copytree(path, target)
+                else:
+                    utils.copy(path, target)
+            elif step['op'] == 'rename':
+                os.rename(path, target)
+            else:
+                utils.move(path, target)
+        except (utils.shutil.Error, OSError) as e:
+            return utils.makeResult(False, str(e))
+        return utils.makeResult(True, "success")
+
+    def runDriveBatch(self, uid: int, operations: list):
+        base = self.getUserDrivePath(uid)
+        if not base['ok']:
+            return base
+        base = base['data']
+        try:
+            steps = driveBatch.plan(operations)
+        except ValueError as e:
+            return utils.makeResult(False, f"invalid request: {str(e)}")
+
+        # validated against the drive as the earlier steps of the batch will have left it
+        effects = []
+
+        def isPresent(path):
+            for kind, root in reversed(effects):
+                if driveBatch.isInside(path, root):
+                    return kind == 'created'
+            return os.path.lexists(f"{base}{path}")
+
+        copied = 0
+        for index, step in enumerate(steps):
+            if not isPresent(step['path']):
+                return utils.makeResult(False, f"invalid request: operation {index}: {step['path']} not exist")
+            if step['target'] is not None and isPresent(step['target']):
+                return utils.makeResult(False, f"invalid request: operation {index}: {step['target']} already exists")
+            if step['op'] in ('move', 'rename', 'delete'):
+                effects.append(('removed', step['path']))
+            if step['target'] is not None:
+                effects.append(('created', step['target']))
+            if step['op'] == 'copy':
+                copied += self.driveUsage.queryTreeSize(uid, step['path'])
+        quota = self.checkDriveQuota(uid, copied)
+        if not quota['ok']:
+            return quota
+
+        results = [None] * len(steps)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=driveBatch.batchWorkers, thread_name_prefix="driveBatch") as pool:
+            for wave in driveBatch.schedule(steps):
+                for index, result in zip(wave, pool.map(lambda i: self._runDriveStep(base, steps[i]), wave)):
+                    results[index] = result
+
+        events = []
+        rows = {}
+        for step, result in zip(steps, results):
+            if not result['ok']:
+                continue
+            if step['op'] == 'delete':
+                events.append({'type': 'removed', 'owner': uid, 'path': step['path']})
+            elif step['op'] == 'copy':
+                events.append({'type': 'added', 'owner': uid, 'path': step['target']})
+            else:
+                events.append({'type': 'renamed', 'owner': uid, 'path': step['path'], 'newPath': step['target']})
+            if step['target'] is not None:
+                try:
+                    rows[step['target']] = driveIndex.walkTree(f"{base}{step['target']}", step['target'])
+                except OSError:
+                    # already moved on by a later step of the batch
+                    rows[step['target']] = []
+
+        def write(conn):
+            # path rewrites of every step commit together
+            for i in events:
+                self.driveIndex.removeTree(conn, uid, i['path'])
+            for i in events:
+                if i['type'] != 'removed':
+                    target = i.get('newPath', i['path'])
+                    self.driveIndex.removeTree(conn, uid, target)
+                    self.driveIndex.insertRows(conn, uid, rows[target])
+            self.applyDriveEvents(conn, events)
+
+        self.db.transaction(write)
+        self.invalidateDriveEvents(events)
+        return utils.makeResult(True, results)
+
     def queryFileRealpath(self, uid: int, path: str):
         base = self.getUserDrivePath(uid)
         if base['ok']:
@@ -355,14 +704,72 @@ class dataManager:
         else:
             return base
 
+    def saveUploadedFile(self, realPath: str, storage):
+        # never written in place, the old inode may be shared with other drive files
+        try:
+            dedupStore.writeAtomically(realPath, storage)
+            self.dirListing.invalidate(realPath)
+            self.driveIndex.update(realPath)
+        except OSError as e:
+            return utils.makeResult(False, str(e))
+        if utils.catchError(self.logger(), self.getXmsDriveDedup()):
+            self.dedup.ingestLater(realPath)
+        return utils.makeResult(True, "success")
+
+    def startDriveDedupScan(self):
+        if not utils.catchError(self.logger(), self.getXmsDriveDedup()):
+            return utils.makeResult(False, "deduplicating storage is disabled")
+        if not self.dedup.startScan(utils.catchError(self.logger(), self.getXmsDrivePath())):
+            return utils.makeResult(False, "a deduplication scan is already running")
+        return utils.makeResult(True, "started")
+
+    def queryDriveDedupReport(self):
+        try:
+            return utils.makeResult(True, self.dedup.queryReport())
+        except OSError as e:
+            return utils.makeResult(False, str(e))
+
+    def createUploadSession(self, uid: int, path: str, size: int):
+        realPath = self.queryFileUploadRealpath(uid, path)
+        if not realPath['ok']:
+            return realPath
+        quota = self.checkDriveQuota(uid, size)
+        if not quota['ok']:
+            return quota
+        return self.uploadSessions.create(uid, path, realPath['data'], size)
+
+    def queryUploadSession(self, uid: int, sessionId: str):
+        return self.uploadSessions.querySession(uid, sessionId)
+
+    def writeUploadSessionChunk(self, uid: int, sessionId: str, offset: int, length: int, checksum: str, stream):
+        return self.uploadSessions.writeChunk(uid, sessionId, offset, length, checksum, stream)
+
+    def finalizeUploadSession(self, uid: int, sessionId: str):
+        session = self.uploadSessions.querySession(uid, sessionId)
+        result = self.uploadSessions.finalize(uid, sessionId)
+        if result['ok']:
+            realPath = utils.catchError(self.logger(), self.queryFileUploadRealpath(uid, session['data']['path']))
+            self.dirListing.invalidate(realPath)
+            self.driveIndex.update(realPath)
+            if utils.catchError(self.logger(), self.getXmsDriveDedup()):
+                self.dedup.ingestLater(realPath)
+        return result
+
+    def abortUploadSession(self, uid: int, sessionId: str):
+        return self.uploadSessions.abort(uid, sessionId)
+
     def updateFileInUserDrive(self, uid: int, path: str, content: str):
         base = self.getUserDrivePath(uid)
         if base['ok']:
             base = f"{base['data']}/{path}"
             try:
                 if os.path.isfile(base):
-                    with open(base, 'w', encoding='utf-8') as file:
-                        file.write(content)
+                    quota = self.checkDriveQuota(uid, len(content.encode('utf-8')) - os.path.getsize(base))
+                    if not quota['ok']:
+                        return quota
+                    dedupStore.writeAtomically(base, content)
+                    self.dirListing.invalidate(base)
+                    self.driveIndex.update(base)
                     return utils.makeResult(True, "success")
                 else:
                     return utils.makeResult(False, f"not a file: {path}")
@@ -374,8 +781,11 @@ class dataManager:
     def queryUser(self, uid: int):
         try:
             d = self.db.query(
-                "select id, name, slogan, level from users where id = ?", (uid, ), one=True)
+                "select id, name, slogan, level, avatarHash, headImageHash, driveQuota from users where id = ?", (uid, ), one=True)
             if d is not None:
+                quota = d.pop('driveQuota')
+                d['usage'] = self.driveUsage.query(uid)
+                d['usage']['quota'] = quota if quota is not None else utils.catchError(self.logger(), self.getXmsDriveQuota())
                 return utils.makeResult(True, d)
             else:
                 return utils.makeResult(False, "user not found")
@@ -387,10 +797,17 @@ class dataManager:
             return utils.makeResult(False, "user not exist")
         else:
             self.deleteUserDrive(uid)
-            self.db.query("delete from users where id = ?", (uid, ))
+            self.db.execute("delete from users where id = ?", (uid, ))
+            self.db.execute("delete from driveUsage where owner = ?", (uid, ))
+            self.invalidateCache()
             return utils.makeResult(True, "success")
 
     def checkIfUserExistById(self, uid: int):
+        if uid in self._userDrivePaths:
+            self._countCacheLookup(True)
+            return uid
+
+        self._countCacheLookup(False)
         try:
             d = self.db.query(
                 "select id from users where id = ?", (uid, ), one=True)
@@ -410,42 +827,50 @@ class dataManager:
         except sqlite3.Error as e:
             return None
 
-    def getUserAvatar(self, uid: int):
+    def getUserAvatar(self, uid: int, size: int = None):
         try:
             d = self.db.query(
-                "select avatar, avatarMime from users where id = ?", (uid, ), one=True)
-
+                "select avatarHash from users where id = ?", (uid, ), one=True)
             if d is not None:
-                return utils.makeResult(True, d)
+                path, mime = self.userImages.resolve(d['avatarHash'], size)
+                return utils.makeResult(True, {"path": path, "mime": mime, "hash": d['avatarHash']})
             else:
                 return utils.makeResult(False, "user not found")
-        except sqlite3.Error as e:
+        except (sqlite3.Error, RuntimeError) as e:
             return utils.makeResult(False, str(e))
 
-    def getUserHeadImage(self, uid: int):
+    def getUserHeadImage(self, uid: int, size: int = None):
         try:
             d = self.db.query(
-                "select headImage, headImageMime from users where id = ?", (uid, ), one=True)
+                "select headImageHash from users where id = ?", (uid, ), one=True)
             if d is not None:
-                return utils.makeResult(True, d)
+                path, mime = self.userImages.resolve(d['headImageHash'], size)
+                return utils.makeResult(True, {"path": path, "mime": mime, "hash": d['headImageHash']})
             else:
                 return utils.makeResult(False, "user not found")
-        except sqlite3.Error as e:
+        except (sqlite3.Error, RuntimeError) as e:
+            return utils.makeResult(False, str(e))
+
+    def getUserImage(self, digest: str, size: int = None):
+        try:
+            path, mime = self.userImages.resolve(digest, size)
+            return utils.makeResult(True, {"path": path, "mime": mime})
+        except RuntimeError as e:
             return utils.makeResult(False, str(e))
 
     def updateUserUsername(self, uid: int, newUserName: str):
         try:
-            d = self.db.query(
+            self.db.execute(
                 "update users set name = ? where id = ?", (newUserName, uid))
-            return utils.makeResult(True, d)
+            return utils.makeResult(True, "success")
         except sqlite3.Error as e:
             return utils.makeResult(False, str(e))
 
     def updateUserSlogan(self, uid: int, newSlogan: str):
         try:
-            d = self.db.query(
+            self.db.execute(
                 "update users set slogan = ? where id = ?", (newSlogan, uid))
-            return utils.makeResult(True, d)
+            return utils.makeResult(True, "success")
         except sqlite3.Error as e:
             return utils.makeResult(False, str(e))
 
@@ -465,30 +890,39 @@ class dataManager:
         if d['ok']:
             if d['data'] != utils.makePasswordMd5(oldPwd):
                 return utils.makeResult(False, "old password not match")
-            self.db.query("update users set passwordMd5 = ? where id = ?",
-                          (utils.makePasswordMd5(newPwd), uid))
+            self.db.execute("update users set passwordMd5 = ? where id = ?",
+                            (utils.makePasswordMd5(newPwd), uid))
             return utils.makeResult(True, "success")
         else:
             return utils.makeResult(False, "user not exist")
 
-    def updateUserAvatar(self, uid: int, avatar: bytes, mime: str):
+    def updateUserAvatar(self, uid: int, avatar: bytes):
         uid = self.checkIfUserExistById(uid)
         if uid is not None:
+            # the type is sniffed from the bytes, the client supplied one is not trusted
+            mime = utils.detectImageMime(avatar)
+            if mime == 'application/octet-stream':
+                return utils.makeResult(False, "unsupported image format")
             try:
-                self.db.query(
-                    "update users set avatar = ?, avatarMime = ? where id = ?", (avatar, mime, uid))
+                self.db.execute(
+                    "update users set avatarHash = ?, avatarMime = ? where id = ?",
+                    (self.userImages.store(avatar), mime, uid))
                 return utils.makeResult(True, "success")
-            except sqlite3.Error as e:
+            except (sqlite3.Error, OSError) as e:
                 return utils.makeResult(False, str(e))
 
-    def updateUserHeadImage(self, uid: int, headImage: bytes, mime: str):
+    def updateUserHeadImage(self, uid: int, headImage: bytes):
         uid = self.checkIfUserExistById(uid)
         if uid is not None:
+            mime = utils.detectImageMime(headImage)
+            if mime == 'application/octet-stream':
+                return utils.makeResult(False, "unsupported image format")
             try:
-                self.db.query(
-                    "update users set headImage = ?, headImageMime = ? where id = ?", (headImage, mime, uid))
+                self.db.execute(
+                    "update users set headImageHash = ?, headImageMime = ? where id = ?",
+                    (self.userImages.store(headImage), mime, uid))
                 return utils.makeResult(True, "success")
-            except sqlite3.Error as e:
+            except (sqlite3.Error, OSError) as e:
                 return utils.makeResult(False, str(e))
 
     def vertifyUserLogin(self, username: str, password: str):
@@ -521,28 +955,31 @@ class dataManager:
 
     def queryUserOwnTaskList(self, uid: int):
         data = self.db.query(
-            "select id, name, plugin, handler, creationTime, endTime from taskList where owner = ? order by id desc", (uid, ))
+            "select id, name, plugin, handler, state, priority, creationTime, startTime, endTime from taskList where owner = ? order by id desc", (uid, ))
         return utils.makeResult(True, data)
 
-    def queryPlaylistArtwork(self, playlistId: int):
+    def queryDefaultArtwork(self, size: int = None):
+        blobPath = utils.catchError(self.logger(), self.getXmsBlobPath())
+        try:
+            path, mime = self.artwork.resolve(
+                self.artwork.storeFile(f'{blobPath}/defaultArtwork.png'), size)
+        except (OSError, RuntimeError) as e:
+            return utils.makeResult(False, str(e))
+        return utils.makeResult(True, {"path": path, "mime": mime})
+
+    def queryPlaylistArtwork(self, playlistId: int, size: int = None):
         data = self.db.query(
             "select id from songlist where playlistId = ? order by sortId desc limit ?", (playlistId, 1), one=True)
-        blobPath = utils.catchError(self.logger(), self.getXmsBlobPath())
         if data == None:
-            with open(f'{blobPath}/defaultArtwork.png', 'rb') as default:
-                return utils.makeResult(True, {"artwork": default.read(), "mime": "image/png"})
-        return self.querySongArtworkFromPlaylist(data['id'])
+            return self.queryDefaultArtwork(size)
+        return self.querySongArtworkFromPlaylist(data['id'], size)
 
     def createUserPlaylist(self, uid: int, name: str, description: str):
         if self.checkUserPlaylistIfExistByPlaylistName(uid, name) is not None:
             return utils.makeResult(False, "playlist with the same playlist name already exists")
         if self.checkIfUserExistById(uid) is not None:
-            self.db.query("insert into playlists (name, owner, description, creationDate) values (?, ?, ?, ?)",
-                          (name, uid, description, getCurrentTime()))
-
-            playlistId = self.checkUserPlaylistIfExistByPlaylistName(uid, name)
-            data = self.queryUserOwnPlaylists(uid)
-            data.append(playlistId)
+            playlistId = self.db.executeInsert("insert into playlists (name, owner, description, creationDate) values (?, ?, ?, ?)",
+                                               (name, uid, description, getCurrentTime()))
             return utils.makeResult(True, playlistId)
         else:
             return utils.makeResult(False, "user not exist")
@@ -552,7 +989,7 @@ class dataManager:
         if data is None:
             return utils.makeResult(False, "playlist not exist")
         else:
-            self.db.query("delete from playlists where id = ?", (id, ))
+            self.db.execute("delete from playlists where id = ?", (id, ))
             return utils.makeResult(True, "success")
 
     def checkIfSongExistInPlaylistByPath(self, playlistId: int, songPath: str):
@@ -560,39 +997,47 @@ class dataManager:
         if data is None:
             return utils.makeResult(False, "playlist not exist")
 
-        return self.db.query("select id from songlist where path = ? and playlistId = ?", (songPath, playlistId), one=True)
+        fileId = self.fileTree.lookup(data['owner'], songPath)
+        if fileId is None:
+            return None
+        return self.db.query("select id from songlist where fileId = ? and playlistId = ?", (fileId, playlistId), one=True)
 
     def checkIfSongExistInPlaylistById(self, playlistId: int, songId: int):
         data = self.checkUserPlaylistIfExistByPlaylistId(playlistId)
         if data is None:
             return utils.makeResult(False, "playlist not exist")
 
-        return self.db.query("select * from songlist where id = ?", (songId, ), one=True)
+        data = self.db.query("select * from songlist where id = ?", (songId, ), one=True)
+        if data is None:
+            return None
+        data = self.fileTree.withPaths([data])
+        return data[0] if data else None
 
     def getPlaylistSongsCount(self, playlistId: int):
         return self.db.query("select count(1) as count from songlist where playlistId = ?", (playlistId, ), one=True)['count']
 
     def increasePlaylistPlayCount(self, playlistId: int):
-        if self.checkUserPlaylistIfExistByPlaylistId(playlistId) is None:
+        data = self.checkUserPlaylistIfExistByPlaylistId(playlistId)
+        if data is None:
             return utils.makeResult(False, "playlist not exist")
-        
-        self.db.query("update playlists set playCount = ? where id = ?", (self.db.query("select playCount from playlists where id = ?", (playlistId, ), one=True)['playCount']+1, playlistId))
+
+        self.playCounter.increasePlaylist(data['id'])
         return utils.makeResult(True, "success")
 
     def increaseSongPlayCount(self, uid: int, songId: int):
         if self.checkIfUserExistById(uid) is None:
             return utils.makeResult(False, "user not exist")
-        
-        data = self.querySongFromPlaylist(songId)
-        
-        if data["ok"]:
-            print(data)
-            plays = self.db.query("select plays from playCount where path = ? and owner = ?", (data["data"]["path"], uid), one=True)["plays"]
-            plays += 1
-            self.db.query("update playCount set plays = ? where path = ? and owner = ?", (plays, data["data"]["path"], uid))
-            return utils.makeResult(True, "success")
-        
-        return utils.makeResult(False, "song not exist")
+
+        # plays are counted in the owner's own playlists only, the file belongs to their drive
+        data = self.db.query(
+            "select s.fileId, p.owner from songlist s join playlists p on p.id = s.playlistId where s.id = ?", (songId, ), one=True)
+        if data is None:
+            return utils.makeResult(False, "song not exist")
+        if data['owner'] != uid:
+            return utils.makeResult(False, "permission denied")
+
+        self.playCounter.increaseSong(uid, data['fileId'])
+        return utils.makeResult(True, "success")
     
     def insertSongToPlaylist(self, playlistId: int, songPath: str):
         data = self.checkUserPlaylistIfExistByPlaylistId(playlistId)
@@ -603,14 +1048,15 @@ class dataManager:
             return utils.makeResult(False, "the song has already been in the playlist")
 
         sortId = self.db.query('select sortId from songlist order by sortId desc limit 1', one=True)
-        self.db.query(
-            "insert into songlist (path, playlistId, sortId) values (?, ?, ?)", (songPath, playlistId, sortId['sortId'] + 1 if sortId is not None else 0))
-        if len(self.db.query('select 1 from playCount where path = ?', (songPath, ))) == 0:
-            self.db.query(
-                "insert into playCount (path, owner) values (?, ?)", (songPath, data['owner']))
 
-        return utils.makeResult(
-            True, self.checkIfSongExistInPlaylistByPath(playlistId, songPath)['id'])
+        def insert(conn):
+            fileId = self.fileTree.ensure(conn, data['owner'], songPath)
+            conn.execute(
+                "insert into playCount (fileId, owner) values (?, ?) on conflict (fileId, owner) do nothing", (fileId, data['owner']))
+            return conn.execute(
+                "insert into songlist (fileId, playlistId, sortId) values (?, ?, ?)", (fileId, playlistId, sortId['sortId'] + 1 if sortId is not None else 0)).lastrowid
+
+        return utils.makeResult(True, self.db.transaction(insert))
 
     def deleteSongFromPlaylist(self, playlistId: int, songId: int):
         data = self.checkUserPlaylistIfExistByPlaylistId(playlistId)
@@ -620,7 +1066,7 @@ class dataManager:
         if self.checkIfSongExistInPlaylistById(playlistId, songId) is None:
             return utils.makeResult(False, "the song isn't in the playlist")
 
-        self.db.query("delete from songlist where id = ?", (songId, ))
+        self.db.execute("delete from songlist where id = ?", (songId, ))
         return utils.makeResult(True, "success")
 
     def queryUserPlaylistSongs(self, playlistId: int):
@@ -628,59 +1074,54 @@ class dataManager:
         if data is None:
             return utils.makeResult(False, "playlist not exist")
 
-        songs = self.db.query(
-            "select * from songlist where playlistId = ? order by sortId desc", (playlistId, ))
+        songs = self.fileTree.withPaths(self.db.query(
+            "select * from songlist where playlistId = ? order by sortId desc", (playlistId, )))
 
+        base = utils.catchError(self.logger(), self.getUserDrivePath(data['owner']))
+        infos = self.songMetadata.getMany([f"{base}/{i['path']}" for i in songs])
         for i in songs:
-            try:
-                i['info'] = utils.getSongInfo(utils.catchError(
-                    self.logger(), self.queryFileRealpath(data['owner'], i['path']))['path'])
-            except RuntimeError:
-                i['info'] = {
-                    'title': '',  
-                    'album': '',  
-                    'artist': '',  
-                    'composer': '',
-                    'length': 0
-                }
+            info = infos[f"{base}/{i['path']}"]
+            i['info'] = info if info is not None else emptySongInfo()
 
         return utils.makeResult(True, songs)
 
     def querySongFromPlaylist(self, songId: int):
         data = self.db.query(
-            "select path, playlistId, sortId from songlist where id = ?", (songId, ), one=True)
+            "select fileId, playlistId, sortId from songlist where id = ?", (songId, ), one=True)
 
-        if data is None:
+        if data is None or not self.fileTree.withPaths([data]):
             return utils.makeResult(False, "song not exist")
 
         playlist = self.queryUserPlaylistInfo(
             data['playlistId'])['data']
 
-        songInfo = utils.getSongInfo(utils.catchError(
+        songInfo = self.songMetadata.get(utils.catchError(
             self.logger(), self.queryFileRealpath(playlist['owner'], data['path']))['path'])
         songInfo['owner'] = playlist['owner']
         songInfo['path'] = data['path']
 
         return utils.makeResult(True, songInfo)
 
-    def querySongArtworkFromPlaylist(self, songId: int):
+    def querySongArtworkFromPlaylist(self, songId: int, size: int = None):
         data = self.db.query(
-            "select path, playlistId from songlist where id = ?", (songId, ), one=True)
-        if data is None:
+            "select songlist.fileId, playlists.owner from songlist join playlists on playlists.id = songlist.playlistId where songlist.id = ?",
+            (songId, ), one=True)
+        if data is None or not self.fileTree.withPaths([data]):
             return utils.makeResult(False, "song not exist")
 
-        playlist = self.queryUserPlaylistInfo(
-            data['playlistId'])['data']
-
         try:
-            return utils.makeResult(True, utils.getSongArtwork(utils.catchError(
-                self.logger(), self.queryFileRealpath(playlist['owner'], data['path']))['path']))
-        except Exception as e:
-            print(e)
-            blobPath = utils.catchError(self.logger(), self.getXmsBlobPath())
-
-            with open(f'{blobPath}/defaultArtwork.png', 'rb') as default:
-                return utils.makeResult(True, {"artwork": default.read(), "mime": "image/png"})
+            digest = self.artwork.forSong(utils.catchError(
+                self.logger(), self.queryFileRealpath(data['owner'], data['path']))['path'])
+        except OSError:
+            digest = None
+
+        result = self.artwork.resolve(digest, size) if digest is not None else None
+        if result is None:
+            result = self.queryDefaultArtwork(size)
+            if not result['ok']:
+                return result
+            result = (result['data']['path'], result['data']['mime'])
+        return utils.makeResult(True, {"owner": data['owner'], "path": result[0], "mime": result[1]})
 
     def updatePlaylistInfo(self, playlistId: int, uid: int, name: str, description: str):
         data = self.checkUserPlaylistIfExistByPlaylistId(playlistId)
@@ -689,8 +1130,8 @@ class dataManager:
         elif data['owner'] != uid:
             return utils.makeResult(False, "user isn't the owner of the playlist")
 
-        self.db.query("update playlists set name = ?, description = ? where id = ?",
-                      (name, description, playlistId, ))
+        self.db.execute("update playlists set name = ?, description = ? where id = ?",
+                        (name, description, playlistId, ))
 
         return utils.makeResult(True, "success")
 
@@ -713,10 +1154,10 @@ class dataManager:
         elif destData is None:
             return utils.makeResult(False, f'SongId({src}) not exist')
 
-        self.db.query("update songlist set sortId = ? where id = ?",
-                      (destData['sortId'], srcData['id']))
-        self.db.query("update songlist set sortId = ? where id = ?",
-                      (srcData['sortId'], destData['id']))
+        self.db.execute("update songlist set sortId = ? where id = ?",
+                        (destData['sortId'], srcData['id']))
+        self.db.execute("update songlist set sortId = ? where id = ?",
+                        (srcData['sortId'], destData['id']))
 
         return utils.makeResult(True, "success")
 
@@ -725,16 +1166,17 @@ class dataManager:
         if not rpath['ok']:
             return rpath
 
+        fileId = self.fileTree.lookup(uid, path)
         test = self.db.query(
-            "select id from shareLinksList where owner = ? and path = ?", (uid, path), one=True)
+            "select id from shareLinksList where owner = ? and fileId = ?", (uid, fileId), one=True) if fileId is not None else None
         if test is not None:
             return utils.makeResult(True, test['id'])
 
         rpath = f"{rpath['data']}/{path}"
         if os.access(rpath, os.F_OK):
             linkId = utils.getRandom10CharString(uid)
-            self.db.query(
-                "insert into shareLinksList (id, path, owner) values (?, ?, ?)", (linkId, path, uid))
+            self.db.transaction(lambda conn: conn.execute(
+                "insert into shareLinksList (id, fileId, owner) values (?, ?, ?)", (linkId, self.fileTree.ensure(conn, uid, path), uid)))
             return utils.makeResult(True, linkId)
         else:
             return utils.makeResult(False, "path not exist")
@@ -743,7 +1185,7 @@ class dataManager:
         data = self.db.query(
             "select * from shareLinksList where id = ?", (linkId, ), one=True)
 
-        if data is None:
+        if data is None or not self.fileTree.withPaths([data]):
             return utils.makeResult(False, "share link not exist")
 
         rpath = self.getUserDrivePath(data['owner'])
@@ -759,8 +1201,8 @@ class dataManager:
             return utils.makeResult(True, data)
 
     def queryUserShareLinks(self, uid: int):
-        data = self.db.query(
-            "select * from shareLinksList where owner = ?", (uid, ))
+        data = self.fileTree.withPaths(self.db.query(
+            "select * from shareLinksList where owner = ?", (uid, )))
         return utils.makeResult(True, data)
 
     def deleteShareLink(self, uid: int, linkId: str):
@@ -769,7 +1211,7 @@ class dataManager:
             return data
         if data['data']['owner']['id'] != uid:
             return utils.makeResult(False, "user isn't the owner of the share link")
-        self.db.query(
+        self.db.execute(
             "delete from shareLinksList where id = ?", (linkId, ))
         return utils.makeResult(True, "success")
 
@@ -782,14 +1224,14 @@ class dataManager:
         data = self.queryFileRealpath(data['owner']['id'], data['path'])
         return data
 
-    def queryShareLinkDirInfo(self, linkId: str, path: str):
+    def queryShareLinkDirInfo(self, linkId: str, path: str, sort: str = 'name', order: str = 'asc', limit: int = None, cursor: str = None):
         data = self.queryShareLink(linkId)
         if not data['ok']:
             return data
 
         data = data['data']
         l = self.getUserDriveDirInfo(
-            data['owner']['id'], f"{data['path']}/{path}")
+            data['owner']['id'], f"{data['path']}/{path}", sort, order, limit, cursor)
         if not l['ok']:
             return l
 
@@ -807,6 +1249,37 @@ class dataManager:
 
         return l
 
+    def searchUserDrive(self, uid: int, query: str, family: str, offset: int, limit: int):
+        try:
+            return utils.makeResult(True, self.driveIndex.search(uid, query, family, offset, limit))
+        except ValueError as e:
+            return utils.makeResult(False, f"invalid request: {str(e)}")
+        except sqlite3.Error as e:
+            return utils.makeResult(False, str(e))
+
+    def applyDriveEvents(self, conn, events: list):
+        # songs, play counts and share links follow entries removed or renamed by a batch or outside the api
+        for i in events:
+            if i['type'] == 'removed':
+                self.fileTree.remove(conn, i['owner'], i['path'])
+            elif i['type'] == 'renamed':
+                self.fileTree.move(conn, i['owner'], i['path'], i['newPath'])
+
+    def invalidateDriveEvents(self, events: list):
+        for i in events:
+            for path in [i['path'], i.get('newPath')]:
+                if path is not None:
+                    realPath = self.driveIndex.realPath(i['owner'], path)
+                    self.songMetadata.invalidate(realPath)
+                    self.artwork.invalidate(realPath)
+                    self.dirListing.invalidate(realPath)
+
+    def rebuildDriveIndex(self, uid: int = None):
+        try:
+            return utils.makeResult(True, self.driveIndex.rebuild(uid))
+        except OSError as e:
+            return utils.makeResult(False, str(e))
+
     def queryShareLinkDirFileRealpath(self, linkId: str, path: str):
         data = self.queryShareLink(linkId)
         if not data['ok']:
@@ -823,15 +1296,23 @@ class dataManager:
             plugins.append({'name': i, 'info': self.plugins[i]['info']})
         return utils.makeResult(True, plugins)
 
-    def queryTask(self, taskId: int):
+    def queryTask(self, taskId: int, since: int = None):
         data = self.db.query(
             "select * from taskList where id = ?", (taskId, ), one=True)
         if data is None:
             return utils.makeResult(False, "task not exist")
+
+        # with since, only the log lines numbered since onwards instead of the whole text
+        if since is not None:
+            del data['logText']
+            data['log'] = self.taskLogs.read(taskId, since)
         else:
-            return utils.makeResult(True, data)
+            text = self.taskLogs.text(taskId)
+            if text is not None:
+                data['logText'] = text
+        return utils.makeResult(True, data)
 
-    def createTask(self, uid: int, name: str, plugin: str, handler: str, args: list):
+    def createTask(self, uid: int, name: str, plugin: str, handler: str, args: list, priority: int = 0):
         if plugin not in self.plugins:
             return utils.makeResult(False, "plugin not exist")
 
@@ -842,20 +1323,78 @@ class dataManager:
         if user['data']['level'] < self.plugins[plugin]['info']['avaliablepermissionLevel']:
             return utils.makeResult(False, "user's permission level is lower than requirement")
 
-        taskId = self.db.query(
-            'insert into taskList (owner, name, plugin, handler, args, creationTime) values (?, ?, ?, ?, ?, ?)',
-            (uid, name, plugin, handler, json.dumps(args), getCurrentTime()))
+        if not hasattr(self.plugins[plugin]['handlers'], handler):
+            return utils.makeResult(False, "specified handler not exist")
+
+        # only administrators can jump the queue
+        priority = max(-10, min(priority, 10 if user['data']['level'] == 2 else 0))
+        taskId = self.db.executeInsert(
+            'insert into taskList (owner, name, plugin, handler, args, creationTime, state, priority) values (?, ?, ?, ?, ?, ?, ?, ?)',
+            (uid, name, plugin, handler, json.dumps(args), getCurrentTime(), 'queued', priority))
+        self.submitTask(taskId, uid, plugin, handler, args, priority)
+        return utils.makeResult(True, taskId)
+
+    def submitTask(self, taskId: int, uid: int, plugin: str, handler: str, args: list, priority: int):
+        handlerCallable = getattr(self.plugins[plugin]['handlers'], handler)
+        taskInfo = self.taskInfo(self.db, taskId, self.taskLogs)
+        self.taskExecutor.submit({
+            'id': taskId,
+            'owner': uid,
+            'plugin': plugin,
+            'priority': priority,
+            'taskInfo': taskInfo,
+            'run': lambda: handlerCallable(self, taskInfo, args)
+        })
+
+    def followTaskState(self, taskId: int, state: str):
+        # the log of a finished task is written out once its final state is committed
+        self.taskLogs.setState(taskId, state)
+        if state in taskStream.finalStates:
+            self.taskLogs.finish(taskId)
+
+    def queryTaskState(self, taskId: int):
+        return self.db.query("select owner, state from taskList where id = ?", (taskId, ), one=True)
+
+    def streamTask(self, taskId: int, cursor: int = 0):
+        def queryState(taskId):
+            data = self.queryTaskState(taskId)
+            return data['state'] if data is not None else None
+
         try:
-            handlerCallable = self.plugins[plugin]['handlers'].__getattribute__(
-                handler)
-            threading.Thread(
-                target=handlerCallable, args=(self, self.taskInfo(self.db, taskId), args)).start()
+            yield from taskStream.followTask(self.taskLogs, queryState, taskId, cursor)
+        finally:
+            # streamed after the request was torn down, the connection is ours to give back
+            self.db.release()
+
+    def resumeTasks(self):
+        # queued tasks wait for a worker again, the ones a restart interrupted are failed
+        interrupted = 0
+        for i in self.db.query("select id from taskList where state = 'running'"):
+            if not self.taskExecutor.contains(i['id']):
+                interrupted += self.db.execute(
+                    "update taskList set state = 'failed', endTime = ? where id = ?", (getCurrentTime(), i['id']))
+        resumed = 0
+        for i in self.db.query("select * from taskList where state = 'queued' order by id"):
+            if self.taskExecutor.contains(i['id']):
+                continue
+            if i['plugin'] not in self.plugins or not hasattr(self.plugins[i['plugin']]['handlers'], i['handler']):
+                self.db.execute("update taskList set state = 'failed', endTime = ? where id = ?", (getCurrentTime(), i['id']))
+                continue
+            self.submitTask(i['id'], i['owner'], i['plugin'], i['handler'], json.loads(i['args']), i['priority'])
+            resumed += 1
+        return utils.makeResult(True, {'resumed': resumed, 'interrupted': interrupted})
+
+    def cancelTask(self, uid: int, taskId: int):
+        task = self.queryTask(taskId)
+        if not task['ok']:
+            return task
 
-            return utils.makeResult(True, taskId)
-        except AttributeError:
-            return utils.makeResult(False, "specified handler not exist")
-        except TypeError:
-            return utils.makeResult(False, "invalid task arguments")
+        if task['data']['owner'] != uid:
+            return utils.makeResult(False, "user isn't the owner of this task")
+
+        if not self.taskExecutor.cancel(taskId):
+            return utils.makeResult(False, f"task is already {task['data']['state']}")
+        return utils.makeResult(True, "success")
 
     def deleteTask(self, uid: int, taskId: int):
         task = self.queryTask(taskId)
@@ -863,19 +1402,53 @@ class dataManager:
             return task
 
         if task['data']['owner'] != uid:
-            return utils.makeResult("user isn't the owner of this task")
+            return utils.makeResult(False, "user isn't the owner of this task")
 
-        self.db.query("delete from taskList where id = ?", (taskId, ))
+        self.taskExecutor.cancel(taskId)
+        self.db.execute("delete from taskList where id = ?", (taskId, ))
+        self.taskLogs.discard(taskId)
 
         return utils.makeResult(True, "success")
 
     def getUserList(self):
-        return utils.makeResult(True, self.db.query("select id, name, slogan, level from users"))
+        return utils.makeResult(True, self.db.query("select id, name, slogan, level, avatarHash, headImageHash from users"))
+
+    def checkDriveQuota(self, uid: int, incoming: int):
+        # incoming is the number of bytes a write is about to add
+        d = self.db.query("select driveQuota from users where id = ?", (uid, ), one=True)
+        if d is None:
+            return utils.makeResult(False, "user not exist")
+        quota = d['driveQuota'] if d['driveQuota'] is not None else utils.catchError(self.logger(), self.getXmsDriveQuota())
+        used = self.driveUsage.query(uid)['bytes']
+        if quota and used + max(incoming, 0) > quota:
+            return utils.makeResult(False, f"drive quota exceeded: {used} of {quota} bytes used, {incoming} more requested")
+        return utils.makeResult(True, {"used": used, "quota": quota})
+
+    def updateUserDriveQuota(self, uid: int, quota):
+        # None falls back to the default quota in the config
+        if self.checkIfUserExistById(uid) is None:
+            return utils.makeResult(False, "user not exist")
+        self.db.execute("update users set driveQuota = ? where id = ?", (quota, uid))
+        return utils.makeResult(True, "success")
+
+    def queryDriveUsageOverview(self):
+        default = utils.catchError(self.logger(), self.getXmsDriveQuota())
+        data = self.db.query("""
+            select users.id, users.name, coalesce(driveUsage.bytes, 0) as bytes, coalesce(driveUsage.files, 0) as files,
+                coalesce(users.driveQuota, ?) as quota, driveUsage.verifiedTime from users
+            left join driveUsage on driveUsage.owner = users.id order by bytes desc
+        """, (default, ))
+        return utils.makeResult(True, {"list": data, "total": sum(i['bytes'] for i in data), "verifier": self.driveUsage.queryStats()})
+
+    def startDriveUsageVerify(self):
+        if not self.driveUsage.startVerify():
+            return utils.makeResult(False, "a usage verification is already running")
+        return utils.makeResult(True, "started")
 
     def updateUserPermissionLevel(self, uid, newLevel):
         if self.checkIfUserExistById(uid) is not None:
-            self.db.query("update users set level = ? where id = ?",
-                          (newLevel, uid), one=True)
+            self.db.execute("update users set level = ? where id = ?",
+                            (newLevel, uid))
             return utils.makeResult(True, "success")
         else:
             return utils.makeResult(False, "user not exist")
@@ -883,10 +1456,60 @@ class dataManager:
 
     def queryMusicStatistics(self, uid):
         if self.checkIfUserExistById(uid) is not None:
-            raw = self.db.query('select * from playCount where owner = ? and plays != 0 order by plays desc limit 100', (uid, ))
+            raw = self.fileTree.withPaths(self.db.query(
+                'select * from playCount where owner = ? and plays != 0 order by plays desc limit 100', (uid, )))
+            base = utils.catchError(self.logger(), self.getUserDrivePath(uid))
+            infos = self.songMetadata.getMany([f"{base}/{i['path']}" for i in raw])
             for i in raw:
-                i['info'] = utils.getSongInfo(utils.catchError(
-                    self.logger(), self.queryFileRealpath(uid, i['path']))['path'])
+                info = infos[f"{base}/{i['path']}"]
+                i['info'] = info if info is not None else emptySongInfo()
             return utils.makeResult(True, raw)
         else:
-            return utils.makeResult(False, "user not exist")
\ No newline at end of file
+            return utils.makeResult(False, "user not exist")
+
+    def startMusicLibraryScan(self, uid: int):
+        base = self.getUserDrivePath(uid)
+        if not base['ok']:
+            return base
+
+        if not self.libraryScanner.start(uid, base['data']):
+            return utils.makeResult(False, "library scan is already running")
+        return utils.makeResult(True, self.libraryScanner.queryState(uid))
+
+    def queryMusicLibraryScanState(self, uid: int):
+        return utils.makeResult(True, self.libraryScanner.queryState(uid))
+
+    def browseMusicLibrary(self, uid: int, field: str, offset: int, limit: int):
+        if field not in ('artist', 'album', 'composer'):
+            return utils.makeResult(False, f"unable to browse by {field}")
+
+        data = self.db.query(
+            f"select {field} as name, count(1) as songs from musicLibrary where owner = ? group by {field} order by {field} limit ? offset ?",
+            (uid, limit, offset))
+        total = self.db.query(
+            f"select count(distinct {field}) as total from musicLibrary where owner = ?", (uid, ), one=True)['total']
+        return utils.makeResult(True, {"list": data, "total": total})
+
+    def queryMusicLibrarySongs(self, uid: int, filters: dict, offset: int, limit: int):
+        conditions = ['owner = ?']
+        args = [uid]
+        for i in filters:
+            if i not in ('artist', 'album', 'title', 'composer'):
+                return utils.makeResult(False, f"unable to filter by {i}")
+            conditions.append(f"{i} = ?")
+            args.append(filters[i])
+
+        data = self.db.query(
+            f"select id, path, title, album, artist, composer, length from musicLibrary where {' and '.join(conditions)} order by artist, album, title limit ? offset ?",
+            (*args, limit, offset))
+        return utils.makeResult(True, data)
+
+    def searchMusicLibrary(self, uid: int, field: str, prefix: str, offset: int, limit: int):
+        if field not in ('artist', 'album', 'title', 'composer'):
+            return utils.makeResult(False, f"unable to search by {field}")
+
+        pattern = prefix.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+        data = self.db.query(
+            f"select id, path, title, album, artist, composer, length from musicLibrary where owner = ? and {field} like ? escape '\\' order by {field}, title limit ? offset ?",
+            (uid, pattern, limit, offset))
+        return utils.makeResult(True, data)
@@ -0,0 +1,330 @@
+import atexit
+import logging
+import queue
+import sqlite3
+import threading
+import time
+import weakref
+from concurrent.futures import Future
+
+
+def materialize(cur, one=False):
+    # resolve the column names once per statement instead of once per row
+    if cur.description is None:
+        return None if one else []
+    columns = [i[0] for i in cur.description]
+    if one:
+        row = cur.fetchone()
+        return dict(zip(columns, row)) if row is not None else None
+    return [dict(zip(columns, row)) for row in cur]
+
+
+# a bounded pool of sqlite3 read connections running in WAL mode, plus a single writer thread.
+# each thread borrows a read connection on its first query and keeps it until release() is called
+# at the end of a request or task. writes from every thread are queued to the writer, which runs
+# them on its own connection and commits whatever is queued as one group, bounded by commitInterval
+# and commitBatchSize.
+# a write returns once its group has been committed, and raises if the commit failed.
+class databaseObject:
+    def __init__(self, dbPath: str, poolSize: int = 32, busyTimeout: float = 30,
+                 commitInterval: float = 0.005, commitBatchSize: int = 256) -> None:
+        self.dbPath = dbPath
+        self.poolSize = poolSize
+        self.busyTimeout = busyTimeout
+        self.commitInterval = commitInterval
+        self.commitBatchSize = commitBatchSize
+        self._logger = logging.getLogger("databaseObject")
+        self._local = threading.local()
+        self._lock = threading.Condition()
+        self._idle = []
+        self._owners = {}
+        self._created = 0
+
+        self._writes = queue.Queue()
+        self._writer = None
+        self._writerLock = threading.Lock()
+        self._submittedSeq = 0
+        self._committedSeq = 0
+        atexit.register(self.close)
+
+    def _connect(self, readOnly: bool = False):
+        conn = sqlite3.connect(
+            self.dbPath, check_same_thread=False, timeout=self.busyTimeout, isolation_level=None)
+        conn.execute("pragma journal_mode = wal")
+        conn.execute("pragma synchronous = normal")
+        if readOnly:
+            # whatever slips past query()'s routing fails instead of writing around the writer
+            conn.execute("pragma query_only = on")
+        return conn
+
+    def _reclaim(self):
+        # hand back connections whose threads exited without releasing them
+        for conn, owner in list(self._owners.items()):
+            thread = owner()
+            if thread is None or not thread.is_alive():
+                del self._owners[conn]
+                self._idle.append(conn)
+
+    def acquire(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            return conn
+
+        with self._lock:
+            while True:
+                if self._idle:
+                    conn = self._idle.pop()
+                    break
+                if self._created < self.poolSize:
+                    conn = self._connect(readOnly=True)
+                    self._created += 1
+                    break
+                self._reclaim()
+                if not self._idle:
+                    self._lock.wait(1)
+            self._owners[conn] = weakref.ref(threading.current_thread())
+
+        self._local.conn = conn
+        return conn
+
+    def release(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            return
+
+        self._local.conn = None
+        with self._lock:
+            self._owners.pop(conn, None)
+            self._idle.append(conn)
+            self._lock.notify()
+
+    @property
+    def db(self) -> sqlite3.Connection:
+        return self.acquire()
+
+    def _startWriter(self):
+        with self._writerLock:
+            if self._writer is None:
+                self._writer = threading.Thread(
+                    target=self._writerLoop, name="databaseWriter", daemon=True)
+                self._writer.start()
+
+    def _submit(self, kind, fn=None):
+        future = Future()
+        if self._writer is None:
+            self._startWriter()
+        with self._writerLock:
+            self._submittedSeq += 1
+            seq = self._submittedSeq
+            self._writes.put((kind, fn, future, seq))
+        if kind == 'write':
+            self._local.lastWriteSeq = seq
+        return future
+
+    def _commitGroup(self, conn, group):
+        # resolves the group once its commit went through. when the commit fails, for instance on
+        # a deferred constraint, every write of the group runs again in a transaction of its own so
+        # only the writes failing by themselves get an error. returns whether all of them committed
+        try:
+            conn.execute("commit")
+            replay = False
+        except sqlite3.Error as e:
+            self._logger.warning(f"group commit failed, committing its writes one by one: {str(e)}")
+            if conn.in_transaction:
+                conn.execute("rollback")
+            replay = True
+
+        succeeded = True
+        for future, fn, result in group:
+            if replay and fn is not None:
+                try:
+                    conn.execute("begin immediate")
+                    result = fn(conn)
+                    conn.execute("commit")
+                except Exception as e:
+                    if conn.in_transaction:
+                        conn.execute("rollback")
+                    future.set_exception(e)
+                    succeeded = False
+                    continue
+            # flushes come after the writes they wait for, so they resolve once those are done
+            future.set_result(result)
+        group.clear()
+        return succeeded
+
+    def _runJob(self, conn, kind, fn, future, group):
+        # write results and flushes are held in group until the group's commit went through
+        if kind == 'flush':
+            group.append((future, None, None))
+        elif kind == 'read':
+            try:
+                future.set_result(fn(conn))
+            except Exception as e:
+                future.set_exception(e)
+        elif kind == 'script':
+            # executescript() manages its own transaction, so end the current group first
+            self._commitGroup(conn, group)
+            try:
+                future.set_result(conn.executescript(fn))
+            except Exception as e:
+                future.set_exception(e)
+            finally:
+                if not conn.in_transaction:
+                    conn.execute("begin immediate")
+        else:
+            # every job runs in a savepoint so a failing job leaves the rest of the group intact
+            conn.execute("savepoint job")
+            try:
+                result = fn(conn)
+            except Exception as e:
+                conn.execute("rollback to job")
+                conn.execute("release job")
+                future.set_exception(e)
+                return
+            conn.execute("release job")
+            group.append((future, fn, result))
+
+    def _writerLoop(self):
+        conn = self._connect()
+        running = True
+        while running:
+            job = self._writes.get()
+            if job is None:
+                break
+
+            group = []
+            lastSeq = job[3]
+            deadline = time.monotonic() + self.commitInterval
+            try:
+                conn.execute("begin immediate")
+                self._runJob(conn, *job[:3], group)
+                # callers block until the commit, so nothing is gained by waiting on an empty queue.
+                # writes arriving meanwhile form the next group
+                for i in range(self.commitBatchSize - 1):
+                    if time.monotonic() >= deadline:
+                        break
+                    try:
+                        job = self._writes.get_nowait()
+                    except queue.Empty:
+                        break
+                    if job is None:
+                        running = False
+                        break
+                    lastSeq = job[3]
+                    self._runJob(conn, *job[:3], group)
+                committed = self._commitGroup(conn, group)
+            except Exception as e:
+                # the group broke before its commit, nothing of it was committed and every caller
+                # in it gets the error, including the job that was running when it happened
+                self._logger.error(f"group failed: {str(e)}")
+                if conn.in_transaction:
+                    conn.execute("rollback")
+                current = [job[2]] if job is not None else []
+                for i in current + [i for i, _, _ in group]:
+                    if not i.done():
+                        i.set_exception(e)
+                continue
+
+            # a write that failed on its own leaves the sequence behind until the next group
+            if committed:
+                self._committedSeq = lastSeq
+        conn.close()
+
+    def hasPendingWrites(self):
+        return getattr(self._local, 'lastWriteSeq', 0) > self._committedSeq
+
+    def flush(self) -> Future:
+        # resolves once everything submitted so far has been committed
+        if self._submittedSeq <= self._committedSeq:
+            future = Future()
+            future.set_result(None)
+            return future
+        return self._submit('flush')
+
+    def transaction(self, fn):
+        # run fn(connection) atomically on the writer and return its result
+        return self._submit('write', fn).result()
+
+    def _isReadOnly(self, statement: str):
+        # statement is stripped and lowercase. a pragma assigning a value changes the database or
+        # the connection it runs on, a with clause may still lead into a write, see query()
+        if statement.startswith('pragma'):
+            return '=' not in statement
+        return statement.startswith(('select', 'with', 'explain', 'values'))
+
+    def _write(self, statement: str, query, args, one):
+        # legacy callers still write through query()
+        if statement.startswith('insert'):
+            return self.executeInsert(query, args)
+        self.execute(query, args)
+        return None if one else []
+
+    def query(self, query, args=(), one=False):
+        statement = query.lstrip().lower()
+        if not self._isReadOnly(statement):
+            return self._write(statement, query, args, one)
+
+        def run(conn):
+            cur = conn.execute(query, args)
+            try:
+                return materialize(cur, one)
+            finally:
+                cur.close()
+
+        if self.hasPendingWrites():
+            # read through the writer so the thread sees its own uncommitted writes
+            return self._submit('read', run).result()
+        try:
+            return run(self.db)
+        except sqlite3.OperationalError as e:
+            # with ... delete/update/insert only shows itself when the read connection refuses it
+            if statement.startswith('with') and 'readonly' in str(e):
+                return self._write(statement, query, args, one)
+            raise
+
+    def queryIter(self, query, args=(), batchSize=256):
+        if self.hasPendingWrites():
+            yield from self.query(query, args)
+            return
+
+        cur = self.db.execute(query, args)
+        try:
+            columns = [i[0] for i in cur.description]
+            while True:
+                rows = cur.fetchmany(batchSize)
+                if not rows:
+                    break
+                for row in rows:
+                    yield dict(zip(columns, row))
+        finally:
+            cur.close()
+
+    def execute(self, query, args=()):
+        return self.transaction(lambda conn: conn.execute(query, args).rowcount)
+
+    def executeMany(self, query, args):
+        return self.transaction(lambda conn: conn.executemany(query, args).rowcount)
+
+    def executeInsert(self, query, args=()):
+        return self.transaction(lambda conn: conn.execute(query, args).lastrowid)
+
+    def runScript(self, query: str):
+        self._submit('script', query).result()
+        return None
+
+    def close(self):
+        with self._writerLock:
+            writer = self._writer
+            self._writer = None
+            if writer is not None:
+                self._writes.put(None)
+        if writer is not None:
+            writer.join()
+
+        with self._lock:
+            for conn in self._idle + list(self._owners):
+                conn.close()
+            self._idle = []
+            self._owners = {}
+            self._created = 0
+        self._local = threading.local()
@@ -0,0 +1,273 @@
+import concurrent.futures
+import hashlib
+import logging
+import os
+import shutil
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# linux ioctl asking the filesystem (btrfs, xfs, ...) to share the extents of another file
+FICLONE = 0x40049409
+gcInterval = 10 * 60
+
+
+def reflink(path: str, newPath: str):
+    if fcntl is None:
+        return False
+    try:
+        with open(path, 'rb') as src, open(newPath, 'wb') as dst:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        shutil.copystat(path, newPath)
+        return True
+    except OSError:
+        if os.path.exists(newPath):
+            os.remove(newPath)
+        return False
+
+
+def hashFile(path: str):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        while True:
+            data = file.read(1024 * 1024)
+            if not data:
+                break
+            digest.update(data)
+    return digest.hexdigest()
+
+
+def replaceWithLink(target: str, path: str):
+    # atomically points path at target's inode
+    temp = f"{path}.{os.getpid()}.{threading.get_ident()}.link"
+    os.link(target, temp)
+    try:
+        os.replace(temp, path)
+    except OSError:
+        os.remove(temp)
+        raise
+
+
+def replaceWithReflink(target: str, path: str):
+    # points path at a new inode sharing target's extents, keeping path's own mode and times
+    temp = f"{path}.{os.getpid()}.{threading.get_ident()}.reflink"
+    if not reflink(target, temp):
+        return False
+    try:
+        shutil.copystat(path, temp)
+        os.replace(temp, path)
+    except OSError:
+        os.remove(temp)
+        raise
+    return True
+
+
+def writeAtomically(path: str, data):
+    # writes to a new inode and renames it over path, so files sharing the old inode keep their bytes
+    temp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        if isinstance(data, str):
+            with open(temp, 'w', encoding='utf-8') as file:
+                file.write(data)
+        elif isinstance(data, bytes):
+            with open(temp, 'wb') as file:
+                file.write(data)
+        else:
+            data.save(temp)
+        os.replace(temp, path)
+    finally:
+        if os.path.exists(temp):
+            os.remove(temp)
+
+
+# content addressed object store for drive files under <blob path>/objects/<hash[:2]>/<hash>.
+# by default drive files with the same bytes only share extents through reflinks, each keeping
+# its own inode, and nothing is shared on filesystems without them. an object is then only kept
+# until the next collection, duplicates met before that are reflinked to it.
+# with hardlinks allowed (config.driveDedupHardlinks) duplicates become hardlinks of one object
+# and st_nlink is its reference count. files of different drives then are one inode with one
+# mode and mtime, and anything writing a file in place, outside writeAtomically, changes every
+# copy of it. the server itself only ever replaces inodes.
+class dedupStore:
+    def __init__(self, storeRoot, allowHardlinks) -> None:
+        # storeRoot and allowHardlinks are callables, both can change with the config
+        self.storeRoot = storeRoot
+        self.allowHardlinks = allowHardlinks
+        self._logger = logging.getLogger("dedupStore")
+        self._lock = threading.Lock()
+        self._pool = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="dedupStore")
+        self._lastCollection = 0
+        self._scan = {'status': 'idle'}
+        self._stats = {'ingested': 0, 'linked': 0, 'reflinked': 0, 'reflinkedBytes': 0, 'collected': 0}
+
+    def _objectPath(self, digest: str):
+        return f"{self.storeRoot()}/objects/{digest[:2]}/{digest}"
+
+    def _count(self, key: str, value: int = 1):
+        with self._lock:
+            self._stats[key] += value
+
+    def ingest(self, path: str):
+        # returns the size of the duplicate released by sharing path with an existing object
+        st = os.stat(path, follow_symlinks=False)
+        if not os.path.isfile(path) or os.path.islink(path) or st.st_size == 0:
+            return 0
+        digest = hashFile(path)
+        after = os.stat(path, follow_symlinks=False)
+        if (after.st_ino, after.st_mtime_ns, after.st_size) != (st.st_ino, st.st_mtime_ns, st.st_size):
+            # changed while hashing, the next write will bring it back here
+            return 0
+
+        objectPath = self._objectPath(digest)
+        os.makedirs(os.path.dirname(objectPath), exist_ok=True)
+        try:
+            target = os.stat(objectPath)
+        except FileNotFoundError:
+            target = None
+
+        if target is not None and target.st_ino == st.st_ino:
+            return 0
+        hardlinks = self.allowHardlinks()
+        self._count('ingested')
+        if target is None:
+            try:
+                if hardlinks:
+                    os.link(path, objectPath)
+                elif not reflink(path, objectPath):
+                    # no reflinks here, an object would only take space
+                    return 0
+            except FileExistsError:
+                return self.ingest(path)
+            except OSError as e:
+                # the drive lives on another filesystem than the blob path
+                self._logger.warning(f"unable to link {path} into the object store: {str(e)}")
+            return 0
+
+        if hardlinks:
+            replaceWithLink(objectPath, path)
+            self._count('linked')
+        elif replaceWithReflink(objectPath, path):
+            self._count('reflinked')
+            self._count('reflinkedBytes', st.st_size)
+        else:
+            return 0
+        return st.st_size
+
+    def ingestLater(self, path: str):
+        def run():
+            try:
+                self.ingest(path)
+                self.collectGarbage()
+            except OSError as e:
+                self._logger.warning(f"unable to deduplicate {path}: {str(e)}")
+        self._pool.submit(run)
+
+    def ingestTree(self, root: str):
+        reclaimed = 0
+        for dirpath, dirnames, filenames in os.walk(root):
+            for i in filenames:
+                try:
+                    reclaimed += self.ingest(os.path.join(dirpath, i))
+                except OSError as e:
+                    self._logger.warning(f"unable to deduplicate {i}: {str(e)}")
+        self.collectGarbage(force=True)
+        return reclaimed
+
+    def startScan(self, root: str):
+        with self._lock:
+            if self._scan['status'] == 'scanning':
+                return False
+            self._scan = {'status': 'scanning', 'startTime': time.time()}
+
+        def run():
+            try:
+                state = {'status': 'done', 'reclaimedBytes': self.ingestTree(root)}
+            except Exception as e:
+                self._logger.error(f"deduplication scan failed: {str(e)}")
+                state = {'status': 'failed', 'error': str(e)}
+            with self._lock:
+                state['startTime'] = self._scan['startTime']
+                state['endTime'] = time.time()
+                self._scan = state
+
+        threading.Thread(target=run, name="dedupScan", daemon=True).start()
+        return True
+
+    def copyFile(self, path: str, newPath: str):
+        if reflink(path, newPath):
+            self._count('reflinked')
+            self._count('reflinkedBytes', os.path.getsize(newPath))
+            return newPath
+
+        if self.allowHardlinks():
+            self.ingest(path)
+            try:
+                os.link(path, newPath)
+                self._count('linked')
+                return newPath
+            except OSError:
+                pass
+        shutil.copy2(path, newPath)
+        return newPath
+
+    def copy(self, path: str, newPath: str):
+        if os.path.isdir(path):
+            shutil.copytree(path, newPath, copy_function=self.copyFile)
+        else:
+            self.copyFile(path, newPath)
+
+    def collectGarbage(self, force: bool = False):
+        # an object nobody links to anymore has st_nlink == 1, reflinked objects always have,
+        # the extents they share stay with the drive files
+        with self._lock:
+            if not force and time.time() - self._lastCollection < gcInterval:
+                return 0
+            self._lastCollection = time.time()
+
+        collected = 0
+        for dirpath, dirnames, filenames in os.walk(f"{self.storeRoot()}/objects"):
+            for i in filenames:
+                try:
+                    if os.stat(os.path.join(dirpath, i)).st_nlink == 1:
+                        os.remove(os.path.join(dirpath, i))
+                        collected += 1
+                except OSError:
+                    pass
+        self._count('collected', collected)
+        return collected
+
+    def queryStats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['scan'] = dict(self._scan)
+        return stats
+
+    def queryReport(self):
+        objects = 0
+        references = 0
+        storedBytes = 0
+        reclaimedBytes = 0
+        for dirpath, dirnames, filenames in os.walk(f"{self.storeRoot()}/objects"):
+            for i in filenames:
+                try:
+                    st = os.stat(os.path.join(dirpath, i))
+                except OSError:
+                    continue
+                objects += 1
+                references += st.st_nlink - 1
+                storedBytes += st.st_size
+                reclaimedBytes += st.st_size * max(st.st_nlink - 2, 0)
+
+        stats = self.queryStats()
+        stats.update({
+            'hardlinks': bool(self.allowHardlinks()),
+            'objects': objects,
+            'references': references,
+            'storedBytes': storedBytes,
+            'reclaimedBytes': reclaimedBytes + stats['reflinkedBytes']
+        })
+        return stats
@@ -0,0 +1,134 @@
+import base64
+import bisect
+import collections
+import json
+import mimetypes
+import os
+import threading
+import time
+
+sortKeys = {
+    'name': lambda i: (i['filename'].casefold(), i['filename']),
+    'mtime': lambda i: (i['mtime'], i['filename']),
+    'size': lambda i: (i['size'], i['filename']),
+    'type': lambda i: (i['type'] == 'file', i['mime'], i['filename'].casefold(), i['filename'])
+}
+
+
+def scanEntry(name: str, isFile: bool, st: os.stat_result):
+    mime = mimetypes.guess_type(name)[0]
+    return {
+        "filename": name,
+        "type": "file" if isFile else "dir",
+        "lastModified": time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(st.st_mtime)),
+        "mime": mime if mime is not None else "application/octet-stream" if isFile else "None",
+        "size": st.st_size if isFile else 0,
+        "mtime": st.st_mtime
+    }
+
+
+def scanDirectory(path: str):
+    # one scandir pass, reusing the DirEntry type and stat instead of stat + isfile per entry
+    entries = []
+    with os.scandir(path) as it:
+        for i in it:
+            try:
+                isFile = i.is_file()
+                st = i.stat()
+            except OSError:
+                continue
+            entries.append(scanEntry(i.name, isFile, st))
+    return entries
+
+
+def encodeCursor(key: tuple):
+    return base64.urlsafe_b64encode(json.dumps(key).encode('utf-8')).decode('ascii')
+
+
+def decodeCursor(cursor: str):
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except ValueError:
+        key = None
+    if not isinstance(key, list):
+        raise ValueError("invalid cursor")
+    return tuple(key)
+
+
+# directory listings cached per real path and validated against the directory's own stat, so
+# entries added, removed or renamed by anyone are noticed. drive mutations invalidate explicitly
+# to also catch content changes that leave the directory untouched.
+class dirListCache:
+    def __init__(self, capacity: int = 256) -> None:
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()
+        self._stats = {'hits': 0, 'misses': 0, 'invalidations': 0}
+
+    def _load(self, path: str):
+        path = os.path.normpath(path)
+        st = os.stat(path)
+        version = (st.st_ino, st.st_mtime_ns)
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry['version'] == version:
+                self._entries.move_to_end(path)
+                self._stats['hits'] += 1
+                return entry
+            self._stats['misses'] += 1
+
+        entry = {'version': version, 'entries': scanDirectory(path), 'sorted': {}}
+        with self._lock:
+            self._entries[path] = entry
+            self._entries.move_to_end(path)
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+        return entry
+
+    def _sorted(self, entry, sort: str):
+        # (keys, entries) in ascending order, computed once per listing and sort
+        result = entry['sorted'].get(sort)
+        if result is None:
+            pairs = sorted(((sortKeys[sort](i), i) for i in entry['entries']), key=lambda i: i[0])
+            result = ([i[0] for i in pairs], [i[1] for i in pairs])
+            entry['sorted'][sort] = result
+        return result
+
+    def list(self, path: str, sort: str = 'name', order: str = 'asc', limit: int = None, cursor: str = None):
+        # returns (page, counts, next cursor), raises ValueError for bad arguments and OSError.
+        # a cursor of another sort compares as a TypeError
+        if sort not in sortKeys or order not in ['asc', 'desc']:
+            raise ValueError("invalid sort")
+        entry = self._load(path)
+        keys, entries = self._sorted(entry, sort)
+
+        if order == 'asc':
+            start = 0 if cursor is None else bisect.bisect_right(keys, decodeCursor(cursor))
+            end = len(entries) if limit is None else min(start + limit, len(entries))
+            indexes = range(start, end)
+        else:
+            end = len(entries) if cursor is None else bisect.bisect_left(keys, decodeCursor(cursor))
+            start = 0 if limit is None else max(end - limit, 0)
+            indexes = range(end - 1, start - 1, -1)
+
+        page = [entries[i] for i in indexes]
+        more = (end < len(entries)) if order == 'asc' else (start > 0)
+        files = sum(i['type'] == 'file' for i in entries)
+        counts = {'total': len(entries), 'files': files, 'dirs': len(entries) - files}
+        return page, counts, encodeCursor(keys[indexes[-1]]) if more and page else None
+
+    def invalidate(self, path: str):
+        # drops the path, its parent and everything below it
+        path = os.path.normpath(path)
+        prefix = path + os.sep
+        parent = os.path.dirname(path)
+        with self._lock:
+            for i in [i for i in self._entries if i == path or i == parent or i.startswith(prefix)]:
+                del self._entries[i]
+            self._stats['invalidations'] += 1
+
+    def queryStats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['cached'] = len(self._entries)
+        return stats
@@ -0,0 +1,72 @@
+import posixpath
+
+maxOperations = 1000
+# filesystem operations of one batch running at once
+batchWorkers = 8
+
+fields = {
+    'move': ('path', 'newPath'),
+    'copy': ('path', 'newPath'),
+    'rename': ('path', 'newName'),
+    'delete': ('path', )
+}
+
+
+def normalizePath(path: str):
+    # drive relative and rooted, '..' can never climb above the drive
+    return posixpath.normpath('/' + path.lstrip('/'))
+
+
+def isInside(path: str, root: str):
+    return path == root or root == '/' or path.startswith(root + '/')
+
+
+def plan(operations: list):
+    # [{'op', 'path', 'target'}] with normalized paths, raises ValueError naming the first bad operation
+    if not isinstance(operations, list) or len(operations) == 0 or len(operations) > maxOperations:
+        raise ValueError(f"expected 1 to {maxOperations} operations")
+
+    steps = []
+    for index, i in enumerate(operations):
+        if not isinstance(i, dict) or i.get('op') not in fields:
+            raise ValueError(f"operation {index}: unknown op")
+        for field in fields[i['op']]:
+            if not isinstance(i.get(field), str):
+                raise ValueError(f"operation {index}: missing {field}")
+
+        path = normalizePath(i['path'])
+        if path == '/':
+            raise ValueError(f"operation {index}: the drive root cannot be changed")
+        if i['op'] == 'rename':
+            if i['newName'] in ('', '.', '..') or '/' in i['newName']:
+                raise ValueError(f"operation {index}: invalid newName")
+            target = posixpath.join(posixpath.dirname(path), i['newName'])
+        elif i['op'] == 'delete':
+            target = None
+        else:
+            target = posixpath.join(normalizePath(i['newPath']), posixpath.basename(path))
+            if isInside(target, path):
+                raise ValueError(f"operation {index}: cannot {i['op']} a directory into itself")
+        steps.append({'op': i['op'], 'path': path, 'target': target})
+    return steps
+
+
+def touchedPaths(step: dict):
+    return [step['path']] if step['target'] is None else [step['path'], step['target']]
+
+
+def schedule(steps: list):
+    # waves of step indexes, a step runs after every earlier step whose paths overlap its own,
+    # steps of one wave are independent of each other
+    waves = []
+    levels = []
+    for index, step in enumerate(steps):
+        level = 0
+        for earlier in range(index):
+            if any(isInside(a, b) or isInside(b, a) for a in touchedPaths(step) for b in touchedPaths(steps[earlier])):
+                level = max(level, levels[earlier] + 1)
+        levels.append(level)
+        if level == len(waves):
+            waves.append([])
+        waves[level].append(index)
+    return waves
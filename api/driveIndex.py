@@ -0,0 +1,199 @@
+import logging
+import os
+import posixpath
+import stat
+import threading
+import time
+
+import api.dirLister as dirLister
+
+# mime families accepted by search, dir matches directories
+families = ('dir', 'audio', 'video', 'image', 'text', 'font', 'application')
+# the trigram tokenizer can only match queries of at least this many characters
+minTrigramQuery = 3
+
+
+def escapeLike(value: str):
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def makeRow(path: str, isFile: bool, st: os.stat_result):
+    row = dirLister.scanEntry(posixpath.basename(path), isFile, st)
+    row.update({'path': path, 'parent': posixpath.dirname(path), 'name': row['filename'], 'inode': st.st_ino})
+    return row
+
+
+def scanRows(realDir: str, dir: str):
+    # rows of the direct children of a directory. only regular files and directories are indexed,
+    # symbolic links are neither followed nor counted, like in driveUsage.walkUsage
+    rows = []
+    with os.scandir(realDir) as it:
+        for i in it:
+            try:
+                isFile = i.is_file(follow_symlinks=False)
+                if not isFile and not i.is_dir(follow_symlinks=False):
+                    continue
+                st = i.stat(follow_symlinks=False)
+            except OSError:
+                continue
+            rows.append(makeRow(f"{dir.rstrip('/')}/{i.name}", isFile, st))
+    return rows
+
+
+def walkTree(realPath: str, path: str):
+    # rows of path and everything below it, the drive root itself may be a link
+    st = os.stat(realPath) if path == '/' else os.lstat(realPath)
+    if not stat.S_ISREG(st.st_mode) and not stat.S_ISDIR(st.st_mode):
+        return []
+    rows = [] if path == '/' else [makeRow(path, stat.S_ISREG(st.st_mode), st)]
+    if not stat.S_ISDIR(st.st_mode):
+        return rows
+
+    stack = [(realPath, path)]
+    while stack:
+        realDir, dir = stack.pop()
+        try:
+            entries = scanRows(realDir, dir)
+        except OSError:
+            continue
+        rows.extend(entries)
+        stack.extend((os.path.join(realDir, i['name']), i['path']) for i in entries if i['type'] == 'dir')
+    return rows
+
+
+# filename index of every user drive: driveIndex holds one row per file or directory and
+# driveSearch is its external content FTS5 table with the trigram tokenizer, kept in sync by
+# triggers. drive mutations update the affected subtree, buildSearchIndex.py rebuilds it all.
+class driveIndex:
+    def __init__(self, db, driveRoot) -> None:
+        # driveRoot is a callable, the drive path can change with the config
+        self.db = db
+        self.driveRoot = driveRoot
+        self._logger = logging.getLogger("driveIndex")
+        self._lock = threading.Lock()
+        self._stats = {'updates': 0, 'removals': 0, 'rowsWritten': 0, 'searches': 0, 'rebuildTime': None}
+
+    def _count(self, key: str, value: int = 1):
+        with self._lock:
+            self._stats[key] += value
+
+    def locate(self, realPath: str):
+        # real path -> (owner, drive relative path), None for anything outside the drives
+        relative = os.path.relpath(os.path.normpath(realPath), os.path.normpath(self.driveRoot()))
+        if relative == '.' or relative.startswith('..'):
+            return None
+        parts = relative.split(os.sep, 1)
+        try:
+            owner = int(parts[0])
+        except ValueError:
+            return None
+        return owner, '/' + parts[1] if len(parts) > 1 else '/'
+
+    def realPath(self, owner: int, path: str):
+        return f"{self.driveRoot()}/{owner}{path if path != '/' else ''}"
+
+    def removeTree(self, conn, owner: int, path: str):
+        prefix = path.rstrip('/')
+        conn.execute("delete from driveIndex where owner = ? and path = ?", (owner, path))
+        # '0' sorts right after '/', so this range is exactly the subtree
+        conn.execute("delete from driveIndex where owner = ? and path >= ? and path < ?",
+                     (owner, f"{prefix}/", f"{prefix}0"))
+
+    def insertRows(self, conn, owner: int, rows: list):
+        # an upsert, a racing writer may have indexed the same path already
+        conn.executemany("""
+            insert into driveIndex (owner, path, parent, name, type, mime, size, mtime, inode)
+            values (:owner, :path, :parent, :name, :type, :mime, :size, :mtime, :inode)
+            on conflict (owner, path) do update set parent = excluded.parent, name = excluded.name, type = excluded.type,
+                mime = excluded.mime, size = excluded.size, mtime = excluded.mtime, inode = excluded.inode
+        """, ({'owner': owner, **i} for i in rows))
+
+    def update(self, realPath: str):
+        # re-indexes realPath and everything below it, a missing path is removed
+        location = self.locate(realPath)
+        if location is None:
+            return 0
+        owner, path = location
+        try:
+            rows = walkTree(realPath, path)
+        except FileNotFoundError:
+            rows = []
+        except OSError as e:
+            self._logger.warning(f"unable to index {realPath}: {str(e)}")
+            return 0
+
+        def write(conn):
+            self.removeTree(conn, owner, path)
+            self.insertRows(conn, owner, rows)
+
+        self.db.transaction(write)
+        self._count('updates')
+        self._count('rowsWritten', len(rows))
+        return len(rows)
+
+    def remove(self, realPath: str):
+        location = self.locate(realPath)
+        if location is None:
+            return
+        self.db.transaction(lambda conn: self.removeTree(conn, *location))
+        self._count('removals')
+
+    def rebuild(self, uid: int = None):
+        # re-indexes one drive, or every drive under the drive path when uid is None
+        root = self.driveRoot()
+        if uid is not None:
+            owners = [uid]
+        else:
+            owners = [int(i) for i in os.listdir(root) if i.isdigit()]
+            self.db.execute("delete from driveIndex where owner not in (%s)" % ','.join('?' * len(owners)), owners)
+
+        indexed = 0
+        for i in owners:
+            indexed += self.update(self.realPath(i, '/'))
+        with self._lock:
+            self._stats['rebuildTime'] = time.time()
+        return {'drives': len(owners), 'indexed': indexed}
+
+    def search(self, owner: int, query: str, family: str = None, offset: int = 0, limit: int = 50):
+        # ranks exact names over name prefixes over name substrings over path matches,
+        # raises ValueError for an empty query or an unknown mime family
+        query = query.strip()
+        if query == '':
+            raise ValueError("empty query")
+        conditions = ['d.owner = ?']
+        args = [owner]
+        if family == 'dir':
+            conditions.append("d.type = 'dir'")
+        elif family is not None:
+            if family not in families:
+                raise ValueError(f"unknown mime family: {family}")
+            conditions.append("d.mime like ?")
+            args.append(f"{family}/%")
+
+        pattern = escapeLike(query)
+        ranking = ["lower(d.name) = lower(?) desc", "d.name like ? escape '\\' desc", "d.name like ? escape '\\' desc"]
+        rankingArgs = [query, f"{pattern}%", f"%{pattern}%"]
+        if len(query) >= minTrigramQuery:
+            source = "driveSearch join driveIndex d on d.id = driveSearch.rowid"
+            conditions.insert(0, "driveSearch match ?")
+            args.insert(0, '"%s"' % query.replace('"', '""'))
+            ranking.append("bm25(driveSearch, 10.0, 1.0)")
+        else:
+            source = "driveIndex d"
+            conditions.append("d.path like ? escape '\\'")
+            args.append(f"%{pattern}%")
+        ranking.append("length(d.path)")
+
+        self._count('searches')
+        where = ' and '.join(conditions)
+        total = self.db.query(f"select count(1) as total from {source} where {where}", args, one=True)['total']
+        data = self.db.query(
+            f"select d.path, d.name as filename, d.type, d.mime, d.size, d.mtime from {source} where {where} order by {', '.join(ranking)} limit ? offset ?",
+            (*args, *rankingArgs, limit, offset))
+        for i in data:
+            i['lastModified'] = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(i['mtime']))
+        return {'list': data, 'total': total}
+
+    def queryStats(self):
+        with self._lock:
+            return dict(self._stats)
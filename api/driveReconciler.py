@@ -0,0 +1,334 @@
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import select
+import struct
+import threading
+import time
+
+import api.driveIndex as driveIndex
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+
+watchMask = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_ONLYDIR
+eventHeader = struct.Struct('iIII')
+
+# seconds events are collected into one batch
+batchDelay = 1
+pollInterval = 60
+fullScanInterval = 10 * 60
+
+
+# minimal inotify binding over libc, watches directories and maps watch descriptors back to paths
+class inotifyWatcher:
+    def __init__(self) -> None:
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        # raises AttributeError where libc has no inotify
+        self.fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            e = ctypes.get_errno()
+            raise OSError(e, os.strerror(e))
+        self.watches = {}
+
+    def watch(self, path: str):
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), watchMask)
+        if wd < 0:
+            e = ctypes.get_errno()
+            raise OSError(e, os.strerror(e), path)
+        self.watches[wd] = path
+
+    def watchTree(self, path: str):
+        for dirpath, dirnames, filenames in os.walk(path):
+            try:
+                self.watch(dirpath)
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    raise
+
+    def rename(self, path: str, newPath: str):
+        # a watch follows its directory, only the path it stands for changes
+        prefix = path + os.sep
+        for wd, i in self.watches.items():
+            if i == path or i.startswith(prefix):
+                self.watches[wd] = newPath + i[len(path):]
+
+    def read(self, timeout: float):
+        # returns [(directory, name, mask, cookie)], None for a queue overflow
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return []
+        events = []
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                return events
+            offset = 0
+            while offset < len(data):
+                wd, mask, cookie, length = eventHeader.unpack_from(data, offset)
+                name = data[offset + eventHeader.size:offset + eventHeader.size + length].rstrip(b'\0')
+                offset += eventHeader.size + length
+                if mask & IN_Q_OVERFLOW:
+                    return None
+                if mask & IN_IGNORED:
+                    self.watches.pop(wd, None)
+                elif wd in self.watches:
+                    events.append((self.watches[wd], os.fsdecode(name), mask, cookie))
+
+    def close(self):
+        os.close(self.fd)
+
+
+# keeps the drive index, and everything subscribed to it, in step with files changed behind the
+# api's back. inotify marks directories dirty, without it a periodic scan stats every indexed
+# directory and only lists those whose mtime moved. a dirty directory is diffed against its rows
+# in the index, removals and additions of the same inode pair up into renames, and every batch
+# of events is published to the handlers inside one transaction, then to the listeners.
+class driveReconciler:
+    def __init__(self, db, index) -> None:
+        self.db = db
+        self.index = index
+        self.handlers = []
+        self.listeners = []
+        self._logger = logging.getLogger("driveReconciler")
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._watcher = None
+        self._thread = None
+        self._stats = {'mode': 'stopped', 'watches': 0, 'scans': 0, 'batches': 0, 'lastScanTime': None,
+                       'lastScanDuration': None, 'lastLag': None, 'maxLag': 0,
+                       'events': {'added': 0, 'removed': 0, 'renamed': 0, 'modified': 0}}
+
+    def subscribe(self, handler):
+        # handler(conn, events) runs in the batch transaction, it must not wait on the database
+        self.handlers.append(handler)
+
+    def listen(self, listener):
+        # listener(events) runs once the batch is committed
+        self.listeners.append(listener)
+
+    def listOwners(self):
+        try:
+            return [int(i) for i in os.listdir(self.index.driveRoot()) if i.isdigit()]
+        except FileNotFoundError:
+            return []
+
+    def _diff(self, owner: int, dirs: set):
+        added, removed, modified, touched = [], [], [], []
+        for path in dirs:
+            try:
+                st = os.stat(self.index.realPath(owner, path))
+                onDisk = {i['name']: i for i in driveIndex.scanRows(self.index.realPath(owner, path), path)}
+            except (FileNotFoundError, NotADirectoryError):
+                # gone, the diff of its parent reports it
+                continue
+            indexed = {i['name']: i for i in self.db.query(
+                "select path, name, type, size, mtime, inode from driveIndex where owner = ? and parent = ?", (owner, path))}
+
+            for name, row in onDisk.items():
+                old = indexed.get(name)
+                if old is None:
+                    added.append(row)
+                elif old['type'] != row['type']:
+                    removed.append(old)
+                    added.append(row)
+                elif row['type'] == 'file' and (old['inode'], old['size'], old['mtime']) != (row['inode'], row['size'], row['mtime']):
+                    # rewritten in place or replaced by a new inode under the same name
+                    modified.append(row)
+            removed.extend(old for name, old in indexed.items() if name not in onDisk)
+            if path != '/':
+                touched.append({'path': path, 'mtime': st.st_mtime, 'inode': st.st_ino})
+
+        candidates = {(i['type'], i['inode']): i for i in removed if i['inode']}
+        renamed = []
+        for row in list(added):
+            old = candidates.pop((row['type'], row['inode']), None)
+            if old is not None and self._isSameEntry(owner, old, row):
+                removed.remove(old)
+                added.remove(row)
+                renamed.append((old, row))
+        return added, removed, renamed, modified, touched
+
+    def _isSameEntry(self, owner: int, old: dict, row: dict):
+        # inodes get reused: a renamed file keeps its size and mtime, a renamed directory
+        # keeps at least one of its entries
+        if row['type'] == 'file':
+            return (old['size'], old['mtime']) == (row['size'], row['mtime'])
+        try:
+            names = set(os.listdir(self.index.realPath(owner, row['path'])))
+        except OSError:
+            return False
+        indexed = {i['name'] for i in self.db.query(
+            "select name from driveIndex where owner = ? and parent = ?", (owner, old['path']))}
+        return names == indexed or bool(names & indexed)
+
+    def reconcile(self, owner: int, dirs: set, since: float = None):
+        added, removed, renamed, modified, touched = self._diff(owner, dirs)
+        events = [{'type': 'added', 'owner': owner, 'path': i['path'], 'dir': i['type'] == 'dir'} for i in added]
+        events += [{'type': 'removed', 'owner': owner, 'path': i['path'], 'dir': i['type'] == 'dir'} for i in removed]
+        events += [{'type': 'renamed', 'owner': owner, 'path': i['path'], 'newPath': j['path'], 'dir': j['type'] == 'dir'} for i, j in renamed]
+        events += [{'type': 'modified', 'owner': owner, 'path': i['path'], 'dir': False} for i in modified]
+
+        rows = list(modified)
+        for i in added + [j for i, j in renamed]:
+            try:
+                rows += driveIndex.walkTree(self.index.realPath(owner, i['path']), i['path']) if i['type'] == 'dir' else [i]
+            except OSError:
+                continue
+
+        def write(conn):
+            for i in removed + [i for i, j in renamed]:
+                self.index.removeTree(conn, owner, i['path'])
+            self.index.insertRows(conn, owner, rows)
+            conn.executemany("update driveIndex set mtime = :mtime, inode = :inode where owner = :owner and path = :path",
+                             ({'owner': owner, **i} for i in touched))
+            if events:
+                for handler in self.handlers:
+                    handler(conn, events)
+
+        self.db.transaction(write)
+        if events:
+            for listener in self.listeners:
+                listener(events)
+
+        with self._lock:
+            if events:
+                self._stats['batches'] += 1
+            for i in events:
+                self._stats['events'][i['type']] += 1
+            if since is not None:
+                lag = time.time() - since
+                self._stats['lastLag'] = lag
+                self._stats['maxLag'] = max(self._stats['maxLag'], lag)
+        return events
+
+    def scan(self, owners: list = None):
+        # full tree diff, only directories whose mtime differs from the index are listed
+        startTime = time.time()
+        with self._lock:
+            since = self._stats['lastScanTime']
+        events = []
+        for owner in owners if owners is not None else self.listOwners():
+            dirs = {'/'}
+            for i in self.db.query("select path, mtime from driveIndex where owner = ? and type = 'dir'", (owner, )):
+                try:
+                    if os.stat(self.index.realPath(owner, i['path'])).st_mtime != i['mtime']:
+                        dirs.add(i['path'])
+                except OSError:
+                    continue
+            events += self.reconcile(owner, dirs, since)
+
+        with self._lock:
+            self._stats['scans'] += 1
+            self._stats['lastScanTime'] = startTime
+            self._stats['lastScanDuration'] = time.time() - startTime
+        return events
+
+    def start(self):
+        if self._thread is not None:
+            return False
+        self._thread = threading.Thread(target=self._run, name="driveReconciler", daemon=True)
+        self._thread.start()
+        return True
+
+    def stop(self):
+        self._stop.set()
+
+    def _startWatching(self):
+        try:
+            watcher = inotifyWatcher()
+        except (OSError, AttributeError) as e:
+            self._logger.warning(f"inotify unavailable, polling drives every {pollInterval}s: {str(e)}")
+            return None
+        try:
+            # the drive root itself too, to pick up drives of new users
+            os.makedirs(self.index.driveRoot(), exist_ok=True)
+            watcher.watch(self.index.driveRoot())
+            for i in self.listOwners():
+                watcher.watchTree(self.index.realPath(i, '/'))
+        except OSError as e:
+            # most likely out of watches, see fs.inotify.max_user_watches
+            self._logger.warning(f"unable to watch drives, polling every {pollInterval}s instead: {str(e)}")
+            watcher.close()
+            return None
+        return watcher
+
+    def _collect(self, events: list, dirty: dict, moves: dict):
+        # marks the directories events happened in dirty and keeps watches on every directory,
+        # whether the api or someone else made or moved it
+        root = os.path.normpath(self.index.driveRoot())
+        for dir, name, mask, cookie in events:
+            if mask & IN_ISDIR and mask & IN_MOVED_FROM:
+                moves[cookie] = os.path.join(dir, name)
+            elif mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                if cookie in moves:
+                    self._watcher.rename(moves.pop(cookie), os.path.join(dir, name))
+                else:
+                    self._watcher.watchTree(os.path.join(dir, name))
+
+            if os.path.normpath(dir) == root:
+                if name.isdigit() and mask & (IN_CREATE | IN_MOVED_TO):
+                    dirty.setdefault(int(name), set()).add('/')
+                continue
+            location = self.index.locate(dir)
+            if location is not None:
+                dirty.setdefault(location[0], set()).add(location[1])
+
+    def _run(self):
+        self._watcher = self._startWatching()
+        with self._lock:
+            self._stats['mode'] = 'inotify' if self._watcher is not None else 'polling'
+        lastScan = 0
+        while not self._stop.is_set():
+            try:
+                if time.time() - lastScan >= (fullScanInterval if self._watcher is not None else pollInterval):
+                    self.scan()
+                    lastScan = time.time()
+                if self._watcher is None:
+                    self._stop.wait(pollInterval)
+                    continue
+
+                events = self._watcher.read(max(lastScan + fullScanInterval - time.time(), 0))
+                if events is None:
+                    self._logger.warning("inotify queue overflowed, scanning every drive")
+                    lastScan = 0
+                    continue
+                if not events:
+                    continue
+
+                since = time.time()
+                dirty = {}
+                moves = {}
+                self._collect(events, dirty, moves)
+                # let a burst settle into one batch
+                while time.time() - since < batchDelay:
+                    more = self._watcher.read(batchDelay - (time.time() - since))
+                    if more is None:
+                        lastScan = 0
+                        break
+                    self._collect(more, dirty, moves)
+                for owner, dirs in dirty.items():
+                    self.reconcile(owner, dirs, since)
+            except Exception as e:
+                self._logger.error(f"drive reconciliation failed: {str(e)}")
+                self._stop.wait(batchDelay)
+            finally:
+                with self._lock:
+                    self._stats['watches'] = len(self._watcher.watches) if self._watcher is not None else 0
+
+    def queryStats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['events'] = dict(self._stats['events'])
+        return stats
@@ -0,0 +1,160 @@
+import concurrent.futures
+import logging
+import os
+import threading
+import time
+
+verifyInterval = 6 * 60 * 60
+
+
+def walkUsage(path: str):
+    # (bytes, files) below path, without following symlinks
+    total = 0
+    files = 0
+    stack = [path]
+    while stack:
+        try:
+            entries = os.scandir(stack.pop())
+        except OSError:
+            continue
+        with entries:
+            for i in entries:
+                try:
+                    if i.is_dir(follow_symlinks=False):
+                        stack.append(i.path)
+                    elif i.is_file(follow_symlinks=False):
+                        total += i.stat(follow_symlinks=False).st_size
+                        files += 1
+                except OSError:
+                    continue
+    return total, files
+
+
+# per drive usage counters. the driveUsage table is maintained by triggers on driveIndex, so every
+# upload, copy, move, delete, update or reconciled change is accounted for as it is indexed and
+# reading usage never touches the disk. verify() walks the drives with a thread pool, one job per
+# top level directory, and repairs a counter that drifted away from what is on disk.
+class driveUsage:
+    def __init__(self, db, index, reconciler, workers: int = None) -> None:
+        self.db = db
+        self.index = index
+        self.reconciler = reconciler
+        self.workers = workers if workers is not None else min(8, (os.cpu_count() or 1) * 2)
+        self._logger = logging.getLogger("driveUsage")
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stats = {'status': 'idle', 'verifications': 0, 'corrections': 0,
+                       'lastVerifyTime': None, 'lastVerifyDuration': None}
+
+    def query(self, uid: int):
+        d = self.db.query("select bytes, files, verifiedTime from driveUsage where owner = ?", (uid, ), one=True)
+        return d if d is not None else {'bytes': 0, 'files': 0, 'verifiedTime': None}
+
+    def queryTreeSize(self, uid: int, path: str):
+        # indexed bytes of a file or of everything below a directory
+        prefix = path.rstrip('/')
+        return self.db.query(
+            "select coalesce(sum(size), 0) as bytes from driveIndex where owner = ? and type = 'file' and (path = ? or (path >= ? and path < ?))",
+            (uid, path, f"{prefix}/", f"{prefix}0"), one=True)['bytes']
+
+    def _walk(self, owners: list):
+        # {owner: (bytes, files)}, the top level entries of every drive are walked in parallel
+        jobs = []
+        for owner in owners:
+            root = self.index.realPath(owner, '/')
+            jobs.append((owner, root, False))
+            try:
+                jobs += [(owner, i.path, True) for i in os.scandir(root) if i.is_dir(follow_symlinks=False)]
+            except OSError:
+                continue
+
+        def run(job):
+            owner, path, recursive = job
+            if recursive:
+                return owner, walkUsage(path)
+            total = 0
+            files = 0
+            try:
+                with os.scandir(path) as entries:
+                    for i in entries:
+                        if i.is_file(follow_symlinks=False):
+                            total += i.stat(follow_symlinks=False).st_size
+                            files += 1
+            except OSError:
+                pass
+            return owner, (total, files)
+
+        usage = {i: (0, 0) for i in owners}
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="driveUsage") as pool:
+            for owner, (total, files) in pool.map(run, jobs):
+                usage[owner] = (usage[owner][0] + total, usage[owner][1] + files)
+        return usage
+
+    def _recount(self, owner: int):
+        self.db.execute("""
+            insert into driveUsage (owner, bytes, files)
+            select ?, coalesce(sum(size), 0), count(1) from driveIndex where owner = ? and type = 'file'
+            on conflict (owner) do update set bytes = excluded.bytes, files = excluded.files
+        """, (owner, owner))
+
+    def verify(self, owners: list = None):
+        startTime = time.time()
+        owners = owners if owners is not None else self.reconciler.listOwners()
+        corrections = 0
+        for owner, actual in self._walk(owners).items():
+            counted = self.query(owner)
+            if (counted['bytes'], counted['files']) != actual:
+                # renames and removals first, so the tables following paths hear about them,
+                # then a full re-index for whatever changed without touching a directory
+                self._logger.warning(f"drive usage of user {owner} drifted: counted {counted['bytes']} bytes, found {actual[0]}")
+                self.reconciler.scan([owner])
+                counted = self.query(owner)
+                if (counted['bytes'], counted['files']) != actual:
+                    self.index.update(self.index.realPath(owner, '/'))
+                    self._recount(owner)
+                corrections += 1
+            self.db.execute("update driveUsage set verifiedTime = ? where owner = ?", (time.time(), owner))
+
+        with self._lock:
+            self._stats['verifications'] += 1
+            self._stats['corrections'] += corrections
+            self._stats['lastVerifyTime'] = startTime
+            self._stats['lastVerifyDuration'] = time.time() - startTime
+        return {'drives': len(owners), 'corrections': corrections}
+
+    def startVerify(self):
+        with self._lock:
+            if self._stats['status'] == 'verifying':
+                return False
+            self._stats['status'] = 'verifying'
+
+        def run():
+            try:
+                self.verify()
+            except Exception as e:
+                self._logger.error(f"drive usage verification failed: {str(e)}")
+            finally:
+                with self._lock:
+                    self._stats['status'] = 'idle'
+                self.db.release()
+
+        threading.Thread(target=run, name="driveUsageVerify", daemon=True).start()
+        return True
+
+    def start(self):
+        # verifies every drive each verifyInterval
+        if self._thread is not None:
+            return False
+
+        def run():
+            while True:
+                time.sleep(verifyInterval)
+                self.startVerify()
+
+        self._thread = threading.Thread(target=run, name="driveUsage", daemon=True)
+        self._thread.start()
+        return True
+
+    def queryStats(self):
+        with self._lock:
+            return dict(self._stats)
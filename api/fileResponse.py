@@ -0,0 +1,185 @@
+import os
+import re
+import secrets
+
+import flask
+from werkzeug.http import http_date, parse_date
+
+chunkSize = 64 * 1024
+maxRanges = 16
+
+# private content is revalidated on every use, artwork may be reused for a while
+revalidate = 'private, no-cache'
+artworkCacheControl = 'private, max-age=3600'
+# content addressed urls never change their content
+immutable = 'public, max-age=31536000, immutable'
+
+
+def fileETag(st: os.stat_result):
+    return f"{st.st_ino:x}-{st.st_mtime_ns:x}-{st.st_size:x}"
+
+
+def isNotModified(etag: str, lastModified: float = None):
+    # If-None-Match wins over If-Modified-Since, and uses the weak comparison
+    header = flask.request.headers.get('If-None-Match')
+    if header is not None:
+        if header.strip() == '*':
+            return True
+        for i in header.split(','):
+            i = i.strip()
+            if (i[2:] if i.startswith('W/') else i) == f'"{etag}"':
+                return True
+        return False
+
+    header = flask.request.headers.get('If-Modified-Since')
+    if header is not None and lastModified is not None:
+        date = parse_date(header)
+        return date is not None and int(lastModified) <= date.timestamp()
+    return False
+
+
+def setValidators(response, etag: str, lastModified: float = None, cacheControl: str = revalidate):
+    response.headers['ETag'] = f'"{etag}"'
+    if lastModified is not None:
+        response.headers['Last-Modified'] = http_date(lastModified)
+    response.headers['Cache-Control'] = cacheControl
+    return response
+
+
+def makeNotModified(etag: str, lastModified: float = None, cacheControl: str = revalidate):
+    return setValidators(flask.Response(status=304), etag, lastModified, cacheControl)
+
+
+def parseRange(header: str, length: int):
+    # returns a list of inclusive (start, end) pairs, [] when nothing is satisfiable,
+    # or None when the header is malformed and must be ignored
+    unit, _, specs = header.partition('=')
+    if unit.strip().lower() != 'bytes' or not specs.strip():
+        return None
+
+    ranges = []
+    for spec in specs.split(','):
+        first, dash, last = spec.strip().partition('-')
+        # ascii digits only, str.isdigit() also takes digits like '²' that int() refuses
+        if not dash or not re.fullmatch(r'[0-9]*', first) or not re.fullmatch(r'[0-9]*', last) or not (first or last):
+            return None
+        if not first:
+            # suffix range: the last n bytes
+            suffix = int(last)
+            if suffix > 0 and length > 0:
+                ranges.append((max(length - suffix, 0), length - 1))
+            continue
+
+        start = int(first)
+        if last and int(last) < start:
+            return None
+        if start < length:
+            ranges.append((start, min(int(last), length - 1) if last else length - 1))
+
+    if len(ranges) > 1:
+        # coalesce overlapping and adjacent ranges so a client can't make us repeat the file
+        ranges.sort()
+        merged = [ranges[0]]
+        for start, end in ranges[1:]:
+            if start <= merged[-1][1] + 1:
+                merged[-1] = (merged[-1][0], max(end, merged[-1][1]))
+            else:
+                merged.append((start, end))
+        ranges = merged
+        if len(ranges) > maxRanges:
+            return None
+    return ranges
+
+
+def checkIfRange(header: str, etag: str, mtime: float):
+    # a range request only applies when If-Range still names the current representation
+    if header is None:
+        return True
+    header = header.strip()
+    if header.startswith('W/'):
+        return False
+    elif header.startswith('"'):
+        return header == f'"{etag}"'
+    date = parse_date(header)
+    return date is not None and int(date.timestamp()) == int(mtime)
+
+
+def iterFile(path: str, ranges: list, parts: list = None):
+    # streams the ranges in bounded chunks, parts holds the multipart header before every range
+    with open(path, 'rb') as file:
+        for index, (start, end) in enumerate(ranges):
+            if parts is not None:
+                yield parts[index]
+            file.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                data = file.read(min(chunkSize, remaining))
+                if not data:
+                    return
+                remaining -= len(data)
+                yield data
+        if parts is not None:
+            yield parts[-1]
+
+
+def makeOffloadResponse(path: str, mime: str, offload: tuple, st: os.stat_result, cacheControl: str):
+    # headers only, the front proxy named by offload = (header, location) streams the bytes
+    # and takes care of ranges itself. the validators come from our stat, so they match the ones
+    # of a response we serve ourselves whichever way the file went out
+    response = flask.Response(mimetype=mime)
+    response.headers[offload[0]] = offload[1]
+    if mime.startswith('application'):
+        response.headers['Content-Disposition'] = "attachment; filename=" + \
+            os.path.basename(path)
+    return setValidators(response, fileETag(st), st.st_mtime, cacheControl)
+
+
+def makeFileResponse(path: str, mime: str, cacheControl: str = revalidate, offload: tuple = None):
+    st = os.stat(path)
+    etag = fileETag(st)
+    # answered from the stat alone, the file is never opened for a 304
+    if isNotModified(etag, st.st_mtime):
+        return makeNotModified(etag, st.st_mtime, cacheControl)
+    if offload is not None:
+        return makeOffloadResponse(path, mime, offload, st, cacheControl)
+
+    isPreview = not mime.startswith('application')
+    header = flask.request.headers.get('Range')
+    length = st.st_size
+    ranges = None
+    if header is not None and checkIfRange(flask.request.headers.get('If-Range'), etag, st.st_mtime):
+        ranges = parseRange(header, length)
+
+    if ranges is None:
+        # whole file, handed to wsgi.file_wrapper (sendfile) when the server provides one
+        response = flask.send_file(path, as_attachment=not isPreview, download_name=os.path.basename(path),
+                                   mimetype=mime, conditional=False, etag=False)
+        response.headers['Accept-Ranges'] = 'bytes'
+        return setValidators(response, etag, st.st_mtime, cacheControl)
+
+    if not ranges:
+        response = flask.Response(status=416)
+        response.headers['Content-Range'] = f'bytes */{length}'
+        response.headers['Accept-Ranges'] = 'bytes'
+        return response
+
+    if len(ranges) == 1:
+        start, end = ranges[0]
+        response = flask.Response(iterFile(path, ranges), status=206, mimetype=mime, direct_passthrough=True)
+        response.headers['Content-Range'] = f'bytes {start}-{end}/{length}'
+        response.content_length = end - start + 1
+    else:
+        boundary = secrets.token_hex(16)
+        parts = [
+            f'\r\n--{boundary}\r\nContent-Type: {mime}\r\nContent-Range: bytes {start}-{end}/{length}\r\n\r\n'.encode()
+            for start, end in ranges]
+        parts.append(f'\r\n--{boundary}--\r\n'.encode())
+        response = flask.Response(iterFile(path, ranges, parts), status=206, direct_passthrough=True,
+                                  content_type=f'multipart/byteranges; boundary={boundary}')
+        response.content_length = sum(len(i) for i in parts) + sum(end - start + 1 for start, end in ranges)
+
+    response.headers['Accept-Ranges'] = 'bytes'
+    if not isPreview:
+        response.headers['Content-Disposition'] = "attachment; filename=" + \
+            os.path.basename(path)
+    return setValidators(response, etag, st.st_mtime, cacheControl)
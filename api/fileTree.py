@@ -0,0 +1,114 @@
+import json
+import posixpath
+
+
+def splitPath(path: str):
+    # names from the drive root down, '..' can never climb above the drive
+    path = posixpath.normpath('/' + path.lstrip('/'))
+    return [] if path == '/' else path[1:].split('/')
+
+
+# stable ids of drive entries. songlist, playCount and share links refer to a row of files instead
+# of a path, and every row only names its parent, so renaming or moving a directory updates one row
+# however much lies below it. only entries something refers to, and their parents, get a row.
+# id 0 is the drive root. methods taking conn run inside a database transaction.
+class fileTree:
+    referencing = ["songlist", "playCount", "shareLinksList"]
+
+    def __init__(self, db) -> None:
+        self.db = db
+
+    def _child(self, conn, owner: int, parentId: int, name: str):
+        query = "select id from files where owner = ? and parentId = ? and name = ?"
+        if conn is not None:
+            row = conn.execute(query, (owner, parentId, name)).fetchone()
+            return row[0] if row is not None else None
+        row = self.db.query(query, (owner, parentId, name), one=True)
+        return row['id'] if row is not None else None
+
+    def lookup(self, owner: int, path: str, conn=None):
+        # id of a drive relative path, None if nothing refers to it
+        fileId = 0
+        for name in splitPath(path):
+            fileId = self._child(conn, owner, fileId, name)
+            if fileId is None:
+                return None
+        return fileId
+
+    def ensure(self, conn, owner: int, path: str):
+        # id of a drive relative path, creating rows for it and its parents
+        fileId = 0
+        for name in splitPath(path):
+            childId = self._child(conn, owner, fileId, name)
+            if childId is None:
+                childId = conn.execute("insert into files (owner, parentId, name) values (?, ?, ?)",
+                                       (owner, fileId, name)).lastrowid
+            fileId = childId
+        return fileId
+
+    def resolve(self, ids: list):
+        # {id: drive relative path} of the given ids, ids whose rows are gone are left out.
+        # read one level at a time, so a parent is read once however many of the ids share it
+        rows = {}
+        pending = {i for i in ids if i}
+        while pending:
+            found = self.db.query("select id, parentId, name from files where id in (select value from json_each(?))",
+                                  (json.dumps(list(pending)), ))
+            rows.update((i['id'], i) for i in found)
+            pending = {i['parentId'] for i in found if i['parentId'] and i['parentId'] not in rows}
+        paths = {0: '/'}
+
+        def path(fileId):
+            if fileId not in paths:
+                # a cycle resolves to nothing instead of recursing forever
+                paths[fileId] = None
+                row = rows.get(fileId)
+                parent = path(row['parentId']) if row is not None else None
+                paths[fileId] = None if parent is None else f"{parent.rstrip('/')}/{row['name']}"
+            return paths[fileId]
+
+        return {i: path(i) for i in ids if path(i) is not None}
+
+    def withPaths(self, rows: list):
+        # rows with a fileId get their current path, rows of entries that are gone are dropped
+        paths = self.resolve([i['fileId'] for i in rows])
+        result = []
+        for i in rows:
+            if i['fileId'] in paths:
+                i['path'] = paths[i['fileId']]
+                result.append(i)
+        return result
+
+    def _subtree(self, conn, owner: int, fileId: int):
+        return [i[0] for i in conn.execute("""
+            with recursive subtree (id) as (
+                select ?
+                union all
+                select files.id from files join subtree on files.owner = ? and files.parentId = subtree.id
+            )
+            select id from subtree
+        """, (fileId, owner))]
+
+    def remove(self, conn, owner: int, path: str):
+        # drops the entry, everything below it and whatever refers to them
+        fileId = self.lookup(owner, path, conn)
+        if not fileId:
+            return 0
+        ids = json.dumps(self._subtree(conn, owner, fileId))
+        for table in self.referencing:
+            conn.execute(f"delete from {table} where fileId in (select value from json_each(?))", (ids, ))
+        return conn.execute("delete from files where id in (select value from json_each(?))", (ids, )).rowcount
+
+    def move(self, conn, owner: int, path: str, newPath: str):
+        # one row changes whatever lies below the entry
+        fileId = self.lookup(owner, path, conn)
+        names = splitPath(newPath)
+        if not fileId or not names:
+            return False
+        parentId = self.ensure(conn, owner, posixpath.dirname('/' + '/'.join(names)))
+        replaced = self._child(conn, owner, parentId, names[-1])
+        if replaced is not None and replaced != fileId:
+            # whatever used to be at the new path is gone
+            self.remove(conn, owner, newPath)
+        conn.execute("update files set parentId = ?, name = ? where id = ?", (parentId, names[-1], fileId))
+        return True
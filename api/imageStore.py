@@ -0,0 +1,164 @@
+import io
+import logging
+import os
+import re
+import threading
+
+import api.utils as utils
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+
+variantSizes = (64, 256, 1024)
+
+extensions = {
+    'image/png': 'png',
+    'image/jpeg': 'jpg',
+    'image/gif': 'gif',
+    'image/webp': 'webp',
+    'image/bmp': 'bmp',
+    'application/octet-stream': 'bin'
+}
+
+mimes = {v: k for k, v in extensions.items()}
+
+
+def writeAtomically(path: str, data: bytes):
+    temp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temp, 'wb') as file:
+        file.write(data)
+    os.replace(temp, path)
+
+
+# content addressed image store under <blob path>/<name>/<hash[:2]>/<hash>/.
+# every image is stored once as original.<ext> next to downscaled <size>.<ext> variants,
+# objects are never modified once written.
+class imageStore:
+    def __init__(self, storeRoot, name: str, sizes: tuple = variantSizes) -> None:
+        # storeRoot is a callable, the blob path can change with the config
+        self.storeRoot = storeRoot
+        self.name = name
+        self.sizes = tuple(sorted(sizes))
+        self._logger = logging.getLogger("imageStore")
+        self._lock = threading.Lock()
+        self._files = {}
+        self._objects = {}
+        self._stored = 0
+        if Image is None:
+            self._logger.warning(f"Pillow is not installed, {name} images are served without resized variants")
+
+    def _objectDir(self, digest: str):
+        return os.path.abspath(f"{self.storeRoot()}/{self.name}/{digest[:2]}/{digest}")
+
+    def _makeVariants(self, data: bytes, mime: str):
+        if Image is None:
+            return {}
+        try:
+            image = Image.open(io.BytesIO(data))
+            image.load()
+        except Exception as e:
+            self._logger.warning(f"unable to decode image: {str(e)}")
+            return {}
+
+        variants = {}
+        hasAlpha = image.mode in ('RGBA', 'LA', 'PA') or 'transparency' in image.info
+        for size in self.sizes:
+            # never upscale, the original is served for anything at least its size
+            if size >= max(image.size):
+                break
+            variant = image.copy()
+            variant.thumbnail((size, size))
+            output = io.BytesIO()
+            if mime == 'image/jpeg' or not hasAlpha:
+                variant.convert('RGB').save(output, 'JPEG', quality=85)
+                variants[size] = ('jpg', output.getvalue())
+            else:
+                variant.save(output, 'PNG', optimize=True)
+                variants[size] = ('png', output.getvalue())
+        return variants
+
+    def store(self, data: bytes):
+        digest = utils.getContentHash(data)
+        if self._loadObject(digest) is not None:
+            return digest
+
+        objectDir = self._objectDir(digest)
+        mime = utils.detectImageMime(data)
+        os.makedirs(objectDir, exist_ok=True)
+        for size, (extension, variant) in self._makeVariants(data, mime).items():
+            writeAtomically(f"{objectDir}/{size}.{extension}", variant)
+        # the original goes last, its presence marks the object as complete
+        writeAtomically(f"{objectDir}/original.{extensions[mime]}", data)
+        with self._lock:
+            self._stored += 1
+        return digest
+
+    def _loadObject(self, digest: str):
+        # digests come from urls too, never let one escape the store
+        if not isinstance(digest, str) or re.fullmatch('[0-9a-f]{64}', digest) is None:
+            return None
+        with self._lock:
+            entry = self._objects.get(digest)
+        if entry is not None:
+            return entry
+
+        try:
+            names = os.listdir(self._objectDir(digest))
+        except OSError:
+            return None
+
+        entry = {}
+        for i in names:
+            name, extension = os.path.splitext(i)
+            mime = mimes.get(extension[1:])
+            if mime is None:
+                continue
+            elif name == 'original':
+                entry[0] = (i, mime)
+            elif name.isdigit():
+                entry[int(name)] = (i, mime)
+        if 0 not in entry:
+            return None
+
+        with self._lock:
+            self._objects[digest] = entry
+        return entry
+
+    def exists(self, digest: str):
+        return self._loadObject(digest) is not None
+
+    def resolve(self, digest: str, size: int = None):
+        # returns (file path, mime) of the smallest variant covering size, or the original
+        entry = self._loadObject(digest)
+        if entry is None:
+            raise RuntimeError(f"image {digest} not exist")
+
+        choice = entry[0]
+        if size is not None and size > 0:
+            for i in sorted(k for k in entry if k != 0):
+                if i >= size:
+                    choice = entry[i]
+                    break
+        return f"{self._objectDir(digest)}/{choice[0]}", choice[1]
+
+    def storeFile(self, path: str):
+        path = os.path.normpath(path)
+        st = os.stat(path)
+        key = (st.st_mtime, st.st_size)
+        with self._lock:
+            entry = self._files.get(path)
+        if entry is not None and entry[0] == key and self._loadObject(entry[1]) is not None:
+            return entry[1]
+
+        with open(path, 'rb') as file:
+            digest = self.store(file.read())
+        with self._lock:
+            self._files[path] = (key, digest)
+        return digest
+
+    def queryStats(self):
+        with self._lock:
+            return {'stored': self._stored, 'objects': len(self._objects)}
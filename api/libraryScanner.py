@@ -0,0 +1,151 @@
+import concurrent.futures
+import json
+import logging
+import mimetypes
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import api.utils as utils
+
+# the directory api is imported from, the tag readers run as python -m api.libraryScanner there
+packageRoot = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# the fewest paths handed to one reader, a fresh interpreter is not worth fewer
+minBatchSize = 16
+
+
+def readTags(path: str):
+    try:
+        return utils.getSongInfo(path)
+    except RuntimeError:
+        return None
+
+
+def readTagsBatch(paths: list):
+    # each batch is parsed by a fresh interpreter exec'd by subprocess. a multiprocessing pool
+    # would fork this threaded server, and its spawn and forkserver workers import __main__ again,
+    # which is app.py with the whole server behind it
+    process = subprocess.run([sys.executable, '-m', 'api.libraryScanner'], cwd=packageRoot,
+                             input=json.dumps(paths).encode(), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if process.returncode != 0:
+        raise RuntimeError(f"tag reader exited with status code {process.returncode}: "
+                           f"{process.stderr.decode(errors='replace').strip()}")
+    return json.loads(process.stdout)
+
+
+def walkAudioFiles(root: str):
+    # yields (drive relative path, st_mtime, st_size) of every audio file below root
+    stack = ['']
+    while stack:
+        relative = stack.pop()
+        try:
+            entries = os.scandir(os.path.join(root, relative.lstrip('/')))
+        except OSError:
+            continue
+        with entries:
+            for i in entries:
+                path = f"{relative}/{i.name}"
+                try:
+                    if i.is_dir(follow_symlinks=False):
+                        stack.append(path)
+                    elif i.is_file():
+                        mime = mimetypes.guess_type(i.name)[0]
+                        if mime is not None and mime.startswith('audio/'):
+                            st = i.stat()
+                            yield path, st.st_mtime, st.st_size
+                except OSError:
+                    continue
+
+
+# indexes the tags of every audio file in a user drive into the musicLibrary table.
+# re-scans only parse files whose mtime or size changed, fanning out over tag reader processes.
+class libraryScanner:
+    def __init__(self, db, workers: int = None) -> None:
+        self.db = db
+        self.workers = workers
+        self._logger = logging.getLogger("libraryScanner")
+        self._lock = threading.Lock()
+        self._states = {}
+
+    def queryState(self, uid: int):
+        with self._lock:
+            state = self._states.get(uid)
+            return dict(state) if state is not None else {'status': 'idle'}
+
+    def start(self, uid: int, driveRoot: str):
+        with self._lock:
+            state = self._states.get(uid)
+            if state is not None and state['status'] == 'scanning':
+                return False
+            self._states[uid] = {'status': 'scanning', 'startTime': time.time()}
+        threading.Thread(target=self._run, args=(uid, driveRoot),
+                         name=f"libraryScanner-{uid}", daemon=True).start()
+        return True
+
+    def _run(self, uid: int, driveRoot: str):
+        try:
+            result = self.scan(uid, driveRoot)
+            state = {'status': 'done', **result}
+        except Exception as e:
+            self._logger.error(f"library scan of user {uid} failed: {str(e)}")
+            state = {'status': 'failed', 'error': str(e)}
+        finally:
+            self.db.release()
+
+        with self._lock:
+            state['startTime'] = self._states[uid]['startTime']
+            state['endTime'] = time.time()
+            self._states[uid] = state
+
+    def scan(self, uid: int, driveRoot: str):
+        known = {}
+        for i in self.db.queryIter("select path, mtime, size from musicLibrary where owner = ?", (uid, )):
+            known[i['path']] = (i['mtime'], i['size'])
+
+        changed = []
+        seen = set()
+        for path, mtime, size in walkAudioFiles(driveRoot):
+            seen.add(path)
+            if known.get(path) != (mtime, size):
+                changed.append((path, mtime, size))
+        removed = [(uid, i) for i in known if i not in seen]
+
+        rows = []
+        if changed:
+            realPaths = [os.path.join(driveRoot, i[0].lstrip('/')) for i in changed]
+            workers = self.workers or os.cpu_count() or 1
+            batchSize = max(minBatchSize, -(-len(realPaths) // workers))
+            batches = [realPaths[i:i + batchSize] for i in range(0, len(realPaths), batchSize)]
+            with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+                infos = [info for batch in pool.map(readTagsBatch, batches) for info in batch]
+                for (path, mtime, size), info in zip(changed, infos):
+                    info = info if info is not None else {
+                        'title': '', 'album': '', 'artist': '', 'composer': '', 'length': 0}
+                    rows.append((uid, path, mtime, size, info['title'] or os.path.basename(path), info['album'],
+                                 info['artist'], info['composer'], info['length']))
+
+        def write(conn):
+            conn.executemany("""
+                insert into musicLibrary (owner, path, mtime, size, title, album, artist, composer, length)
+                values (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                on conflict (owner, path) do update set mtime = excluded.mtime, size = excluded.size, title = excluded.title,
+                album = excluded.album, artist = excluded.artist, composer = excluded.composer, length = excluded.length
+            """, rows)
+            conn.executemany(
+                "delete from musicLibrary where owner = ? and path = ?", removed)
+
+        self.db.transaction(write)
+        self.db.flush().result()
+        return {
+            'scanned': len(seen),
+            'updated': len(rows),
+            'removed': len(removed),
+            'unchanged': len(seen) - len(rows)
+        }
+
+
+if __name__ == "__main__":
+    # tag reader: a json list of paths on stdin, a json list of their tags or null on stdout
+    json.dump([readTags(i) for i in json.load(sys.stdin)], sys.stdout)
@@ -0,0 +1,130 @@
+import collections
+import concurrent.futures
+import os
+import threading
+
+import api.utils as utils
+
+
+def normalizePath(path: str):
+    return os.path.normpath(path)
+
+
+# caches the tags of audio files keyed by real path, validated against st_mtime and st_size.
+# lookups go through an in-memory LRU, then the songMetadata table, and only parse the file
+# with music_tag when both miss. parsing fans out over a bounded thread pool.
+class songMetadataCache:
+    def __init__(self, db, capacity: int = 4096, workers: int = 4) -> None:
+        self.db = db
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()
+        self._pool = concurrent.futures.ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="songMetadata")
+        self._stats = {'memoryHits': 0, 'tableHits': 0, 'extracted': 0, 'failed': 0}
+
+    def _remember(self, path, stat, info):
+        with self._lock:
+            self._entries[path] = (stat, info)
+            self._entries.move_to_end(path)
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+
+    def _extract(self, path):
+        try:
+            return utils.getSongInfo(path)
+        except RuntimeError:
+            return None
+
+    def getMany(self, paths: list):
+        result = {}
+        stats = {}
+        missing = []
+        for i in paths:
+            path = normalizePath(i)
+            try:
+                st = os.stat(path)
+            except OSError:
+                result[i] = None
+                continue
+            stats[path] = (st.st_mtime, st.st_size)
+
+            with self._lock:
+                entry = self._entries.get(path)
+                if entry is not None and entry[0] == stats[path]:
+                    self._entries.move_to_end(path)
+                    self._stats['memoryHits'] += 1
+                    result[i] = entry[1]
+                    continue
+            missing.append((i, path))
+
+        if not missing:
+            return result
+
+        # second level: the songMetadata table, queried in chunks to stay under the variable limit
+        rows = {}
+        keys = list({path for i, path in missing})
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            for row in self.db.query(f"select * from songMetadata where path in ({','.join('?' * len(chunk))})", chunk):
+                rows[row['path']] = row
+
+        extract = {}
+        for i, path in missing:
+            row = rows.get(path)
+            if row is not None and (row['mtime'], row['size']) == stats[path]:
+                info = {'title': row['title'], 'album': row['album'], 'artist': row['artist'],
+                        'composer': row['composer'], 'length': row['length']}
+                self._remember(path, stats[path], info)
+                with self._lock:
+                    self._stats['tableHits'] += 1
+                result[i] = info
+            else:
+                extract.setdefault(path, []).append(i)
+
+        if not extract:
+            return result
+
+        updates = []
+        for path, info in zip(extract, self._pool.map(self._extract, extract)):
+            self._remember(path, stats[path], info)
+            with self._lock:
+                self._stats['extracted' if info is not None else 'failed'] += 1
+            for i in extract[path]:
+                result[i] = info
+            if info is not None:
+                updates.append((path, *stats[path], info['title'], info['album'],
+                                info['artist'], info['composer'], info['length']))
+
+        if updates:
+            # written from the pool so the calling request doesn't wait on the commit
+            self._pool.submit(self.db.executeMany, """
+                insert into songMetadata (path, mtime, size, title, album, artist, composer, length)
+                values (?, ?, ?, ?, ?, ?, ?, ?)
+                on conflict (path) do update set mtime = excluded.mtime, size = excluded.size, title = excluded.title,
+                album = excluded.album, artist = excluded.artist, composer = excluded.composer, length = excluded.length
+            """, updates)
+        return result
+
+    def get(self, path: str):
+        info = self.getMany([path])[path]
+        if info is None:
+            raise RuntimeError("getSongInfo(): mutagen failed")
+        return dict(info)
+
+    def invalidate(self, path: str):
+        # drops the file itself and everything below it when it is a directory
+        path = normalizePath(path)
+        prefix = path + os.sep
+        with self._lock:
+            for i in [i for i in self._entries if i == path or i.startswith(prefix)]:
+                del self._entries[i]
+        self.db.execute(
+            "delete from songMetadata where path = ? or (path >= ? and path < ?)",
+            (path, prefix, path + chr(ord(os.sep) + 1)))
+
+    def queryStats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['cached'] = len(self._entries)
+        return stats
@@ -0,0 +1,387 @@
+"""
+XmediaCenter 2 schema migrations
+
+scripts/init.sql creates the base schema (version 0). Every later change to the schema is a
+forward migration in `migrations`, applied in order and recorded in the schemaVersion table.
+Released migrations must never be edited; append a new one instead.
+"""
+
+import hashlib
+import posixpath
+import sqlite3
+import time
+
+
+def createPlayCount(conn: sqlite3.Connection):
+    # instances older than playCount, previously upgraded with a one-off migrate.py
+    conn.execute("""
+        create table if not exists playCount (
+            id                  integer primary key autoincrement,
+            path                string not null,
+            owner               integer,
+            plays               integer default 0
+        )
+    """)
+    conn.execute("""
+        insert into playCount (path, owner)
+        select distinct songlist.path, playlists.owner from songlist
+        join playlists on playlists.id = songlist.playlistId
+        where not exists (
+            select 1 from playCount where playCount.path = songlist.path and playCount.owner = playlists.owner
+        )
+    """)
+
+
+def createHotPathIndexes(conn: sqlite3.Connection):
+    conn.execute(
+        "create index if not exists songlistPlaylistSort on songlist (playlistId, sortId)")
+    conn.execute("create index if not exists songlistPath on songlist (path)")
+    conn.execute("create index if not exists playCountPath on playCount (path)")
+    conn.execute(
+        "create index if not exists shareLinksOwnerPath on shareLinksList (owner, path)")
+    conn.execute(
+        "create index if not exists playlistsOwnerName on playlists (owner, name)")
+    conn.execute("create index if not exists taskListOwner on taskList (owner)")
+
+
+def uniquePlayCount(conn: sqlite3.Connection):
+    # fold duplicated (owner, path) records into the oldest one before adding the constraint
+    conn.execute("""
+        update playCount set plays = (
+            select sum(plays) from playCount dup where dup.owner is playCount.owner and dup.path = playCount.path
+        )
+        where id in (select min(id) from playCount group by owner, path having count(1) > 1)
+    """)
+    conn.execute("""
+        delete from playCount where id not in (select min(id) from playCount group by owner, path)
+    """)
+    conn.execute(
+        "create unique index if not exists playCountOwnerPath on playCount (owner, path)")
+
+
+def createSongMetadata(conn: sqlite3.Connection):
+    conn.execute("""
+        create table if not exists songMetadata (
+            path                string primary key,
+            mtime               real not null,
+            size                integer not null,
+            title               string,
+            album               string,
+            artist              string,
+            composer            string,
+            length              integer
+        )
+    """)
+
+
+def createMusicLibrary(conn: sqlite3.Connection):
+    # tag columns are text collate nocase so prefix LIKE searches can use the indexes
+    conn.execute("""
+        create table if not exists musicLibrary (
+            id                  integer primary key autoincrement,
+            owner               integer not null,
+            path                string not null,
+            mtime               real not null,
+            size                integer not null,
+            title               text collate nocase default '',
+            album               text collate nocase default '',
+            artist              text collate nocase default '',
+            composer            text collate nocase default '',
+            length              integer default 0,
+            unique (owner, path)
+        )
+    """)
+    conn.execute(
+        "create index if not exists musicLibraryArtist on musicLibrary (owner, artist, album, title)")
+    conn.execute(
+        "create index if not exists musicLibraryAlbum on musicLibrary (owner, album, title)")
+    conn.execute(
+        "create index if not exists musicLibraryTitle on musicLibrary (owner, title)")
+    conn.execute(
+        "create index if not exists musicLibraryComposer on musicLibrary (owner, composer, title)")
+
+
+def createSongArtwork(conn: sqlite3.Connection):
+    # hash is null when the file has no embedded artwork, so it isn't parsed again
+    conn.execute("""
+        create table if not exists songArtwork (
+            path                string primary key,
+            mtime               real not null,
+            size                integer not null,
+            hash                string
+        )
+    """)
+
+
+def addUserImageHashes(conn: sqlite3.Connection):
+    # lets the avatar routes answer conditional requests without reading the blobs
+    conn.create_function("sha256", 1, lambda data: hashlib.sha256(data).hexdigest() if data is not None else None,
+                         deterministic=True)
+    conn.execute("alter table users add column avatarHash string")
+    conn.execute("alter table users add column headImageHash string")
+    conn.execute("update users set avatarHash = sha256(avatar), headImageHash = sha256(headImage)")
+
+
+def addFileOffload(conn: sqlite3.Connection):
+    # fileOffloadMode is one of None, X-Sendfile or X-Accel-Redirect
+    conn.execute("alter table config add column fileOffloadMode string default 'None'")
+    conn.execute("alter table config add column fileOffloadPrefix string default '/xms-internal'")
+
+
+def moveUserImagesToStore(conn: sqlite3.Connection):
+    # avatars and head images move into the content addressed store under <blob path>/images
+    users = conn.execute("select id, avatar, headImage from users").fetchall()
+    if users:
+        # imported here, the store needs the image libraries only when there is something to move
+        import api.imageStore as imageStore
+        import api.utils as utils
+        root, blobPath = conn.execute("select xmsRootPath, xmsBlobPath from config").fetchone()
+        store = imageStore.imageStore(lambda: blobPath.replace('$', root), 'images')
+        for uid, avatar, headImage in users:
+            conn.execute("update users set avatarHash = ?, avatarMime = ?, headImageHash = ?, headImageMime = ? where id = ?",
+                         (store.store(avatar), utils.detectImageMime(avatar), store.store(headImage), utils.detectImageMime(headImage), uid))
+    conn.execute("alter table users drop column avatar")
+    conn.execute("alter table users drop column headImage")
+
+
+def createUploadSessions(conn: sqlite3.Connection):
+    # received is a json list of the half open byte ranges written so far
+    conn.execute("""
+        create table if not exists uploadSessions (
+            id                  string primary key,
+            owner               integer not null,
+            path                string not null,
+            realPath            string not null,
+            size                integer not null,
+            received            string default '[]',
+            creationTime        real not null,
+            updateTime          real not null
+        )
+    """)
+    conn.execute(
+        "create index if not exists uploadSessionsUpdateTime on uploadSessions (updateTime)")
+
+
+def addDriveDedup(conn: sqlite3.Connection):
+    conn.execute("alter table config add column driveDedup integer default 0")
+
+
+def createDriveIndex(conn: sqlite3.Connection):
+    # driveSearch is an external content table over driveIndex, the triggers keep them in sync.
+    # filled by buildSearchIndex.py for existing drives
+    conn.execute("""
+        create table if not exists driveIndex (
+            id                  integer primary key autoincrement,
+            owner               integer not null,
+            path                text not null,
+            name                text not null,
+            type                text not null,
+            mime                text not null,
+            size                integer default 0,
+            mtime               real default 0
+        )
+    """)
+    conn.execute(
+        "create unique index if not exists driveIndexOwnerPath on driveIndex (owner, path)")
+    conn.execute(
+        "create virtual table if not exists driveSearch using fts5(name, path, content='driveIndex', content_rowid='id', tokenize='trigram')")
+    conn.execute("""
+        create trigger if not exists driveIndexInsert after insert on driveIndex begin
+            insert into driveSearch (rowid, name, path) values (new.id, new.name, new.path);
+        end
+    """)
+    conn.execute("""
+        create trigger if not exists driveIndexDelete after delete on driveIndex begin
+            insert into driveSearch (driveSearch, rowid, name, path) values ('delete', old.id, old.name, old.path);
+        end
+    """)
+    conn.execute("""
+        create trigger if not exists driveIndexUpdate after update on driveIndex begin
+            insert into driveSearch (driveSearch, rowid, name, path) values ('delete', old.id, old.name, old.path);
+            insert into driveSearch (rowid, name, path) values (new.id, new.name, new.path);
+        end
+    """)
+
+
+def addDriveIndexTree(conn: sqlite3.Connection):
+    # parent lets the reconciler list a directory from the index, inode pairs up renames
+    conn.execute("alter table driveIndex add column parent text")
+    conn.execute("alter table driveIndex add column inode integer default 0")
+    conn.executemany("update driveIndex set parent = ? where id = ?",
+                     [(posixpath.dirname(path), id) for id, path in conn.execute("select id, path from driveIndex").fetchall()])
+    conn.execute(
+        "create index if not exists driveIndexOwnerParent on driveIndex (owner, parent)")
+
+
+def createDriveUsage(conn: sqlite3.Connection):
+    # bytes and files of every drive, kept by triggers on driveIndex so whatever indexes a
+    # change also accounts for it. driveQuota is in bytes, 0 is unlimited, null on a user
+    # falls back to the config
+    conn.execute("""
+        create table if not exists driveUsage (
+            owner               integer primary key,
+            bytes               integer default 0,
+            files               integer default 0,
+            verifiedTime        real
+        )
+    """)
+    conn.execute("""
+        create trigger if not exists driveUsageInsert after insert on driveIndex when new.type = 'file' begin
+            insert into driveUsage (owner, bytes, files) values (new.owner, new.size, 1)
+                on conflict (owner) do update set bytes = bytes + excluded.bytes, files = files + 1;
+        end
+    """)
+    conn.execute("""
+        create trigger if not exists driveUsageDelete after delete on driveIndex when old.type = 'file' begin
+            update driveUsage set bytes = bytes - old.size, files = files - 1 where owner = old.owner;
+        end
+    """)
+    conn.execute("""
+        create trigger if not exists driveUsageUpdate after update on driveIndex begin
+            update driveUsage set bytes = bytes - old.size, files = files - 1 where owner = old.owner and old.type = 'file';
+            insert into driveUsage (owner, bytes, files) select new.owner, new.size, 1 where new.type = 'file'
+                on conflict (owner) do update set bytes = bytes + excluded.bytes, files = files + 1;
+        end
+    """)
+    conn.execute(
+        "insert into driveUsage (owner, bytes, files) select owner, sum(size), count(1) from driveIndex where type = 'file' group by owner")
+    conn.execute("alter table config add column driveQuota integer default 0")
+    conn.execute("alter table users add column driveQuota integer")
+
+
+def createFiles(conn: sqlite3.Connection):
+    # songlist, playCount and share links refer to stable file ids instead of drive paths
+    conn.execute("""
+        create table if not exists files (
+            id                  integer primary key autoincrement,
+            owner               integer not null,
+            parentId            integer not null default 0,
+            name                string not null
+        )
+    """)
+    conn.execute(
+        "create unique index if not exists filesOwnerParentName on files (owner, parentId, name)")
+
+    def fileId(owner, path):
+        # creates the rows of the path and its parents, 0 is the drive root
+        parentId = 0
+        for name in [i for i in posixpath.normpath('/' + path.lstrip('/')).split('/') if i]:
+            conn.execute("insert into files (owner, parentId, name) values (?, ?, ?) on conflict do nothing",
+                         (owner, parentId, name))
+            parentId = conn.execute("select id from files where owner = ? and parentId = ? and name = ?",
+                                    (owner, parentId, name)).fetchone()[0]
+        return parentId
+
+    for table in ["songlist", "playCount", "shareLinksList"]:
+        conn.execute(f"alter table {table} add column fileId integer")
+
+    # songs of deleted playlists have no owner to resolve against
+    conn.execute("delete from songlist where playlistId not in (select id from playlists)")
+    for id, path, owner in conn.execute(
+            "select songlist.id, songlist.path, playlists.owner from songlist join playlists on playlists.id = songlist.playlistId").fetchall():
+        conn.execute("update songlist set fileId = ? where id = ?", (fileId(owner, path), id))
+
+    # spellings of one path collapse into one file, their counts are folded together
+    conn.execute("delete from playCount where owner is null")
+    kept = {}
+    for id, path, owner, plays in conn.execute("select id, path, owner, plays from playCount order by id").fetchall():
+        key = (fileId(owner, path), owner)
+        if key in kept:
+            conn.execute("update playCount set plays = plays + ? where id = ?", (plays or 0, kept[key]))
+            conn.execute("delete from playCount where id = ?", (id, ))
+        else:
+            kept[key] = id
+            conn.execute("update playCount set fileId = ? where id = ?", (key[0], id))
+
+    for id, path, owner in conn.execute("select id, path, owner from shareLinksList").fetchall():
+        conn.execute("update shareLinksList set fileId = ? where id = ?", (fileId(owner, path), id))
+
+    for index in ["songlistPath", "playCountPath", "playCountOwnerPath", "shareLinksOwnerPath"]:
+        conn.execute(f"drop index if exists {index}")
+    for table in ["songlist", "playCount", "shareLinksList"]:
+        conn.execute(f"alter table {table} drop column path")
+    conn.execute("create index if not exists songlistFileId on songlist (fileId)")
+    conn.execute(
+        "create unique index if not exists playCountFileOwner on playCount (fileId, owner)")
+    conn.execute("create index if not exists playCountOwner on playCount (owner)")
+    conn.execute(
+        "create index if not exists shareLinksOwnerFile on shareLinksList (owner, fileId)")
+    conn.execute("create index if not exists shareLinksFileId on shareLinksList (fileId)")
+
+
+def addTaskStates(conn: sqlite3.Connection):
+    # tasks that never recorded an end were lost with the threads that ran them
+    conn.execute("alter table taskList add column state string not null default 'queued'")
+    conn.execute("alter table taskList add column priority integer not null default 0")
+    conn.execute("alter table taskList add column startTime string")
+    conn.execute(
+        "update taskList set state = case when endTime = '0000-00-00 00:00:00' then 'failed' else 'done' end")
+    conn.execute("create index if not exists taskListState on taskList (state)")
+
+
+def addTaskLogSeq(conn: sqlite3.Connection):
+    # sequence number of the line after the last one of logText, lines are numbered from 0
+    conn.execute("alter table taskList add column logSeq integer not null default 0")
+    for id, logText in conn.execute("select id, logText from taskList where logText != ''").fetchall():
+        conn.execute("update taskList set logSeq = ? where id = ?", (len(logText.splitlines()), id))
+
+
+def addDriveDedupHardlinks(conn: sqlite3.Connection):
+    # deduplicated files of different drives may only share an inode when an admin opts in
+    conn.execute("alter table config add column driveDedupHardlinks integer default 0")
+
+
+migrations = [
+    (1, "create playCount for old instances", createPlayCount),
+    (2, "add indexes for hot queries", createHotPathIndexes),
+    (3, "make playCount unique per (owner, path)", uniquePlayCount),
+    (4, "cache audio metadata by path", createSongMetadata),
+    (5, "index music library tags", createMusicLibrary),
+    (6, "map songs to cached artwork", createSongArtwork),
+    (7, "store content hashes of user images", addUserImageHashes),
+    (8, "configure proxy file offload", addFileOffload),
+    (9, "move user images into the image store", moveUserImagesToStore),
+    (10, "track resumable upload sessions", createUploadSessions),
+    (11, "configure deduplicating drive storage", addDriveDedup),
+    (12, "index drive paths for search", createDriveIndex),
+    (13, "track drive index parents and inodes", addDriveIndexTree),
+    (14, "account drive usage and quotas", createDriveUsage),
+    (15, "refer to drive entries by stable file ids", createFiles),
+    (16, "track task states and priorities", addTaskStates),
+    (17, "number task log lines", addTaskLogSeq),
+    (18, "make hardlinked deduplication opt-in", addDriveDedupHardlinks),
+]
+
+latestVersion = migrations[-1][0]
+
+
+def getSchemaVersion(conn: sqlite3.Connection):
+    conn.execute("""
+        create table if not exists schemaVersion (
+            version             integer primary key,
+            description         string not null,
+            appliedTime         string not null
+        )
+    """)
+    return conn.execute("select coalesce(max(version), 0) from schemaVersion").fetchone()[0]
+
+
+def applyMigrations(conn: sqlite3.Connection):
+    applied = []
+    current = getSchemaVersion(conn)
+    for version, description, migration in migrations:
+        if version <= current:
+            continue
+
+        conn.execute("savepoint migration")
+        try:
+            migration(conn)
+            conn.execute("insert into schemaVersion (version, description, appliedTime) values (?, ?, ?)",
+                         (version, description, time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(time.time()))))
+            conn.execute("release migration")
+        except Exception:
+            conn.execute("rollback to migration")
+            conn.execute("release migration")
+            raise
+        applied.append(version)
+    return applied
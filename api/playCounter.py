@@ -0,0 +1,91 @@
+import atexit
+import logging
+import sqlite3
+import threading
+
+
+# collects song and playlist play count increments in memory and writes them out periodically
+# as one batch of atomic updates, so a play event never waits on the database
+class playCounter:
+    def __init__(self, db, flushInterval: float = 5) -> None:
+        self.db = db
+        self.flushInterval = flushInterval
+        self._logger = logging.getLogger("playCounter")
+        self._lock = threading.Lock()
+        self._songs = {}
+        self._playlists = {}
+        self._flushed = 0
+        self._stop = threading.Event()
+        self._thread = None
+        atexit.register(self.close)
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._flushLoop, name="playCounter", daemon=True)
+                self._thread.start()
+
+    def _flushLoop(self):
+        while not self._stop.wait(self.flushInterval):
+            self.flush()
+
+    def increaseSong(self, owner: int, fileId: int, plays: int = 1):
+        if self._thread is None:
+            self._start()
+        key = (owner, fileId)
+        with self._lock:
+            self._songs[key] = self._songs.get(key, 0) + plays
+
+    def increasePlaylist(self, playlistId: int, plays: int = 1):
+        if self._thread is None:
+            self._start()
+        with self._lock:
+            self._playlists[playlistId] = self._playlists.get(playlistId, 0) + plays
+
+    def pending(self):
+        with self._lock:
+            return sum(self._songs.values()) + sum(self._playlists.values())
+
+    def flush(self):
+        with self._lock:
+            songs, self._songs = self._songs, {}
+            playlists, self._playlists = self._playlists, {}
+        if not songs and not playlists:
+            return 0
+
+        def write(conn):
+            # rows are created by insertSongToPlaylist, a play never adds one of its own
+            conn.executemany(
+                "update playCount set plays = plays + ? where fileId = ? and owner = ?",
+                [(plays, fileId, owner) for (owner, fileId), plays in songs.items()])
+            conn.executemany(
+                "update playlists set playCount = playCount + ? where id = ?",
+                [(plays, playlistId) for playlistId, plays in playlists.items()])
+
+        try:
+            # returns after the commit and raises if it failed, so nothing is counted twice or lost
+            self.db.transaction(write)
+        except sqlite3.Error as e:
+            # keep the increments around for the next round
+            self._logger.error(f"unable to flush play counts: {str(e)}")
+            for (owner, fileId), plays in songs.items():
+                self.increaseSong(owner, fileId, plays)
+            for playlistId, plays in playlists.items():
+                self.increasePlaylist(playlistId, plays)
+            return 0
+
+        flushed = sum(songs.values()) + sum(playlists.values())
+        with self._lock:
+            self._flushed += flushed
+        return flushed
+
+    def queryStats(self):
+        return {'pending': self.pending(), 'flushed': self._flushed}
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
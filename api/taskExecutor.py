@@ -0,0 +1,184 @@
+import bisect
+import itertools
+import logging
+import os
+import signal
+import subprocess
+import threading
+import time
+
+taskWorkers = 4
+# tasks of one plugin and of one user running at once, a plugin can lower its own
+# limit with 'concurrency' in its registry
+pluginConcurrency = 2
+userConcurrency = 2
+# seconds between SIGTERM and SIGKILL of a cancelled task's processes
+killGrace = 5
+
+
+def getCurrentTime():
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(time.time()))
+
+
+def isUnreaped(process: subprocess.Popen):
+    # true while the pid still belongs to our child, running or a zombie. checked with WNOWAIT,
+    # so whoever waits for the process still gets its status
+    if process.returncode is not None:
+        return False
+    try:
+        os.waitid(os.P_PID, process.pid, os.WEXITED | os.WNOHANG | os.WNOWAIT)
+        return True
+    except ChildProcessError:
+        return False
+
+
+def killProcessGroup(process: subprocess.Popen, grace: float = killGrace):
+    # children run in their own session, so the group takes everything they spawned with it
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+    except (ProcessLookupError, PermissionError):
+        return
+
+    def kill():
+        # once the leader is reaped its pid, and with it the group id, may be reused
+        if not isUnreaped(process):
+            return
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            pass
+
+    timer = threading.Timer(grace, kill)
+    timer.daemon = True
+    timer.start()
+    return timer
+
+
+# runs plugin tasks on a fixed number of worker threads. queued tasks wait in priority order,
+# higher first and oldest first within a priority, and a worker takes the first one whose plugin
+# and owner are under their concurrency limits. every state change is written to taskList, so
+# queued tasks survive a restart and are submitted again by dataManager.resumeTasks().
+class taskExecutor:
+    def __init__(self, db, workers: int = taskWorkers, userLimit: int = userConcurrency) -> None:
+        self.db = db
+        self.workers = workers
+        self.userLimit = userLimit
+        self.pluginLimits = {}
+        self._logger = logging.getLogger("taskExecutor")
+        self._cond = threading.Condition()
+        self._queue = []
+        self._running = {}
+        self._runningPlugins = {}
+        self._runningUsers = {}
+        self._seq = itertools.count()
+        self._threads = []
+        self._listeners = []
+        self._stats = {'done': 0, 'failed': 0, 'cancelled': 0}
+
+    def _start(self):
+        with self._cond:
+            while len(self._threads) < self.workers:
+                thread = threading.Thread(
+                    target=self._work, name=f"taskExecutor-{len(self._threads)}", daemon=True)
+                self._threads.append(thread)
+                thread.start()
+
+    def submit(self, job: dict):
+        # job: {'id', 'owner', 'plugin', 'priority', 'taskInfo', 'run'}, run() calls the handler
+        if len(self._threads) < self.workers:
+            self._start()
+        with self._cond:
+            bisect.insort(self._queue, (-job['priority'], next(self._seq), job['id'], job))
+            self._cond.notify()
+
+    def _eligible(self, job: dict):
+        return self._runningPlugins.get(job['plugin'], 0) < self.pluginLimits.get(job['plugin'], pluginConcurrency) \
+            and self._runningUsers.get(job['owner'], 0) < self.userLimit
+
+    def _take(self):
+        for index, (_, _, _, job) in enumerate(self._queue):
+            if self._eligible(job):
+                del self._queue[index]
+                self._running[job['id']] = job
+                self._runningPlugins[job['plugin']] = self._runningPlugins.get(job['plugin'], 0) + 1
+                self._runningUsers[job['owner']] = self._runningUsers.get(job['owner'], 0) + 1
+                return job
+        return None
+
+    def listen(self, listener):
+        # listener(taskId, state) runs after every state change has been committed
+        self._listeners.append(listener)
+
+    def _setState(self, taskId: int, state: str, **columns):
+        assignments = ''.join(f", {i} = ?" for i in columns)
+        self.db.execute(f"update taskList set state = ?{assignments} where id = ?",
+                        (state, *columns.values(), taskId))
+        if self._listeners:
+            self.db.flush().result()
+        for listener in self._listeners:
+            listener(taskId, state)
+
+    def _work(self):
+        while True:
+            with self._cond:
+                job = self._take()
+                while job is None:
+                    self._cond.wait()
+                    job = self._take()
+
+            taskInfo = job['taskInfo']
+            state = 'done'
+            try:
+                self._setState(job['id'], 'running', startTime=getCurrentTime())
+                if not taskInfo.cancelled.is_set():
+                    job['run']()
+                if taskInfo.cancelled.is_set():
+                    state = 'cancelled'
+                elif taskInfo.failed:
+                    state = 'failed'
+            except Exception as e:
+                state = 'cancelled' if taskInfo.cancelled.is_set() else 'failed'
+                self._logger.error(f"task {job['id']} failed: {str(e)}")
+            finally:
+                with self._cond:
+                    del self._running[job['id']]
+                    self._runningPlugins[job['plugin']] -= 1
+                    self._runningUsers[job['owner']] -= 1
+                    self._stats[state] += 1
+                    self._cond.notify_all()
+                try:
+                    self._setState(job['id'], state, endTime=getCurrentTime())
+                except Exception as e:
+                    self._logger.error(f"unable to record the end of task {job['id']}: {str(e)}")
+                # give the thread's connection back to the pool
+                self.db.release()
+
+    def cancel(self, taskId: int):
+        # a queued task never starts, a running one has its processes killed
+        with self._cond:
+            for index, (_, _, queuedId, job) in enumerate(self._queue):
+                if queuedId == taskId:
+                    del self._queue[index]
+                    self._stats['cancelled'] += 1
+                    break
+            else:
+                job = self._running.get(taskId)
+                if job is None:
+                    return False
+                job['taskInfo'].cancel()
+                return True
+        job['taskInfo'].cancelled.set()
+        self._setState(taskId, 'cancelled', endTime=getCurrentTime())
+        return True
+
+    def contains(self, taskId: int):
+        with self._cond:
+            return taskId in self._running or any(i[2] == taskId for i in self._queue)
+
+    def queryStats(self):
+        with self._cond:
+            stats = dict(self._stats)
+            stats['queued'] = len(self._queue)
+            stats['running'] = len(self._running)
+            stats['workers'] = self.workers
+        return stats
@@ -0,0 +1,203 @@
+import atexit
+import collections
+import itertools
+import logging
+import sqlite3
+import threading
+
+# lines kept per task, older ones are dropped as new ones arrive
+logCapacity = 1000
+maxLineLength = 4096
+
+
+class taskLog:
+    def __init__(self, lines: list = (), nextSeq: int = None, capacity: int = logCapacity) -> None:
+        self.lines = collections.deque(lines, maxlen=capacity)
+        self.nextSeq = nextSeq if nextSeq is not None else len(self.lines)
+        self.dirty = False
+        self.state = None
+        self.progress = None
+
+    def append(self, text: str):
+        for line in text.splitlines():
+            self.lines.append(line[:maxLineLength])
+            self.nextSeq += 1
+        self.dirty = True
+
+    def read(self, since: int = 0):
+        # lines numbered since onwards, truncated when some of them were already dropped
+        first = self.nextSeq - len(self.lines)
+        start = max(since - first, 0)
+        return {
+            'lines': [{'seq': first + index, 'text': line}
+                      for index, line in enumerate(itertools.islice(self.lines, start, None), start)],
+            'next': self.nextSeq,
+            'truncated': since < first
+        }
+
+    def text(self):
+        return '\n'.join(self.lines)
+
+
+# append only task logs. every line gets a sequence number, so a client polling with since= only
+# receives what is new. the lines of running tasks live in memory and are checkpointed to
+# taskList.logText/logSeq every checkpointInterval seconds in one transaction, instead of the
+# whole text being rewritten for every update. logs of finished tasks are read back from the table.
+# the state and the latest progress report of a live task are kept next to its lines, and wait()
+# lets followers block until any of them changes.
+class taskLogStore:
+    def __init__(self, db, checkpointInterval: float = 2, capacity: int = logCapacity) -> None:
+        self.db = db
+        self.checkpointInterval = checkpointInterval
+        self.capacity = capacity
+        self._logger = logging.getLogger("taskLogs")
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._logs = {}
+        # bumped on every change of a task, including its log leaving memory. followers wait for it to move
+        self._versions = {}
+        self._checkpoints = 0
+        self._stop = threading.Event()
+        self._thread = None
+        atexit.register(self.close)
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._checkpointLoop, name="taskLogs", daemon=True)
+                self._thread.start()
+
+    def _checkpointLoop(self):
+        while not self._stop.wait(self.checkpointInterval):
+            self.checkpoint()
+
+    def _load(self, taskId: int):
+        row = self.db.query("select logText, logSeq from taskList where id = ?", (taskId, ), one=True)
+        if row is None:
+            return None
+        lines = row['logText'].splitlines() if row['logText'] else []
+        return taskLog(lines, max(row['logSeq'], len(lines)), self.capacity)
+
+    def _touch(self, taskId: int):
+        self._versions[taskId] = self._versions.get(taskId, 0) + 1
+        self._changed.notify_all()
+
+    def _live(self, taskId: int):
+        # the in-memory log of a task, picking up where a checkpoint left off
+        if self._thread is None:
+            self._start()
+        with self._lock:
+            log = self._logs.get(taskId)
+        if log is None:
+            loaded = self._load(taskId) or taskLog(capacity=self.capacity)
+            with self._lock:
+                log = self._logs.setdefault(taskId, loaded)
+        return log
+
+    def append(self, taskId: int, text: str):
+        log = self._live(taskId)
+        with self._lock:
+            log.append(text)
+            self._touch(taskId)
+
+    def replace(self, taskId: int, text: str):
+        # numbering carries on, readers behind the new first line see truncated
+        log = self._live(taskId)
+        with self._lock:
+            log.lines.clear()
+            log.append(text)
+            self._touch(taskId)
+
+    def setState(self, taskId: int, state: str):
+        log = self._live(taskId)
+        with self._lock:
+            log.state = state
+            self._touch(taskId)
+
+    def setProgress(self, taskId: int, progress: dict):
+        # only the latest report is kept, a follower that missed one gets the next
+        log = self._live(taskId)
+        with self._lock:
+            log.progress = progress
+            self._touch(taskId)
+
+    def snapshot(self, taskId: int):
+        # {'version', 'live', 'state', 'progress'}, state and progress are only known while live
+        with self._lock:
+            log = self._logs.get(taskId)
+            return {'version': self._versions.get(taskId, 0), 'live': log is not None,
+                    'state': log.state if log is not None else None,
+                    'progress': log.progress if log is not None else None}
+
+    def wait(self, taskId: int, version: int, timeout: float):
+        # blocks until the task changes after the snapshot of the given version, or timeout passes
+        with self._changed:
+            return self._changed.wait_for(lambda: self._versions.get(taskId, 0) != version, timeout)
+
+    def read(self, taskId: int, since: int = 0):
+        with self._lock:
+            log = self._logs.get(taskId)
+            if log is not None:
+                return log.read(since)
+        log = self._load(taskId)
+        return log.read(since) if log is not None else None
+
+    def text(self, taskId: int):
+        # the retained text of a live task, None once it is only in the table
+        with self._lock:
+            log = self._logs.get(taskId)
+            return log.text() if log is not None else None
+
+    def checkpoint(self, taskIds: list = None):
+        with self._lock:
+            dirty = []
+            for taskId, log in self._logs.items():
+                if log.dirty and (taskIds is None or taskId in taskIds):
+                    dirty.append((log.text(), log.nextSeq, taskId))
+                    log.dirty = False
+        if not dirty:
+            return 0
+
+        try:
+            self.db.executeMany("update taskList set logText = ?, logSeq = ? where id = ?", dirty)
+        except sqlite3.Error as e:
+            self._logger.error(f"unable to checkpoint task logs: {str(e)}")
+            with self._lock:
+                for _, _, taskId in dirty:
+                    if taskId in self._logs:
+                        self._logs[taskId].dirty = True
+            return 0
+
+        with self._lock:
+            self._checkpoints += len(dirty)
+        return len(dirty)
+
+    def finish(self, taskId: int):
+        # a finished task is written out and from then on only read from the table,
+        # committed first so readers never find the table behind the memory they lost
+        self.checkpoint([taskId])
+        self.db.flush().result()
+        with self._lock:
+            log = self._logs.get(taskId)
+            if log is not None and not log.dirty:
+                del self._logs[taskId]
+                self._touch(taskId)
+
+    def discard(self, taskId: int):
+        with self._lock:
+            self._logs.pop(taskId, None)
+            self._versions.pop(taskId, None)
+            self._changed.notify_all()
+
+    def queryStats(self):
+        with self._lock:
+            return {'live': len(self._logs), 'bufferedLines': sum(len(i.lines) for i in self._logs.values()),
+                    'checkpoints': self._checkpoints}
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.checkpoint()
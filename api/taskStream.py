@@ -0,0 +1,49 @@
+import json
+
+# seconds without an event before a comment line keeps the connection alive
+heartbeatInterval = 15
+# log lines sent in one event at most
+maxBatch = 200
+finalStates = ('done', 'failed', 'cancelled')
+
+
+def formatEvent(event: str, data, eventId: int = None):
+    lines = [f"event: {event}"]
+    if eventId is not None:
+        lines.append(f"id: {eventId}")
+    lines.append(f"data: {json.dumps(data)}")
+    return '\n'.join(lines) + '\n\n'
+
+
+def followTask(logs, queryState, taskId: int, cursor: int = 0, heartbeat: float = heartbeatInterval):
+    # server-sent events of one task: 'log' with appended lines, 'state' on transitions, 'progress'
+    # with the latest report and 'end' once it finished. an event id is the log cursor to resume from,
+    # as Last-Event-ID. nothing is queued per follower, each wake reads what is new from the task's
+    # ring buffer, so a slow client only holds its own cursor. queryState(taskId) reads the state
+    # from the table, None when the task is gone.
+    state = None
+    progress = None
+    while True:
+        snapshot = logs.snapshot(taskId)
+        log = logs.read(taskId, cursor)
+        current = snapshot['state'] if snapshot['state'] is not None else queryState(taskId)
+        if log is None or current is None:
+            yield formatEvent('end', {'state': None, 'message': 'task not exist'})
+            return
+
+        for start in range(0, len(log['lines']), maxBatch):
+            lines = log['lines'][start:start + maxBatch]
+            yield formatEvent('log', {'lines': lines, 'truncated': log['truncated'] and start == 0}, lines[-1]['seq'] + 1)
+        cursor = log['next']
+        if current != state:
+            state = current
+            yield formatEvent('state', {'state': state}, cursor)
+        if snapshot['progress'] is not None and snapshot['progress'] != progress:
+            progress = snapshot['progress']
+            yield formatEvent('progress', progress, cursor)
+        if not snapshot['live'] and state in finalStates:
+            yield formatEvent('end', {'state': state}, cursor)
+            return
+
+        if not logs.wait(taskId, snapshot['version'], heartbeat):
+            yield ': heartbeat\n\n'
@@ -0,0 +1,212 @@
+import hashlib
+import json
+import logging
+import os
+import secrets
+import shutil
+import tempfile
+import threading
+import time
+
+import api.utils as utils
+
+chunkSize = 8 * 1024 * 1024
+maxChunkSize = 64 * 1024 * 1024
+sessionTTL = 24 * 60 * 60
+gcInterval = 10 * 60
+
+
+def mergeRange(ranges: list, start: int, end: int):
+    # ranges are sorted, disjoint, half open [start, end) pairs
+    result = []
+    for i in sorted(ranges + [[start, end]]):
+        if result and i[0] <= result[-1][1]:
+            result[-1][1] = max(result[-1][1], i[1])
+        else:
+            result.append(list(i))
+    return result
+
+
+# resumable uploads: a session names the target file and its size, every chunk is spooled and
+# verified first and then written at its offset into a preallocated part file under
+# <blob path>/uploads, and finalizing renames the part file over the target once every byte has
+# been received.
+class uploadSessionManager:
+    def __init__(self, db, storeRoot) -> None:
+        # storeRoot is a callable, the blob path can change with the config
+        self.db = db
+        self.storeRoot = storeRoot
+        self._logger = logging.getLogger("uploadSessions")
+        self._lock = threading.Lock()
+        self._lastCollection = 0
+
+    def _partPath(self, sessionId: str):
+        return f"{self.storeRoot()}/uploads/{sessionId}.part"
+
+    def _load(self, uid: int, sessionId: str):
+        d = self.db.query(
+            "select * from uploadSessions where id = ?", (sessionId, ), one=True)
+        if d is None or d['owner'] != uid:
+            return utils.makeResult(False, "upload session not exist")
+        d['received'] = json.loads(d['received'])
+        d['complete'] = d['received'] == [[0, d['size']]] or d['size'] == 0
+        return utils.makeResult(True, d)
+
+    def querySession(self, uid: int, sessionId: str):
+        session = self._load(uid, sessionId)
+        if session['ok']:
+            # the server side path stays private
+            del session['data']['realPath']
+        return session
+
+    def create(self, uid: int, path: str, realPath: str, size: int):
+        self.collectGarbage()
+        if size < 0:
+            return utils.makeResult(False, "invalid size")
+        if not os.path.isdir(os.path.dirname(realPath)):
+            return utils.makeResult(False, f"not a directory: {os.path.dirname(path)}")
+
+        sessionId = secrets.token_hex(16)
+        partPath = self._partPath(sessionId)
+        try:
+            os.makedirs(os.path.dirname(partPath), exist_ok=True)
+            with open(partPath, 'wb') as file:
+                # reserve the space up front, a full disk fails here instead of mid upload
+                if size > 0 and hasattr(os, 'posix_fallocate'):
+                    os.posix_fallocate(file.fileno(), 0, size)
+                else:
+                    file.truncate(size)
+        except OSError as e:
+            if os.path.exists(partPath):
+                os.remove(partPath)
+            return utils.makeResult(False, str(e))
+
+        now = time.time()
+        self.db.execute("insert into uploadSessions (id, owner, path, realPath, size, received, creationTime, updateTime) values (?, ?, ?, ?, ?, ?, ?, ?)",
+                        (sessionId, uid, path, realPath, size, '[]', now, now))
+        return utils.makeResult(True, {"id": sessionId, "size": size, "chunkSize": chunkSize, "expires": now + sessionTTL})
+
+    def writeChunk(self, uid: int, sessionId: str, offset: int, length: int, checksum: str, stream):
+        session = self._load(uid, sessionId)
+        if not session['ok']:
+            return session
+        session = session['data']
+        if length is None or length > maxChunkSize:
+            return utils.makeResult(False, f"chunks need a Content-Length of at most {maxChunkSize} bytes")
+        if offset < 0 or offset + length > session['size']:
+            return utils.makeResult(False, "chunk out of range")
+        if checksum is None:
+            return utils.makeResult(False, "missing chunk checksum")
+
+        # the chunk is spooled and verified before it touches the part file, a bad retry of a range
+        # that was already received must not overwrite the good bytes counted for it
+        digest = hashlib.sha256()
+        written = 0
+        try:
+            with tempfile.SpooledTemporaryFile(max_size=chunkSize, dir=os.path.dirname(self._partPath(sessionId))) as spool:
+                while written < length:
+                    data = stream.read(min(1024 * 1024, length - written))
+                    if not data:
+                        break
+                    digest.update(data)
+                    spool.write(data)
+                    written += len(data)
+
+                if written != length:
+                    return utils.makeResult(False, "chunk truncated")
+                if digest.hexdigest() != checksum.lower():
+                    return utils.makeResult(False, "chunk checksum mismatch")
+
+                spool.seek(0)
+                fd = os.open(self._partPath(sessionId), os.O_WRONLY)
+                try:
+                    position = 0
+                    while position < length:
+                        data = spool.read(min(1024 * 1024, length - position))
+                        os.pwrite(fd, data, offset + position)
+                        position += len(data)
+                finally:
+                    os.close(fd)
+        except OSError as e:
+            return utils.makeResult(False, str(e))
+
+        def record(conn):
+            row = conn.execute(
+                "select received from uploadSessions where id = ?", (sessionId, )).fetchone()
+            if row is None:
+                return None
+            received = mergeRange(json.loads(row[0]), offset, offset + length)
+            conn.execute("update uploadSessions set received = ?, updateTime = ? where id = ?",
+                         (json.dumps(received), time.time(), sessionId))
+            return received
+
+        received = self.db.transaction(record)
+        if received is None:
+            return utils.makeResult(False, "upload session not exist")
+        return utils.makeResult(True, {"received": received})
+
+    def finalize(self, uid: int, sessionId: str):
+        session = self._load(uid, sessionId)
+        if not session['ok']:
+            return session
+        session = session['data']
+        if not session['complete']:
+            return utils.makeResult(False, "upload incomplete")
+
+        partPath = self._partPath(sessionId)
+        try:
+            with open(partPath, 'rb+') as file:
+                os.fsync(file.fileno())
+            try:
+                os.replace(partPath, session['realPath'])
+            except OSError:
+                # the drive lives on another filesystem than the blob path
+                shutil.move(partPath, session['realPath'])
+        except OSError as e:
+            return utils.makeResult(False, str(e))
+
+        self.db.execute("delete from uploadSessions where id = ?", (sessionId, ))
+        return utils.makeResult(True, "success")
+
+    def abort(self, uid: int, sessionId: str):
+        session = self._load(uid, sessionId)
+        if not session['ok']:
+            return session
+        self._remove(sessionId)
+        return utils.makeResult(True, "success")
+
+    def _remove(self, sessionId: str):
+        self.db.execute("delete from uploadSessions where id = ?", (sessionId, ))
+        try:
+            os.remove(self._partPath(sessionId))
+        except OSError:
+            pass
+
+    def collectGarbage(self, force: bool = False):
+        # drops sessions idle for longer than sessionTTL and part files nobody owns anymore
+        with self._lock:
+            if not force and time.time() - self._lastCollection < gcInterval:
+                return 0
+            self._lastCollection = time.time()
+
+        stale = [i['id'] for i in self.db.query(
+            "select id from uploadSessions where updateTime < ?", (time.time() - sessionTTL, ))]
+        for i in stale:
+            self._remove(i)
+
+        try:
+            names = os.listdir(f"{self.storeRoot()}/uploads")
+        except OSError:
+            return len(stale)
+        known = {i['id'] for i in self.db.query("select id from uploadSessions")}
+        for i in names:
+            if i.endswith('.part') and i[:-5] not in known:
+                try:
+                    if time.time() - os.stat(f"{self.storeRoot()}/uploads/{i}").st_mtime > sessionTTL:
+                        os.remove(f"{self.storeRoot()}/uploads/{i}")
+                        stale.append(i[:-5])
+                except OSError:
+                    pass
+        if stale:
+            self._logger.info(f"collected {len(stale)} stale upload session(s)")
+        return len(stale)
@@ -72,15 +72,36 @@ def getSongInfo(songPath: str):
         raise RuntimeError("getSongInfo(): mutagen failed")
 
 
+def detectImageMime(data: bytes):
+    if data.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'image/png'
+    elif data.startswith(b'\xff\xd8\xff'):
+        return 'image/jpeg'
+    elif data.startswith((b'GIF87a', b'GIF89a')):
+        return 'image/gif'
+    elif data.startswith(b'RIFF') and data[8:12] == b'WEBP':
+        return 'image/webp'
+    elif data.startswith(b'BM'):
+        return 'image/bmp'
+    else:
+        return 'application/octet-stream'
+
+
 def getSongArtwork(songPath: str):
     file = music_tag.load_file(songPath)
-    print("where's my change", file['artwork'].first)
+    artwork = file['artwork'].first
+    if artwork is None:
+        raise RuntimeError("getSongArtwork(): no embedded artwork")
     return {
-        'mime': 'image/png',  
-        'artwork': file['artwork'].first.data  
+        'mime': detectImageMime(artwork.data),
+        'artwork': artwork.data
     }
 
 
+def getContentHash(data: bytes):
+    return hashlib.sha256(data).hexdigest()
+
+
 def getRandom10CharString(salt):
     return hashlib.md5(f'{int(time.time() * 100)}{str(salt)}{random.randint(0, 114514191)}'.encode('utf-8')).hexdigest()[0:10]
 
@@ -10,6 +10,7 @@ import json
 from io import BytesIO
 
 import api.dataManager
+import api.fileResponse
 import api.utils
 import api.xms
 
@@ -20,6 +21,16 @@ dataManager = api.dataManager.dataManager(
     database, "./root", "./plugins", plugins.enabled)
 
 webLogger = logging.Logger("webApplication")
+
+# bring the database up to the schema this build expects before serving anything
+schemaState = dataManager.upgradeSchema()
+if not schemaState['ok']:
+    webLogger.error(f"schema check failed: {schemaState['data']}")
+else:
+    dataManager.uploadSessions.collectGarbage(force=True)
+    dataManager.reconciler.start()
+    dataManager.driveUsage.start()
+    dataManager.resumeTasks()
 webApplication = flask.Flask(__name__)
 
 flask_cors.CORS(webApplication)
@@ -32,56 +43,44 @@ def checkIfLoggedInSession(s):
     return json.loads(api.flaskSession.decode(s))['loginState']
 
 
-def parseRequestRange(s, flen):
-    s = s[s.find('=')+1:]
-    c = s.split('-')
-    if len(c) != 2:
+def parseListingArgs(data, maxLimit=5000):
+    # sort, order, limit and cursor of a directory listing request, limit is optional
+    sort = data.get('sort', 'name')
+    order = data.get('order', 'asc')
+    limit = data.get('limit')
+    cursor = data.get('cursor')
+    if not isinstance(sort, str) or not isinstance(order, str) or \
+            (limit is not None and (not isinstance(limit, int) or limit <= 0)) or \
+            (cursor is not None and not isinstance(cursor, str)):
         return None
-    else:
-        if c[0] == '' and c[1] == '':
-            return [0, flen - 1]
-        elif c[1] == '':
-            return [int(c[0]), flen - 1]
-        elif c[0] == '':
-            return [flen - int(c[1]) - 1, flen - 1]
-        else:
-            return [int(i) for i in c]
+    return sort, order, min(limit, maxLimit) if limit is not None else None, cursor
 
 
-def makeFileResponse(path, mime):
-    isPreview = not mime.startswith('application')
-    if flask.request.headers.get('Range') != None:
-        fileLength = os.path.getsize(path)
-        
-        reqRange = parseRequestRange(flask.request.headers.get('Range'), fileLength)
-        
-        response_file = bytes()
-
-        with open(path, 'rb') as file:
-            file.seek(reqRange[0])
-            response_file = file.read(reqRange[1] - reqRange[0] + 1)
+def parsePageArgs(defaultLimit=50, maxLimit=500):
+    offset = flask.request.args.get('offset', 0, type=int)
+    limit = flask.request.args.get('limit', defaultLimit, type=int)
+    return max(offset, 0), min(max(limit, 0), maxLimit)
 
-        response = flask.make_response(response_file)
-        response.headers['Accept-Ranges'] = 'bytes'
-        response.headers['Content-Range'] = 'bytes ' + \
-            str(reqRange[0]) + '-' + \
-            str(reqRange[1]) + '/' + str(fileLength)
-        response.headers['Content-Type'] = mime
-        if response.headers['Content-Type'].startswith('application'):
-            response.headers['Content-Disposition'] = "attachment; filename=" + \
-                os.path.basename(path)
 
-        response.status_code = 206
-        return response
-    return flask.send_file(path, as_attachment=not isPreview, download_name=os.path.basename(path), mimetype=mime)
+def makeDriveFileResponse(path, mime):
+    offload = dataManager.queryFileOffload(path)
+    return api.fileResponse.makeFileResponse(
+        path, mime, offload=offload['data'] if offload['ok'] else None)
 
 
 def routeAfterRequest(d):
-    dataManager.db.db.commit()
+    # read-only requests never touch the writer; requests that wrote wait for their group commit
+    if dataManager.db.hasPendingWrites():
+        dataManager.db.flush().result()
     return d
 
 
+def routeTeardownRequest(e):
+    dataManager.db.release()
+
+
 webApplication.after_request(routeAfterRequest)
+webApplication.teardown_request(routeTeardownRequest)
 
 
 @webApplication.route("/xms/v1/info", methods=["GET"])
@@ -123,6 +122,36 @@ def routeConfigUpdate():
     return dataManager.updateXmsConfig(data)
 
 
+@webApplication.route("/xms/v1/config/metrics", methods=["GET"])
+def routeConfigMetrics():
+    uid = checkIfLoggedIn()
+    if uid is None:
+        return api.utils.makeResult(False, "user haven't logged in yet")
+    if dataManager.queryUser(uid)['data']['level'] < 1:
+        return api.utils.makeResult(False, "user is not admin")
+    return dataManager.queryMetrics()
+
+
+@webApplication.route("/xms/v1/config/dedup/scan", methods=["POST"])
+def routeConfigDedupScan():
+    uid = checkIfLoggedIn()
+    if uid is None:
+        return api.utils.makeResult(False, "user haven't logged in yet")
+    if dataManager.queryUser(uid)['data']['level'] < 1:
+        return api.utils.makeResult(False, "user is not admin")
+    return dataManager.startDriveDedupScan()
+
+
+@webApplication.route("/xms/v1/config/dedup/report", methods=["GET"])
+def routeConfigDedupReport():
+    uid = checkIfLoggedIn()
+    if uid is None:
+        return api.utils.makeResult(False, "user haven't logged in yet")
+    if dataManager.queryUser(uid)['data']['level'] < 1:
+        return api.utils.makeResult(False, "user is not admin")
+    return dataManager.queryDriveDedupReport()
+
+
 @webApplication.route("/xms/v1/info/plugins", methods=["GET"])
 def routeInfoPlugins():
     return dataManager.queryAvaliablePlugins()
@@ -210,10 +239,9 @@ def routeUserTasks():
 @webApplication.route("/xms/v1/user/<uid>/avatar", methods=["GET"])
 def routeUserAvatar(uid):
     uid = int(uid)
-    avatar = dataManager.getUserAvatar(uid)
+    avatar = dataManager.getUserAvatar(uid, flask.request.args.get('size', type=int))
     if avatar['ok']:
-        file = BytesIO(avatar['data']["avatar"])
-        return flask.send_file(file, avatar['data']["avatarMime"])
+        return api.fileResponse.makeFileResponse(avatar['data']['path'], avatar['data']['mime'])
     else:
         return avatar
 
@@ -221,14 +249,23 @@ def routeUserAvatar(uid):
 @webApplication.route("/xms/v1/user/<uid>/headimg", methods=["GET"])
 def routeUserHeadImg(uid):
     uid = int(uid)
-    headImg = dataManager.getUserHeadImage(uid)
+    headImg = dataManager.getUserHeadImage(uid, flask.request.args.get('size', type=int))
     if headImg['ok']:
-        file = BytesIO(headImg['data']["headImage"])
-        return flask.send_file(file, headImg['data']["headImageMime"])
+        return api.fileResponse.makeFileResponse(headImg['data']['path'], headImg['data']['mime'])
     else:
         return headImg
 
 
+@webApplication.route("/xms/v1/image/<hash>", methods=["GET"])
+def routeImage(hash):
+    # hash versioned urls of avatars and head images, see avatarHash and headImageHash in user info
+    image = dataManager.getUserImage(hash, flask.request.args.get('size', type=int))
+    if image['ok']:
+        return api.fileResponse.makeFileResponse(image['data']['path'], image['data']['mime'], api.fileResponse.immutable)
+    else:
+        return image
+
+
 @webApplication.route("/xms/v1/user/playlists", methods=["GET"])
 def routeUserPlaylists():
     uid = checkIfLoggedIn()
@@ -298,7 +335,7 @@ def routeUserAvatarUpdate():
 
     image = avatar.stream.read()
 
-    return dataManager.updateUserAvatar(uid, image, avatar.content_type)
+    return dataManager.updateUserAvatar(uid, image)
 
 
 @webApplication.route("/xms/v1/user/headimg/update", methods=["POST"])
@@ -316,7 +353,7 @@ def routeUserHeadImgUpdate():
 
     image = headimg.stream.read()
 
-    return dataManager.updateUserHeadImage(uid, image, headimg.content_type)
+    return dataManager.updateUserHeadImage(uid, image)
 
 
 @webApplication.route("/xms/v1/drive/dir", methods=["POST"])
@@ -328,8 +365,25 @@ def routeDriveDir():
     path = data.get('path')
     if path is None or not isinstance(path, str):
         return api.utils.makeResult(False, "invalid request")
+    listing = parseListingArgs(data)
+    if listing is None:
+        return api.utils.makeResult(False, "invalid request")
+
+    return dataManager.getUserDriveDirInfo(uid, path, *listing)
+
+
+@webApplication.route("/xms/v1/drive/search", methods=["GET"])
+def routeDriveSearch():
+    uid = checkIfLoggedIn()
+    if uid is None:
+        return api.utils.makeResult(False, "user haven't logged in yet")
+
+    query = flask.request.args.get('q')
+    if query is None or len(query) == 0:
+        return api.utils.makeResult(False, "invalid request")
 
-    return dataManager.getUserDriveDirInfo(uid, path)
+    offset, limit = parsePageArgs()
+    return dataManager.searchUserDrive(uid, query, flask.request.args.get('type'), offset, limit)
 
 
 @webApplication.route("/xms/v1/drive/createdir", methods=["POST"])
@@ -365,6 +419,21 @@ def routeDriveDelete():
     return dataManager.deleteInUserDrive(uid, path)
 
 
+@webApplication.route("/xms/v1/drive/batch", methods=["POST"])
+def routeDriveBatch():
+    uid = checkIfLoggedIn()
+    if uid is None:
+        return api.utils.makeResult(False, "user haven't logged in yet")
+    data = flask.request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return api.utils.makeResult(False, "invalid request")
+    operations = data.get('operations')
+    if operations is None or not isinstance(operations, list):
+        return api.utils.makeResult(False, "invalid request")
+
+    return dataManager.runDriveBatch(uid, operations)
+
+
 @webApplication.route("/xms/v1/drive/copy", methods=["POST"])
 def routeDriveCopy():
     uid = checkIfLoggedIn()
@@ -430,7 +499,7 @@ def routeDriveFile():
         result = dataManager.queryFileRealpath(uid, path)
         if result['ok']:
             result = result['data']
-            return makeFileResponse(result['path'], result['mime'])
+            return makeDriveFileResponse(result['path'], result['mime'])
         else:
             return result
     except OSError as e:
@@ -446,6 +515,10 @@ def routeDriveUpload():
     path = flask.request.args.get("path", type=str)
     if path is None or not isinstance(path, str):
         return api.utils.makeResult(False, "invalid request")
+    # before the body is parsed, the whole request counts against the quota
+    quota = dataManager.checkDriveQuota(uid, flask.request.content_length or 0)
+    if not quota['ok']:
+        return quota
 
     for i in flask.request.files:
         j = flask.request.files[i]
@@ -453,8 +526,8 @@ def routeDriveUpload():
         result = dataManager.queryFileUploadRealpath(
             uid, f"{path}/{j.filename}")
         if result['ok']:
-            j.save(result['data'])
-        else:
+            result = dataManager.saveUploadedFile(result['data'], j)
+        if not result['ok']:
             return result
 
     return api.utils.makeResult(True, "success")
@@ -489,6 +562,10 @@ def routeMobileDriveUpload():
     path = flask.request.args.get("path", type=str)
     if path is None or not isinstance(path, str):
         return api.utils.makeResult(False, "invalid request")
+    # before the body is parsed, the whole request counts against the quota
+    quota = dataManager.checkDriveQuota(uid, flask.request.content_length or 0)
+    if not quota['ok']:
+        return quota
 
     for i in flask.request.files:
         j = flask.request.files[i]
@@ -496,13 +573,72 @@ def routeMobileDriveUpload():
         result = dataManager.queryFileUploadRealpath(
             uid, f"{path}/{filename}")
         if result['ok']:
-            j.save(result['data'])
-        else:
+            result = dataManager.saveUploadedFile(result['data'], j)
+        if not result['ok']:
             return result
 
     return api.utils.makeResult(True, "success")
 
 
+@webApplication.route("/xms/v1/drive/upload/session", methods=["POST"])
+def routeDriveUploadSessionCreate():
+    uid = checkIfLoggedIn()
+    if uid is None:
+        return api.utils.makeResult(False, "user haven't logged in yet")
+
+    data = flask.request.get_json(silent=True)
+    if data is None:
+        return api.utils.makeResult(False, "invalid request")
+    path = data.get('path')
+    size = data.get('size')
+    if not isinstance(path, str) or len(path) == 0 or not isinstance(size, int):
+        return api.utils.makeResult(False, "invalid request")
+
+    return dataManager.createUploadSession(uid, path, size)
+
+
+@webApplication.route("/xms/v1/drive/upload/session/<id>", methods=["GET"])
+def routeDriveUploadSessionStatus(id):
+    uid = checkIfLoggedIn()
+    if uid is None:
+        return api.utils.makeResult(False, "user haven't logged in yet")
+
+    return dataManager.queryUploadSession(uid, id)
+
+
+@webApplication.route("/xms/v1/drive/upload/session/<id>", methods=["PUT"])
+def routeDriveUploadSessionChunk(id):
+    uid = checkIfLoggedIn()
+    if uid is None:
+        return api.utils.makeResult(False, "user haven't logged in yet")
+
+    offset = flask.request.args.get('offset', type=int)
+    if offset is None:
+        return api.utils.makeResult(False, "invalid request")
+
+    # the body is read straight from the socket into the part file, never spooled
+    return dataManager.writeUploadSessionChunk(uid, id, offset, flask.request.content_length,
+                                               flask.request.headers.get('X-Chunk-Sha256'), flask.request.stream)
+
+
+@webApplication.route("/xms/v1/drive/upload/session/<id>/finalize", methods=["POST"])
+def routeDriveUploadSessionFinalize(id):
+    uid = checkIfLoggedIn()
+    if uid is None:
+        return api.utils.makeResult(False, "user haven't logged in yet")
+
+    return dataManager.finalizeUploadSession(uid, id)
+
+
+@webApplication.route("/xms/v1/drive/upload/session/<id>", methods=["DELETE"])
+def routeDriveUploadSessionAbort(id):
+    uid = checkIfLoggedIn()
+    if uid is None:
+        return api.utils.makeResult(False, "user haven't logged in yet")
+
+    return dataManager.abortUploadSession(uid, id)
+
+
 @webApplication.route("/xms/v1/music/statistics", methods=["GET"])
 def routeMusicStatistics():
     uid = checkIfLoggedIn()
@@ -512,6 +648,64 @@ def routeMusicStatistics():
         return dataManager.queryMusicStatistics(uid)
 
 
+@webApplication.route("/xms/v1/music/library/scan", methods=["POST"])
+def routeMusicLibraryScan():
+    uid = checkIfLoggedIn()
+    if uid is None:
+        return api.utils.makeResult(False, "user haven't logged in yet")
+
+    return dataManager.startMusicLibraryScan(uid)
+
+
+@webApplication.route("/xms/v1/music/library/scan/status", methods=["GET"])
+def routeMusicLibraryScanStatus():
+    uid = checkIfLoggedIn()
+    if uid is None:
+        return api.utils.makeResult(False, "user haven't logged in yet")
+
+    return dataManager.queryMusicLibraryScanState(uid)
+
+
+@webApplication.route("/xms/v1/music/library/browse/<field>", methods=["GET"])
+def routeMusicLibraryBrowse(field):
+    uid = checkIfLoggedIn()
+    if uid is None:
+        return api.utils.makeResult(False, "user haven't logged in yet")
+
+    offset, limit = parsePageArgs()
+    return dataManager.browseMusicLibrary(uid, field, offset, limit)
+
+
+@webApplication.route("/xms/v1/music/library/songs", methods=["GET"])
+def routeMusicLibrarySongs():
+    uid = checkIfLoggedIn()
+    if uid is None:
+        return api.utils.makeResult(False, "user haven't logged in yet")
+
+    filters = {}
+    for i in ('artist', 'album', 'title', 'composer'):
+        if i in flask.request.args:
+            filters[i] = flask.request.args.get(i)
+
+    offset, limit = parsePageArgs()
+    return dataManager.queryMusicLibrarySongs(uid, filters, offset, limit)
+
+
+@webApplication.route("/xms/v1/music/library/search", methods=["GET"])
+def routeMusicLibrarySearch():
+    uid = checkIfLoggedIn()
+    if uid is None:
+        return api.utils.makeResult(False, "user haven't logged in yet")
+
+    field = flask.request.args.get('field', 'title')
+    prefix = flask.request.args.get('q')
+    if prefix is None or len(prefix) == 0:
+        return api.utils.makeResult(False, "invalid request")
+
+    offset, limit = parsePageArgs()
+    return dataManager.searchMusicLibrary(uid, field, prefix, offset, limit)
+
+
 @webApplication.route("/xms/v1/music/playlist/create", methods=["POST"])
 def routeMusicPlaylistCreate():
     uid = checkIfLoggedIn()
@@ -617,9 +811,10 @@ def routePlaylistArtwork(id):
     if uid is None:
         return api.utils.makeResult(False, "user haven't logged in yet")
 
-    data = dataManager.queryPlaylistArtwork(id)
+    data = dataManager.queryPlaylistArtwork(id, flask.request.args.get('size', type=int))
     if data['ok']:
-        return flask.send_file(BytesIO(data['data']['artwork']), data['data']['mime'])
+        return api.fileResponse.makeFileResponse(
+            data['data']['path'], data['data']['mime'], api.fileResponse.artworkCacheControl)
     else:
         return data
 
@@ -630,19 +825,15 @@ def routeMusicSongArtwork(id):
     if uid is None:
         return api.utils.makeResult(False, "user haven't logged in yet")
 
-    songInfo = dataManager.querySongFromPlaylist(id)
-    if not songInfo['ok']:
-        return songInfo
+    data = dataManager.querySongArtworkFromPlaylist(id, flask.request.args.get('size', type=int))
+    if not data['ok']:
+        return data
 
-    songInfo = songInfo['data']
-    if songInfo['owner'] != uid:
+    if data['data']['owner'] != uid:
         return api.utils.makeResult(False, "permission denied")
 
-    data = dataManager.querySongArtworkFromPlaylist(id)
-    if data['ok']:
-        return flask.send_file(BytesIO(data['data']['artwork']), data['data']['mime'])
-    else:
-        return data
+    return api.fileResponse.makeFileResponse(
+        data['data']['path'], data['data']['mime'], api.fileResponse.artworkCacheControl)
     
 @webApplication.route("/xms/v1/mobile/music/song/<id>/artwork", methods=["GET"])
 def routeMobileMusicSongArtwork(id):
@@ -652,19 +843,15 @@ def routeMobileMusicSongArtwork(id):
     
     uid = checkIfLoggedInSession(session)
 
-    songInfo = dataManager.querySongFromPlaylist(id)
-    if not songInfo['ok']:
-        return songInfo
+    data = dataManager.querySongArtworkFromPlaylist(id, flask.request.args.get('size', type=int))
+    if not data['ok']:
+        return data
 
-    songInfo = songInfo['data']
-    if songInfo['owner'] != uid:
+    if data['data']['owner'] != uid:
         return api.utils.makeResult(False, "permission denied")
 
-    data = dataManager.querySongArtworkFromPlaylist(id)
-    if data['ok']:
-        return flask.send_file(BytesIO(data['data']['artwork']), data['data']['mime'])
-    else:
-        return data
+    return api.fileResponse.makeFileResponse(
+        data['data']['path'], data['data']['mime'], api.fileResponse.artworkCacheControl)
 
 
 @webApplication.route("/xms/v1/music/playlist/<id>/songs/<sid>/file", methods=["GET"])
@@ -678,14 +865,13 @@ def routeMusicPlaylistSongsFile(id, sid):
     if d['owner'] != uid:
         return api.utils.makeResult(False, "user isn't the owner of playlist")
 
-    data = dataManager.db.query(
-        "select id, path from songlist where id = ?", (sid, ), one=True)
+    data = dataManager.checkIfSongExistInPlaylistById(int(id), sid)
     if data is None:
         return api.utils.makeResult(False, f'SongId({sid}) not exist')
 
     path = api.utils.catchError(
         webLogger, dataManager.queryFileRealpath(uid, data['path']))
-    return makeFileResponse(path['path'], path['mime'])
+    return makeDriveFileResponse(path['path'], path['mime'])
 
 
 @webApplication.route("/xms/v1/mobile/music/playlist/<id>/songs/<sid>/file", methods=["GET"])
@@ -702,14 +888,13 @@ def routeMobileMusicPlaylistSongsFile(id, sid):
     if d['owner'] != uid:
         return api.utils.makeResult(False, "user isn't the owner of playlist")
 
-    data = dataManager.db.query(
-        "select id, path from songlist where id = ?", (sid, ), one=True)
+    data = dataManager.checkIfSongExistInPlaylistById(int(id), sid)
     if data is None:
         return api.utils.makeResult(False, f'SongId({sid}) not exist')
 
     path = api.utils.catchError(
         webLogger, dataManager.queryFileRealpath(uid, data['path']))
-    return makeFileResponse(path['path'], path['mime'])
+    return makeDriveFileResponse(path['path'], path['mime'])
 
 
 @webApplication.route("/xms/v1/music/playlist/<id>/songs", methods=["GET"])
@@ -814,7 +999,7 @@ def routeShareLinkFile(id: str):
     try:
         result = dataManager.queryShareLinkFileRealpath(id)
         if result['ok']:
-            return makeFileResponse(result['data']['path'], result['data']['mime'])
+            return makeDriveFileResponse(result['data']['path'], result['data']['mime'])
         else:
             return result
     except OSError as e:
@@ -827,7 +1012,10 @@ def routeShareLinkDir(id: str):
     path = data.get('path')
     if not isinstance(path, str):
         return api.utils.makeResult(False, "invalid request")
-    return dataManager.queryShareLinkDirInfo(id, path)
+    listing = parseListingArgs(data)
+    if listing is None:
+        return api.utils.makeResult(False, "invalid request")
+    return dataManager.queryShareLinkDirInfo(id, path, *listing)
 
 
 @webApplication.route("/xms/v1/sharelink/<id>/dir/file", methods=["GET"])
@@ -838,7 +1026,7 @@ def routeShareLinkDirFile(id: str):
     try:
         result = dataManager.queryShareLinkDirFileRealpath(id, path)
         if result['ok']:
-            return makeFileResponse(result['data']['path'], result['data']['mime'])
+            return makeDriveFileResponse(result['data']['path'], result['data']['mime'])
         else:
             return result
     except OSError as e:
@@ -870,7 +1058,11 @@ def routeTaskCreate():
     if name is None or not isinstance(args, list):
         return api.utils.makeResult(False, "invalid request")
 
-    return dataManager.createTask(uid, name, plugin, handler, args)
+    priority = data.get('priority', 0)
+    if not isinstance(priority, int):
+        return api.utils.makeResult(False, "invalid request")
+
+    return dataManager.createTask(uid, name, plugin, handler, args, priority)
 
 
 @webApplication.route("/xms/v1/task/<id>/info", methods=["GET"])
@@ -881,16 +1073,41 @@ def routeTaskInfo(id):
 
     try:
         id = int(id)
+        since = flask.request.args.get('since')
+        since = int(since) if since is not None else None
     except:
         return api.utils.makeResult(False, "invalid request")
 
-    data = dataManager.queryTask(id)
+    data = dataManager.queryTask(id, since)
     if data['ok'] and data['data']['owner'] != uid:
         return api.utils.makeResult(False, "user isn't the owner of this task")
     else:
         return data
 
 
+@webApplication.route("/xms/v1/task/<id>/stream", methods=["GET"])
+def routeTaskStream(id):
+    uid = checkIfLoggedIn()
+    if uid is None:
+        return api.utils.makeResult(False, "user haven't logged in yet")
+
+    try:
+        id = int(id)
+        # an EventSource reconnecting sends the id of the last event it received
+        cursor = int(flask.request.headers.get('Last-Event-ID', flask.request.args.get('since', 0)))
+    except:
+        return api.utils.makeResult(False, "invalid request")
+
+    data = dataManager.queryTaskState(id)
+    if data is None:
+        return api.utils.makeResult(False, "task not exist")
+    if data['owner'] != uid:
+        return api.utils.makeResult(False, "user isn't the owner of this task")
+
+    return flask.Response(dataManager.streamTask(id, cursor), mimetype='text/event-stream',
+                          headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
 @webApplication.route("/xms/v1/task/<id>/delete", methods=["POST"])
 def routeTaskDelete(id):
     uid = checkIfLoggedIn()
@@ -905,6 +1122,20 @@ def routeTaskDelete(id):
     return dataManager.deleteTask(uid, id)
 
 
+@webApplication.route("/xms/v1/task/<id>/cancel", methods=["POST"])
+def routeTaskCancel(id):
+    uid = checkIfLoggedIn()
+    if uid is None:
+        return api.utils.makeResult(False, "user haven't logged in yet")
+
+    try:
+        id = int(id)
+    except:
+        return api.utils.makeResult(False, "invalid request")
+
+    return dataManager.cancelTask(uid, id)
+
+
 @webApplication.route("/xms/v1/user/manage/list", methods=["GET"])
 def userManageList():
     uid = checkIfLoggedIn()
@@ -925,6 +1156,8 @@ def userManageDelete():
 
     if dataManager.queryUser(uid)['data']['level'] == 2:
         data = flask.request.get_json(silent=True)
+        if not isinstance(data, dict):
+            return api.utils.makeResult(False, "invalid request")
         if data.get('id') is None or not isinstance(data['id'], int):
             return api.utils.makeResult(False, "invalid request")
 
@@ -941,6 +1174,8 @@ def userManageUpdateLevel():
 
     if dataManager.queryUser(uid)['data']['level'] == 2:
         data = flask.request.get_json(silent=True)
+        if not isinstance(data, dict):
+            return api.utils.makeResult(False, "invalid request")
         if data.get('id') is None or not isinstance(data['id'], int):
             return api.utils.makeResult(False, "invalid request")
         if data.get('level') is None or not isinstance(data['level'], int):
@@ -951,6 +1186,51 @@ def userManageUpdateLevel():
         return api.utils.makeResult(False, "permission denied")
 
 
+@webApplication.route("/xms/v1/user/manage/updateQuota", methods=["POST"])
+def userManageUpdateQuota():
+    uid = checkIfLoggedIn()
+    if uid is None:
+        return api.utils.makeResult(False, "user haven't logged in yet")
+
+    if dataManager.queryUser(uid)['data']['level'] == 2:
+        data = flask.request.get_json(silent=True)
+        if not isinstance(data, dict):
+            return api.utils.makeResult(False, "invalid request")
+        if data.get('id') is None or not isinstance(data['id'], int):
+            return api.utils.makeResult(False, "invalid request")
+        # quota in bytes, 0 for unlimited, null for the default in the config
+        if data.get('quota') is not None and (not isinstance(data['quota'], int) or data['quota'] < 0):
+            return api.utils.makeResult(False, "invalid request")
+
+        return dataManager.updateUserDriveQuota(data['id'], data.get('quota'))
+    else:
+        return api.utils.makeResult(False, "permission denied")
+
+
+@webApplication.route("/xms/v1/user/manage/usage", methods=["GET"])
+def userManageUsage():
+    uid = checkIfLoggedIn()
+    if uid is None:
+        return api.utils.makeResult(False, "user haven't logged in yet")
+
+    if dataManager.queryUser(uid)['data']['level'] == 2:
+        return dataManager.queryDriveUsageOverview()
+    else:
+        return api.utils.makeResult(False, "permission denied")
+
+
+@webApplication.route("/xms/v1/user/manage/usage/verify", methods=["POST"])
+def userManageUsageVerify():
+    uid = checkIfLoggedIn()
+    if uid is None:
+        return api.utils.makeResult(False, "user haven't logged in yet")
+
+    if dataManager.queryUser(uid)['data']['level'] == 2:
+        return dataManager.startDriveUsageVerify()
+    else:
+        return api.utils.makeResult(False, "permission denied")
+
+
 @webApplication.route("/xms/v1/user/manage/create", methods=["POST"])
 def userManageCreate():
     uid = checkIfLoggedIn()
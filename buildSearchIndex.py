@@ -0,0 +1,30 @@
+"""
+XmediaCenter 2 Drive Search Index Builder
+This script rebuilds the filename search index of every user drive, or of a single one,
+from what is on disk. Run it once after upgrading to schema version 12 and whenever files
+were changed behind the server's back.
+
+@params databasePath str the database to connect
+@params uid int|None the user whose drive is rebuilt, None for every drive
+"""
+
+import api.dataManager
+import plugins.enabled
+
+# params
+databasePath = "./root/blob/xms.db"
+appRoot = "./root"
+pluginsPath = "./plugins"
+uid = None
+
+
+database = api.dataManager.databaseObject(databasePath)
+dataManager = api.dataManager.dataManager(database, appRoot, pluginsPath, plugins.enabled)
+
+if __name__ == "__main__":
+    result = dataManager.rebuildDriveIndex(uid)
+    if result['ok']:
+        print(f"Done! Indexed {result['data']['indexed']} path(s) in {result['data']['drives']} drive(s).")
+    else:
+        print(f"Failed: {result['data']}")
+    dataManager.db.close()
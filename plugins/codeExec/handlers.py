@@ -1,52 +1,106 @@
-import multiprocessing
+import os
+import selectors
+import shlex
+import signal
 import subprocess
 import time
 
-def execution(taskInfo, arg: str, timeout: int):
-    limitation = timeout * 2
-    currentCount = 0
-    process = subprocess.Popen(arg, shell=True, universal_newlines=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    logs = []
+import api.taskExecutor
+
+# limits of every process the script starts, the cpu limit defaults to the wall clock timeout
+memoryLimit = 512 * 1024 * 1024
+fileLimit = 64
+readSize = 65536
+
+
+def limitResources(arg: str, cpu: int):
+    # the shell sets the limits and then execs the script, so no python runs between fork and
+    # exec in this threaded server, and the limits are in place before the script starts anything.
+    # RLIMIT_CPU sends SIGXCPU at the soft limit and SIGKILL a second later, each process of the
+    # group is limited on its own. the soft limit goes first, a hard one below it is invalid
+    return f"ulimit -S -t {cpu} && ulimit -H -t {cpu + 1} && ulimit -v {memoryLimit // 1024} && " \
+        f"ulimit -n {fileLimit} && exec /bin/sh -c {shlex.quote(arg)}"
+
+
+def describeUsage(status: int, usage, wall: float):
+    return f'status code {status}, wall {wall:.2f}s, user {usage.ru_utime:.2f}s, system {usage.ru_stime:.2f}s, ' \
+        f'max rss {usage.ru_maxrss} KiB'
+
+
+def execution(taskInfo, arg: str, timeout: float, cpu: int = None):
+    # stdout and stderr are read as they arrive from one selector, so neither pipe can fill up and
+    # block the script, and the wall clock deadline is checked between reads instead of after them
+    cpu = max(int(cpu if cpu is not None else timeout), 1)
+    begin = time.monotonic()
+    deadline = begin + timeout
+    process = taskInfo.popen(limitResources(arg, cpu), shell=True, stdin=subprocess.DEVNULL,
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    selector = selectors.DefaultSelector()
+    pending = {}
+    for pipe in (process.stdout, process.stderr):
+        selector.register(pipe, selectors.EVENT_READ)
+        pending[pipe] = b''
+    timedOut = False
     try:
-        while process.poll() is None:
-            time.sleep(0.5)
-            for i in process.stdout.readlines()[-100:]:
-                logs.append(i)
-            logs = logs[-100:]
-            logText = ''
-            for i in logs:
-                logText += i
-                
-            currentCount += 1
-            if currentCount > limitation:
-                logText += 'TERMINATED due to timeout'
-                process.terminate()
-                taskInfo.setLogText(logText)
-                taskInfo.ended()
-                return
-            else:
-                taskInfo.setLogText(logText)
-                
-        for i in process.stdout.readlines()[-100:]:
-            logs.append(i)
-        logs = logs[-100:]
-        logText = ''
-        for i in logs:
-            logText += i
-        logText += f'OK with status code {process.returncode}'
-        
-        taskInfo.setLogText(logText)
-        taskInfo.ended()
-    except Exception as e:
-        process.terminate()
-        taskInfo.setLogText(f'ERROR {str(e)}')
-        taskInfo.ended()
+        while selector.get_map():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                if timedOut:
+                    # something outside the group still holds the pipes
+                    break
+                timedOut = True
+                api.taskExecutor.killProcessGroup(process)
+                deadline = time.monotonic() + api.taskExecutor.killGrace + 1
+                continue
+
+            for key, _ in selector.select(remaining):
+                chunk = os.read(key.fd, readSize)
+                if not chunk:
+                    selector.unregister(key.fileobj)
+                    if pending[key.fileobj]:
+                        taskInfo.appendLog(pending[key.fileobj].decode(errors='replace'))
+                    continue
+                lines = (pending[key.fileobj] + chunk).split(b'\n')
+                pending[key.fileobj] = lines.pop()
+                if lines:
+                    taskInfo.appendLog(b'\n'.join(lines).decode(errors='replace'))
+    except Exception:
+        os.killpg(process.pid, signal.SIGKILL)
+        os.waitpid(process.pid, 0)
+        raise
+    finally:
+        selector.close()
+        process.stdout.close()
+        process.stderr.close()
+
+    # wait4 instead of process.wait() for the usage of the script and every child it waited for
+    if timedOut:
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+    _, waitStatus, usage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(waitStatus)
+    report = describeUsage(process.returncode, usage, time.monotonic() - begin)
+
+    if taskInfo.cancelled.is_set():
+        taskInfo.appendLog(f'CANCELLED with {report}')
+    elif timedOut:
+        taskInfo.fail(f'TERMINATED due to timeout with {report}')
+    elif os.WIFSIGNALED(waitStatus) and (os.WTERMSIG(waitStatus) == signal.SIGXCPU or (
+            os.WTERMSIG(waitStatus) == signal.SIGKILL and usage.ru_utime + usage.ru_stime >= cpu)):
+        # SIGXCPU alone is enough, the usage of a process killed right at the limit may read a tick
+        # short of it. a SIGKILL is the hard limit only for a script that ignored SIGXCPU a second ago
+        taskInfo.fail(f'TERMINATED due to cpu limit with {report}')
+    else:
+        taskInfo.appendLog(f'OK with {report}')
+    taskInfo.ended()
 
-    
 
 def exec(dm, taskInfo, args: list):
+    # args: [script, wall clock timeout in seconds, optional cpu seconds]
     try:
-        execution(taskInfo, args[0], args[1])
+        execution(taskInfo, *args[:3])
     except Exception as e:
-        taskInfo.setLogText(f'ERROR {str(e)}')
-        taskInfo.ended()
\ No newline at end of file
+        taskInfo.fail(f'ERROR {str(e)}')
+        taskInfo.ended()
@@ -4,5 +4,6 @@ def registry():
     return {
         'name': 'spotdlBackend',
         'description': 'download music with spotdl',
-        'avaliablepermissionLevel': 0
+        'avaliablepermissionLevel': 0,
+        'concurrency': 1
     }    
\ No newline at end of file
@@ -1,41 +1,34 @@
 import multiprocessing
+import signal
 import subprocess
 import time
 import os
 
-def downloadMusic(taskInfo, searchParam: str, realSavePath: str, proxyType: bool, proxyUrl: str):
+def downloadMusic(taskInfo, searchParam: str, realSavePath: str, proxyType: bool, proxyUrl: str, checkQuota=None):
     env = os.environ.copy()
     if proxyType == "HTTP(S)":
         env['http_proxy'] = proxyUrl
         env['https_proxy'] = proxyUrl
     
     cmdline = f'python3.9 -m spotdl --audio youtube-music --lyrics musixmatch --format mp3 --bitrate auto download "{searchParam}"'
-    process = subprocess.Popen(cmdline, shell=True, universal_newlines=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env, cwd=realSavePath)
+    process = taskInfo.popen(cmdline, shell=True, universal_newlines=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env, cwd=realSavePath)
     
-    logs = []
-    logText = ''
+    lastQuotaCheck = time.time()
     try:
         while process.poll() is None:
-            logs.append(process.stdout.readline())
-            logs = logs[-100:]
-            for i in logs:
-                logText += i
+            if checkQuota is not None and time.time() - lastQuotaCheck > 5:
+                lastQuotaCheck = time.time()
+                quota = checkQuota()
+                if not quota['ok']:
+                    raise RuntimeError(quota['data'])
+            taskInfo.appendLog(process.stdout.readline())
                 
-            taskInfo.setLogText(logText)
-                
-        for i in process.stdout.readlines()[-100:]:
-            logs.append(i)
-        logs = logs[-100:]
-        logText = ''
-        for i in logs:
-            logText += i
-        logText += f'OK with status code {process.returncode}'
-        
-        taskInfo.setLogText(logText)
+        taskInfo.appendLog(''.join(process.stdout.readlines()))
+        taskInfo.appendLog(f'OK with status code {process.returncode}')
         taskInfo.ended()
     except Exception as e:
-        process.terminate()
-        taskInfo.setLogText(f'ERROR {str(e)}')
+        os.killpg(process.pid, signal.SIGTERM)
+        taskInfo.fail(f'ERROR {str(e)}')
         taskInfo.ended()
 
     
@@ -43,9 +36,14 @@ def downloadMusic(taskInfo, searchParam: str, realSavePath: str, proxyType: bool
 def download(dm, taskInfo, args: list):
     try:
         task = dm.queryTask(taskInfo.id)['data']
-        data = taskInfo.db.query("select * from config", one=True)
+        data = dm.getXmsConfig()['data']
         path = os.path.realpath(dm.queryFileUploadRealpath(task['owner'], args[1])['data'])
-        downloadMusic(taskInfo, args[0], path, data['proxyType'], data['proxyUrl'])
+        quota = dm.checkDriveQuota(task['owner'], 0)
+        if not quota['ok']:
+            raise RuntimeError(quota['data'])
+        # downloads land in the drive behind the api's back, the reconciler accounts for them
+        downloadMusic(taskInfo, args[0], path, data['proxyType'], data['proxyUrl'],
+                      lambda: dm.checkDriveQuota(task['owner'], 0))
     except Exception as e:
-        taskInfo.setLogText(f'ERROR {str(e)}')
+        taskInfo.fail(f'ERROR {str(e)}')
         taskInfo.ended()
@@ -7,6 +7,15 @@ drop table if exists articles;
 drop table if exists taskList;
 drop table if exists settings;
 drop table if exists playCount;
+drop table if exists schemaVersion;
+drop table if exists songMetadata;
+drop table if exists musicLibrary;
+drop table if exists songArtwork;
+drop table if exists uploadSessions;
+drop table if exists driveSearch;
+drop table if exists driveIndex;
+drop table if exists driveUsage;
+drop table if exists files;
 
 create table users (
     id                  integer primary key autoincrement,
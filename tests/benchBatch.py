@@ -0,0 +1,51 @@
+"""
+Latency benchmark: moving files with one /drive/move call each against a single /drive/batch call.
+
+Needs a running server on localhost:11453. Uploads the files into /benchBatchSrc, moves them to
+/benchBatchDst one request at a time, moves them back in one batch, and checks where they ended up.
+
+@params files int number of files moved per run
+"""
+
+import time
+
+import requests
+
+server = "http://localhost:11453"
+files = 200
+
+
+def listNames(cookies, path):
+    r = requests.post(f"{server}/xms/v1/drive/dir", json={"path": path}, cookies=cookies).json()
+    assert r['ok'], r
+    return sorted(i['filename'] for i in r['data']['list'])
+
+
+if __name__ == "__main__":
+    cookies = requests.post(f"{server}/xms/v1/signin",
+                            json={"username": "JerryChau", "password": "YoimiyaIsMyWaifu"}).cookies
+    for i in ["benchBatchSrc", "benchBatchDst"]:
+        requests.post(f"{server}/xms/v1/drive/createdir", json={"path": "/", "name": i}, cookies=cookies)
+    names = [f"f{i}.txt" for i in range(files)]
+    r = requests.post(f"{server}/xms/v1/drive/upload", params={"path": "/benchBatchSrc"},
+                      files=[(i, (i, b"x")) for i in names], cookies=cookies).json()
+    assert r['ok'], r
+
+    start = time.time()
+    for i in names:
+        r = requests.post(f"{server}/xms/v1/drive/move", json={"path": f"/benchBatchSrc/{i}", "newPath": "/benchBatchDst"},
+                          cookies=cookies).json()
+        assert r['ok'], r
+    print(f"{files} x /drive/move: {time.time() - start:.3f}s")
+    assert listNames(cookies, "/benchBatchDst") == sorted(names)
+
+    start = time.time()
+    r = requests.post(f"{server}/xms/v1/drive/batch", json={"operations": [
+        {"op": "move", "path": f"/benchBatchDst/{i}", "newPath": "/benchBatchSrc"} for i in names]}, cookies=cookies).json()
+    assert r['ok'] and all(i['ok'] for i in r['data']), r
+    print(f"1 x /drive/batch: {time.time() - start:.3f}s")
+    assert listNames(cookies, "/benchBatchSrc") == sorted(names)
+
+    requests.post(f"{server}/xms/v1/drive/batch", json={"operations": [
+        {"op": "delete", "path": "/benchBatchSrc"}, {"op": "delete", "path": "/benchBatchDst"}]}, cookies=cookies)
+    print("OK")
@@ -0,0 +1,81 @@
+"""
+Benchmark: moving a folder whose files are all in a playlist, against a scratch database. Times the
+old rewrite of every songlist and playCount path below the folder next to the single files row the
+move updates now, and the cost of resolving the moved songs' paths afterwards.
+
+@params files int number of songs inside the moved folder
+@params rounds int moves timed per approach, the folder moves back and forth
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, root)
+
+import api.database
+import api.fileTree
+import api.migrations
+
+files = 10000
+rounds = 10
+
+
+def legacyMove(conn, path, newPath):
+    # the path rewrite a directory move used to need
+    for table in ["legacySonglist", "legacyPlayCount"]:
+        conn.execute(f"update {table} set path = ? || substr(path, ?) where path = ? or path like ?",
+                     (newPath, len(path) + 1, path, path + '/%'))
+
+
+if __name__ == "__main__":
+    workDir = tempfile.mkdtemp()
+    try:
+        db = api.database.databaseObject(f"{workDir}/xms.db")
+        with open(os.path.join(root, 'scripts/init.sql')) as file:
+            db.runScript(file.read())
+        db.transaction(api.migrations.applyMigrations)
+        tree = api.fileTree.fileTree(db)
+        paths = [f"/library/album/disc{i // 100}/{i}.mp3" for i in range(files)]
+
+        def populate(conn):
+            conn.execute("create table legacySonglist (id integer primary key, path string, playlistId integer, sortId integer)")
+            conn.execute("create index legacySonglistPath on legacySonglist (path)")
+            conn.execute("create table legacyPlayCount (id integer primary key, path string, owner integer, plays integer)")
+            conn.execute("create unique index legacyPlayCountOwnerPath on legacyPlayCount (owner, path)")
+            conn.executemany("insert into legacySonglist (path, playlistId, sortId) values (?, 1, ?)",
+                             [(path, i) for i, path in enumerate(paths)])
+            conn.executemany("insert into legacyPlayCount (path, owner, plays) values (?, 1, 0)", [(i, ) for i in paths])
+            for i, path in enumerate(paths):
+                fileId = tree.ensure(conn, 1, path)
+                conn.execute("insert into songlist (fileId, playlistId, sortId) values (?, 1, ?)", (fileId, i))
+                conn.execute("insert into playCount (fileId, owner) values (?, 1)", (fileId, ))
+
+        db.transaction(populate)
+        moves = [('/library/album', '/archive/album'), ('/archive/album', '/library/album')]
+
+        start = time.time()
+        for i in range(rounds):
+            path, newPath = moves[i % 2]
+            db.transaction(lambda conn: legacyMove(conn, path, newPath))
+        legacy = (time.time() - start) / rounds
+        print(f"path rewrite: {legacy * 1000:.2f}ms per move of {files} songs")
+
+        start = time.time()
+        for i in range(rounds):
+            path, newPath = moves[i % 2]
+            assert db.transaction(lambda conn: tree.move(conn, 1, path, newPath))
+        moved = (time.time() - start) / rounds
+        print(f"parent pointer: {moved * 1000:.2f}ms per move of {files} songs ({legacy / moved:.0f}x)")
+
+        db.transaction(lambda conn: tree.move(conn, 1, '/library/album', '/archive/album'))
+        start = time.time()
+        songs = tree.withPaths(db.query("select * from songlist where playlistId = ? order by sortId", (1, )))
+        print(f"resolving {len(songs)} song paths: {(time.time() - start) * 1000:.2f}ms")
+        assert [i['path'] for i in songs] == [i.replace('/library/', '/archive/') for i in paths]
+        print("OK")
+    finally:
+        shutil.rmtree(workDir)
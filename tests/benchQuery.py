@@ -0,0 +1,61 @@
+"""
+Micro-benchmark for databaseObject row materialization.
+
+Compares the old per-row `cursor.description` enumeration with the current `query` and
+`queryIter` paths on a throwaway playCount table.
+
+@params rows int number of rows to materialize
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import api.database
+
+rows = 200000
+rounds = 5
+
+
+def legacyQuery(db, query, args=(), one=False):
+    cur = db.execute(query, args)
+    rv = [dict((cur.description[idx][0], value)
+               for idx, value in enumerate(row)) for row in cur.fetchall()]
+    lastrowid = cur.lastrowid
+    cur.close()
+    if query.startswith('insert'):
+        return lastrowid
+    else:
+        return (rv[0] if rv else None) if one else rv
+
+
+def bench(name, fn):
+    best = None
+    for i in range(rounds):
+        start = time.perf_counter()
+        count = fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    print(f"{name:<12} {count} rows  best {best * 1000:8.1f} ms  {rows / best:12.0f} rows/s")
+    return best
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as tmp:
+        database = api.database.databaseObject(os.path.join(tmp, 'bench.db'))
+        database.runScript(
+            "create table playCount (id integer primary key autoincrement, path string not null, owner integer, plays integer default 0);")
+        database.executeMany("insert into playCount (path, owner, plays) values (?, ?, ?)",
+                             [(f"/music/{i}.mp3", i % 16, i % 100) for i in range(rows)])
+        database.flush().result()
+
+        sql = "select * from playCount"
+        legacy = bench("legacy", lambda: len(legacyQuery(database.db, sql)))
+        current = bench("query", lambda: len(database.query(sql)))
+        streamed = bench("queryIter", lambda: sum(1 for i in database.queryIter(sql)))
+
+        print(f"query is {legacy / current:.2f}x the legacy path, queryIter {legacy / streamed:.2f}x")
+        database.close()
@@ -0,0 +1,149 @@
+"""
+Benchmark for Range responses under many concurrent seeks.
+
+Serves a large file through api.fileResponse.makeFileResponse and through the old
+read-the-whole-span implementation, lets concurrent clients issue open-ended `bytes=N-`
+requests and hang up after a few chunks like a seeking media player, and reports the peak
+RSS of the process for both. Also checks range parsing and multipart/byteranges output.
+
+@params fileSize int size of the served file in bytes
+@params clients int number of concurrent clients
+@params seeks int seeks per client
+"""
+
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+import werkzeug.serving
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import flask
+import api.fileResponse
+
+fileSize = 256 * 1024 * 1024
+clients = 32
+seeks = 8
+
+
+def legacyFileResponse(path, mime):
+    c = flask.request.headers.get('Range')
+    c = c[c.find('=')+1:].split('-')
+    fileLength = os.path.getsize(path)
+    reqRange = [int(c[0]), fileLength - 1]
+    with open(path, 'rb') as file:
+        file.seek(reqRange[0])
+        data = file.read(reqRange[1] - reqRange[0] + 1)
+    response = flask.make_response(data)
+    response.headers['Content-Range'] = f'bytes {reqRange[0]}-{reqRange[1]}/{fileLength}'
+    response.status_code = 206
+    return response
+
+
+def currentRSS():
+    with open('/proc/self/status') as file:
+        for i in file:
+            if i.startswith('VmRSS:'):
+                return int(i.split()[1]) * 1024
+    return 0
+
+
+def checkRanges(url, data):
+    assert api.fileResponse.parseRange('bytes=0-', 10) == [(0, 9)]
+    assert api.fileResponse.parseRange('bytes=-3', 10) == [(7, 9)]
+    assert api.fileResponse.parseRange('bytes=-30', 10) == [(0, 9)]
+    assert api.fileResponse.parseRange('bytes=5-100', 10) == [(5, 9)]
+    assert api.fileResponse.parseRange('bytes=0-1,1-3,8-', 10) == [(0, 3), (8, 9)]
+    assert api.fileResponse.parseRange('bytes=10-', 10) == []
+    assert api.fileResponse.parseRange('bytes=3-1', 10) is None
+    assert api.fileResponse.parseRange('items=0-1', 10) is None
+    assert api.fileResponse.parseRange('bytes=²-', 10) is None
+    assert api.fileResponse.parseRange('bytes=0-٣', 10) is None
+    assert api.fileResponse.parseRange('bytes=-²', 10) is None
+
+    r = requests.get(url, headers={'Range': 'bytes=-16'})
+    assert r.status_code == 206 and r.content == data[-16:], r.headers
+    assert r.headers['Content-Range'] == f'bytes {len(data) - 16}-{len(data) - 1}/{len(data)}'
+
+    r = requests.get(url, headers={'Range': 'bytes=0-9,100-109'})
+    assert r.status_code == 206 and r.headers['Content-Type'].startswith('multipart/byteranges')
+    assert int(r.headers['Content-Length']) == len(r.content)
+    assert data[0:10] in r.content and data[100:110] in r.content
+
+    # a malformed header is ignored and the whole file is served
+    r = requests.get(url, headers={'Range': 'bytes=²-'.encode('utf-8').decode('latin-1')})
+    assert r.status_code == 200 and r.content == data, r.status_code
+
+    r = requests.get(url, headers={'Range': f'bytes={len(data)}-'})
+    assert r.status_code == 416 and r.headers['Content-Range'] == f'bytes */{len(data)}'
+
+    etag = requests.head(url).headers['ETag']
+    r = requests.get(url, headers={'Range': 'bytes=0-9', 'If-Range': etag})
+    assert r.status_code == 206 and len(r.content) == 10
+    r = requests.get(url, headers={'Range': 'bytes=0-9', 'If-Range': '"stale"'}, stream=True)
+    assert r.status_code == 200
+    r.close()
+
+
+def seekStorm(url):
+    peak = [currentRSS()]
+    running = [True]
+
+    def sample():
+        while running[0]:
+            peak[0] = max(peak[0], currentRSS())
+            time.sleep(0.01)
+
+    def client():
+        session = requests.Session()
+        for i in range(seeks):
+            offset = random.randrange(0, fileSize // 2)
+            r = session.get(url, headers={'Range': f'bytes={offset}-'}, stream=True)
+            for index, chunk in enumerate(r.iter_content(64 * 1024)):
+                if index == 3:
+                    break
+            r.close()
+
+    sampler = threading.Thread(target=sample)
+    sampler.start()
+    start = time.time()
+    workers = [threading.Thread(target=client) for i in range(clients)]
+    for i in workers:
+        i.start()
+    for i in workers:
+        i.join()
+    running[0] = False
+    sampler.join()
+    return peak[0], time.time() - start
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as dirname:
+        path = os.path.join(dirname, 'big.flac')
+        with open(path, 'wb') as file:
+            file.truncate(fileSize)
+        small = os.path.join(dirname, 'small.flac')
+        smallData = os.urandom(4096)
+        with open(small, 'wb') as file:
+            file.write(smallData)
+
+        app = flask.Flask(__name__)
+        app.add_url_rule('/stream', 'stream', lambda: api.fileResponse.makeFileResponse(path, 'audio/flac'))
+        app.add_url_rule('/small', 'small', lambda: api.fileResponse.makeFileResponse(small, 'audio/flac'))
+        app.add_url_rule('/legacy', 'legacy', lambda: legacyFileResponse(path, 'audio/flac'))
+        server = werkzeug.serving.make_server('127.0.0.1', 0, app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base = f'http://127.0.0.1:{server.server_port}'
+
+        checkRanges(f'{base}/small', smallData)
+        baseline = currentRSS()
+        for name in ['stream', 'legacy']:
+            peak, elapsed = seekStorm(f'{base}/{name}')
+            print(f"{name:>8}: {clients * seeks} seeks in {elapsed:.2f}s, "
+                  f"peak RSS +{(peak - baseline) / 1024 / 1024:.1f} MiB")
+        server.shutdown()
@@ -0,0 +1,90 @@
+"""
+Throughput benchmark: one multipart /drive/upload against the resumable upload session API.
+
+Needs a running server on localhost:11453. Uploads the same random file through both paths,
+the session path with sequential chunks and with a few chunks in flight, simulates a dropped
+connection by resuming from the received ranges, and checks the stored bytes.
+
+@params fileSize int size of the uploaded file in bytes
+@params chunkSize int bytes per PUT
+@params parallel int chunks in flight for the parallel run
+"""
+
+import concurrent.futures
+import hashlib
+import os
+import time
+
+import requests
+
+server = "http://localhost:11453"
+fileSize = 256 * 1024 * 1024
+chunkSize = 8 * 1024 * 1024
+parallel = 4
+
+
+def putChunk(cookies, sessionId, data, offset):
+    chunk = data[offset:offset + chunkSize]
+    r = requests.put(f"{server}/xms/v1/drive/upload/session/{sessionId}", params={"offset": offset}, data=chunk,
+                     headers={"X-Chunk-Sha256": hashlib.sha256(chunk).hexdigest()}, cookies=cookies).json()
+    assert r['ok'], r
+    return r
+
+
+def sessionUpload(cookies, data, path, workers=1, skip=()):
+    r = requests.post(f"{server}/xms/v1/drive/upload/session",
+                      json={"path": path, "size": len(data)}, cookies=cookies).json()
+    assert r['ok'], r
+    sessionId = r['data']['id']
+    offsets = [i for i in range(0, len(data), chunkSize) if i not in skip]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(lambda offset: putChunk(cookies, sessionId, data, offset), offsets))
+    return sessionId
+
+
+def finalize(cookies, sessionId):
+    r = requests.post(f"{server}/xms/v1/drive/upload/session/{sessionId}/finalize", cookies=cookies).json()
+    assert r['ok'], r
+
+
+def checkStored(cookies, data, path):
+    r = requests.get(f"{server}/xms/v1/drive/file", params={"path": path}, cookies=cookies)
+    assert hashlib.sha256(r.content).digest() == hashlib.sha256(data).digest(), "stored file differs"
+
+
+if __name__ == "__main__":
+    cookies = requests.post(f"{server}/xms/v1/signin",
+                            json={"username": "JerryChau", "password": "YoimiyaIsMyWaifu"}).cookies
+    data = os.urandom(fileSize)
+
+    start = time.time()
+    r = requests.post(f"{server}/xms/v1/drive/upload", params={"path": "/"},
+                      files={"f": ("benchMultipart.bin", data)}, cookies=cookies).json()
+    assert r['ok'], r
+    elapsed = time.time() - start
+    print(f"multipart: {fileSize / elapsed / 1024 / 1024:.1f} MiB/s")
+    checkStored(cookies, data, "/benchMultipart.bin")
+
+    for workers in [1, parallel]:
+        start = time.time()
+        finalize(cookies, sessionUpload(cookies, data, f"/benchSession{workers}.bin", workers))
+        elapsed = time.time() - start
+        print(f"session x{workers}: {fileSize / elapsed / 1024 / 1024:.1f} MiB/s")
+        checkStored(cookies, data, f"/benchSession{workers}.bin")
+
+    # drop every other chunk, then resume from what the server says it has
+    sessionId = sessionUpload(cookies, data, "/benchResume.bin", skip=range(0, fileSize, chunkSize * 2))
+    r = requests.post(f"{server}/xms/v1/drive/upload/session/{sessionId}/finalize", cookies=cookies).json()
+    assert not r['ok'], r
+    received = requests.get(f"{server}/xms/v1/drive/upload/session/{sessionId}", cookies=cookies).json()['data']['received']
+    missing = [i for i in range(0, fileSize, chunkSize)
+               if not any(start <= i and i + min(chunkSize, fileSize - i) <= end for start, end in received)]
+    print(f"resuming {len(missing)} missing chunk(s)")
+    for i in missing:
+        putChunk(cookies, sessionId, data, i)
+    finalize(cookies, sessionId)
+    checkStored(cookies, data, "/benchResume.bin")
+
+    for i in ["/benchMultipart.bin", "/benchSession1.bin", f"/benchSession{parallel}.bin", "/benchResume.bin"]:
+        requests.post(f"{server}/xms/v1/drive/delete", json={"path": i}, cookies=cookies)
+    print("OK")
@@ -0,0 +1,106 @@
+"""
+Checks the codeExec runner against a scratch database: output shows up in the task log while the
+script still runs, a script flooding stderr does not stall, and the wall clock timeout, the cpu
+limit and the memory limit end the script with its exit status and resource usage in the log.
+
+@params timeout float wall clock seconds given to the scripts that are meant to be stopped
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, root)
+
+import api.database
+import api.dataManager
+import api.migrations
+import api.taskLogs
+import plugins.codeExec.handlers as handlers
+
+timeout = 2
+
+
+def run(db, logs, script, *limits):
+    taskId = db.executeInsert(
+        "insert into taskList (owner, name, plugin, handler, creationTime) values (1, 't', 'rce', 'exec', '')")
+    taskInfo = api.dataManager.dataManager.taskInfo(db, taskId, logs)
+    begin = time.monotonic()
+    handlers.exec(None, taskInfo, [script, *limits])
+    return taskInfo, logs.text(taskId).splitlines(), time.monotonic() - begin
+
+
+if __name__ == "__main__":
+    workDir = tempfile.mkdtemp()
+    try:
+        db = api.database.databaseObject(f"{workDir}/xms.db")
+        with open(os.path.join(root, 'scripts/init.sql')) as file:
+            db.runScript(file.read())
+        db.transaction(api.migrations.applyMigrations)
+        logs = api.taskLogs.taskLogStore(db, checkpointInterval=60)
+
+        # streamed: the first line is in the log long before the script ends
+        taskId = db.executeInsert(
+            "insert into taskList (owner, name, plugin, handler, creationTime) values (1, 't', 'rce', 'exec', '')")
+        taskInfo = api.dataManager.dataManager.taskInfo(db, taskId, logs)
+        runner = threading.Thread(target=handlers.exec, args=(None, taskInfo, ["echo first; echo err >&2; sleep 1.5; echo last", 10]))
+        runner.start()
+        time.sleep(0.7)
+        early = logs.text(taskId).splitlines()
+        runner.join(10)
+        lines = logs.text(taskId).splitlines()
+        print(early, lines[-1])
+        assert sorted(early) == ['err', 'first'], early
+        assert lines[2] == 'last' and lines[-1].startswith('OK with status code 0') and not taskInfo.failed
+
+        # a megabyte on stderr would fill an undrained pipe and block the script forever
+        taskInfo, lines, elapsed = run(db, logs, "head -c 1048576 /dev/zero | tr '\\0' 'x' | fold -w 1024 >&2; echo done", 10)
+        written = logs.read(taskInfo.id)['next']
+        print(written, round(elapsed, 2), lines[-1])
+        assert written == 1024 + 2 and 'done' in lines and not taskInfo.failed
+
+        # wall clock: a sleeping script is killed when the timeout passes, not at its own pace
+        taskInfo, lines, elapsed = run(db, logs, "echo started; sleep 60", timeout)
+        print(round(elapsed, 2), lines[-1])
+        assert taskInfo.failed and lines[-1].startswith('TERMINATED due to timeout')
+        assert timeout <= elapsed < timeout + 1, elapsed
+
+        # cpu: a busy loop gets SIGXCPU after one cpu second even with plenty of wall clock left
+        taskInfo, lines, elapsed = run(db, logs, "while :; do :; done", 30, 1)
+        print(round(elapsed, 2), lines[-1])
+        assert taskInfo.failed and lines[-1].startswith('TERMINATED due to cpu limit'), lines[-1]
+        assert elapsed < 5, elapsed
+
+        # an exit status that happens to equal a signal number is just an exit status
+        taskInfo, lines, elapsed = run(db, logs, "exit 24", 10)
+        assert not taskInfo.failed and lines[-1].startswith('OK with status code 24'), lines
+
+        # the limits reach the script itself
+        taskInfo, lines, elapsed = run(db, logs, "ulimit -n; ulimit -St; ulimit -Ht; ulimit -v", 10, 3)
+        print(lines[:4])
+        assert lines[:4] == [str(handlers.fileLimit), '3', '4', str(handlers.memoryLimit // 1024)], lines
+
+        # memory: allocating past the address space limit fails inside the script
+        taskInfo, lines, elapsed = run(db, logs, f"{sys.executable} -c 'bytearray({handlers.memoryLimit * 2})'", 10)
+        print(lines[-2:])
+        assert 'MemoryError' in lines[-2] and lines[-1].startswith('OK with status code 1'), lines
+
+        # cancelling the task ends the runner through its process group
+        taskId = db.executeInsert(
+            "insert into taskList (owner, name, plugin, handler, creationTime) values (1, 't', 'rce', 'exec', '')")
+        taskInfo = api.dataManager.dataManager.taskInfo(db, taskId, logs)
+        runner = threading.Thread(target=handlers.exec, args=(None, taskInfo, ["sleep 60 & sleep 60; wait", 30]))
+        runner.start()
+        time.sleep(0.5)
+        taskInfo.cancel()
+        runner.join(10)
+        assert not runner.is_alive(), "runner outlived the cancellation"
+        print(logs.text(taskId).splitlines()[-1])
+        assert logs.text(taskId).splitlines()[-1].startswith('CANCELLED')
+        print("OK")
+    finally:
+        shutil.rmtree(workDir)
@@ -0,0 +1,65 @@
+"""
+Checks the deduplicating store in a scratch directory: by default duplicates never end up as one
+inode, copies are reflinks or plain copies, and only with hardlinks allowed do duplicates and
+copies share the inode of one object, which goes away once nothing links to it.
+
+@params size int bytes of every test file
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, root)
+
+import api.dedupStore
+
+size = 64 * 1024
+
+if __name__ == "__main__":
+    workDir = tempfile.mkdtemp()
+    try:
+        os.makedirs(f"{workDir}/drive/1")
+        os.makedirs(f"{workDir}/drive/2")
+        hardlinks = [False]
+        store = api.dedupStore.dedupStore(lambda: f"{workDir}/blob", lambda: hardlinks[0])
+        data = os.urandom(size)
+        for i in ('1/a', '2/a'):
+            with open(f"{workDir}/drive/{i}", 'wb') as file:
+                file.write(data)
+        os.chmod(f"{workDir}/drive/2/a", 0o600)
+
+        def inode(path):
+            return os.stat(f"{workDir}/drive/{path}").st_ino
+
+        # default: reflinks where the filesystem has them, nothing shared otherwise
+        reclaimed = store.ingestTree(f"{workDir}/drive")
+        store.copy(f"{workDir}/drive/1/a", f"{workDir}/drive/2/b")
+        print(reclaimed, store.queryReport())
+        assert len({inode('1/a'), inode('2/a'), inode('2/b')}) == 3
+        assert os.stat(f"{workDir}/drive/2/a").st_mode & 0o777 == 0o600
+        assert store.queryReport()['hardlinks'] is False and store.queryReport()['objects'] == 0
+        with open(f"{workDir}/drive/2/b", 'rb') as file:
+            assert file.read() == data
+
+        # opted in: duplicates and copies become one inode with the object
+        hardlinks[0] = True
+        assert store.ingestTree(f"{workDir}/drive") == 2 * size
+        store.copy(f"{workDir}/drive/1/a", f"{workDir}/drive/2/c")
+        report = store.queryReport()
+        print(report)
+        assert len({inode('1/a'), inode('2/a'), inode('2/b'), inode('2/c')}) == 1
+        assert report['hardlinks'] is True and report['objects'] == 1 and report['references'] == 4
+
+        # replacing a linked file breaks its sharing only
+        api.dedupStore.writeAtomically(f"{workDir}/drive/2/c", b"other")
+        with open(f"{workDir}/drive/1/a", 'rb') as file:
+            assert file.read() == data
+        for i in ('1/a', '2/a', '2/b'):
+            os.remove(f"{workDir}/drive/{i}")
+        assert store.collectGarbage(force=True) == 1
+        print("OK")
+    finally:
+        shutil.rmtree(workDir)
@@ -0,0 +1,115 @@
+"""
+Checks the drive reconciler against a scratch drive: files added, modified, renamed and removed
+behind the api's back become events, the search index follows them, and songlist entries are
+moved or dropped through the file tree in the same batch. Runs the mtime tree diff directly, then
+the background thread, which uses inotify where the platform has it.
+
+@params waitTimeout float seconds to wait for the background reconciler to catch up
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, root)
+
+import api.database
+import api.driveIndex
+import api.driveReconciler
+import api.fileTree
+import api.migrations
+
+waitTimeout = 10
+
+
+def write(path, data=b'x'):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as file:
+        file.write(data)
+
+
+def paths(db):
+    return sorted(i['path'] for i in db.query("select path from driveIndex where owner = 1"))
+
+
+def waitFor(condition):
+    deadline = time.time() + waitTimeout
+    while time.time() < deadline:
+        if condition():
+            return True
+        time.sleep(0.1)
+    return False
+
+
+if __name__ == "__main__":
+    workDir = tempfile.mkdtemp()
+    drive = f"{workDir}/drive"
+    try:
+        db = api.database.databaseObject(f"{workDir}/xms.db")
+        with open(os.path.join(root, 'scripts/init.sql')) as file:
+            db.runScript(file.read())
+        db.transaction(api.migrations.applyMigrations)
+
+        index = api.driveIndex.driveIndex(db, lambda: drive)
+        reconciler = api.driveReconciler.driveReconciler(db, index)
+        tree = api.fileTree.fileTree(db)
+
+        def applyPathEvents(conn, events):
+            # what dataManager.applyDriveEvents does
+            for i in events:
+                if i['type'] == 'renamed':
+                    tree.move(conn, i['owner'], i['path'], i['newPath'])
+                elif i['type'] == 'removed':
+                    tree.remove(conn, i['owner'], i['path'])
+
+        reconciler.subscribe(applyPathEvents)
+        published = []
+        reconciler.listen(published.extend)
+
+        write(f"{drive}/1/music/a.mp3")
+        write(f"{drive}/1/music/album/b.mp3")
+        reconciler.scan()
+        assert paths(db) == ['/music', '/music/a.mp3', '/music/album', '/music/album/b.mp3'], paths(db)
+        db.transaction(lambda conn: conn.execute("insert into songlist (fileId, playlistId, sortId) values (?, 1, 0)",
+                                                 (tree.ensure(conn, 1, '/music/album/b.mp3'), )))
+
+        # a second scan over an unchanged tree lists nothing and finds nothing
+        assert reconciler.scan() == []
+
+        os.rename(f"{drive}/1/music/album", f"{drive}/1/music/renamed")
+        os.remove(f"{drive}/1/music/a.mp3")
+        write(f"{drive}/1/new.txt")
+        events = reconciler.scan()
+        print(events)
+        assert {i['type'] for i in events} == {'renamed', 'removed', 'added'}, events
+        assert paths(db) == ['/music', '/music/renamed', '/music/renamed/b.mp3', '/new.txt'], paths(db)
+        assert tree.withPaths(db.query("select fileId from songlist"))[0]['path'] == '/music/renamed/b.mp3'
+        assert index.search(1, 'renamed')['total'] == 2
+
+        # links are not followed: a link to an ancestor would otherwise be walked until path limits
+        os.symlink(f"{drive}/1", f"{drive}/1/music/loop")
+        os.symlink(f"{drive}/1/new.txt", f"{drive}/1/music/alias.txt")
+        assert reconciler.scan() == []
+        index.rebuild(1)
+        assert paths(db) == ['/music', '/music/renamed', '/music/renamed/b.mp3', '/new.txt'], paths(db)
+        os.remove(f"{drive}/1/music/loop")
+        os.remove(f"{drive}/1/music/alias.txt")
+
+        # the scans above count too, wait for the first one of the thread
+        scans = reconciler.queryStats()['scans']
+        reconciler.start()
+        assert waitFor(lambda: reconciler.queryStats()['mode'] != 'stopped' and reconciler.queryStats()['scans'] > scans)
+        print(f"mode: {reconciler.queryStats()['mode']}")
+        if reconciler.queryStats()['mode'] == 'inotify':
+            shutil.rmtree(f"{drive}/1/music/renamed")
+            write(f"{drive}/1/music/deep/c.flac")
+            assert waitFor(lambda: paths(db) == ['/music', '/music/deep', '/music/deep/c.flac', '/new.txt']), paths(db)
+            assert waitFor(lambda: db.query("select count(1) as n from songlist", one=True)['n'] == 0), db.query("select * from songlist")
+        reconciler.stop()
+        print(reconciler.queryStats())
+        print("OK")
+    finally:
+        shutil.rmtree(workDir)
@@ -0,0 +1,97 @@
+"""
+Checks the database writer against a scratch database: a write only returns once its group has
+been committed, a group whose commit fails is committed again write by write so only the write
+that fails by itself raises, and a writer that cannot even begin its transaction fails the
+waiting caller instead of leaving it blocked. writes reaching query() go through the writer,
+whatever they start with.
+
+@params busyTimeout float seconds the writer waits for a lock held by another connection
+"""
+
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, root)
+
+import api.database
+
+busyTimeout = 0.2
+
+if __name__ == "__main__":
+    workDir = tempfile.mkdtemp()
+    try:
+        db = api.database.databaseObject(f"{workDir}/xms.db", busyTimeout=busyTimeout)
+        # a deferred foreign key is only checked by the commit, which then fails the group it is in
+        db.runScript("""
+            pragma foreign_keys = on;
+            create table parent (id integer primary key);
+            create table child (parentId integer references parent (id) deferrable initially deferred);
+            create table plain (value integer);
+        """)
+
+        db.execute("insert into parent (id) values (1)")
+        assert not db.hasPendingWrites()
+        other = sqlite3.connect(f"{workDir}/xms.db")
+        assert other.execute("select count(*) from parent").fetchone()[0] == 1, "returned before the commit"
+
+        # a good write in the same group as the bad one still commits, only the bad one raises.
+        # the slow job outlasts commitInterval and commits alone, the other two queue up behind it
+        results = {}
+
+        def write(name, fn):
+            try:
+                results[name] = db.transaction(fn)
+            except sqlite3.Error as e:
+                results[name] = e
+
+        threads = [threading.Thread(target=write, args=('slow', lambda conn: time.sleep(0.3))),
+                   threading.Thread(target=write, args=('good', lambda conn: conn.execute("insert into plain (value) values (1)").rowcount)),
+                   threading.Thread(target=write, args=('bad', lambda conn: conn.execute("insert into child (parentId) values (5)").rowcount))]
+        for i in threads:
+            i.start()
+            time.sleep(0.05)
+        for i in threads:
+            i.join(10)
+        print(results)
+        assert results['slow'] is None, results
+        assert results['good'] == 1 and isinstance(results['bad'], sqlite3.IntegrityError), results
+        assert other.execute("select count(*) from plain").fetchone()[0] == 1
+
+        try:
+            db.execute("insert into child (parentId) values (5)")
+            raise AssertionError("failed commit reported as success")
+        except sqlite3.IntegrityError:
+            pass
+        assert db.hasPendingWrites(), "lost write reported as committed"
+        db.execute("insert into plain (value) values (2)")
+        assert not db.hasPendingWrites()
+
+        # the writer cannot begin while another connection holds the write lock
+        other.execute("begin immediate")
+        try:
+            db.execute("insert into plain (value) values (3)")
+            raise AssertionError("write went through a held lock")
+        except sqlite3.OperationalError as e:
+            print(e)
+        other.execute("rollback")
+        db.execute("insert into plain (value) values (4)")
+        assert [i['value'] for i in db.query("select value from plain order by value")] == [1, 2, 4]
+
+        # statements reaching query() that write go through the writer, whatever they start with
+        assert db.query("  INSERT into plain (value) values (5)") == other.execute("select max(rowid) from plain").fetchone()[0]
+        db.query("with old as (select 2 as value) delete from plain where value in (select value from old)")
+        db.query("pragma user_version = 7")
+        assert other.execute("select group_concat(value) from plain").fetchone()[0] == '1,4,5'
+        assert other.execute("pragma user_version").fetchone()[0] == 7
+        assert db.query("pragma user_version", one=True) == {'user_version': 7}
+        other.close()
+        db.close()
+        print("OK")
+    finally:
+        shutil.rmtree(workDir)
@@ -0,0 +1,83 @@
+"""
+Stand-in for a front proxy doing X-Accel-Redirect / X-Sendfile offload.
+
+Listens on localhost:11454 and forwards every request to the server on localhost:11453. When
+the answer carries X-Accel-Redirect, the internal location is mapped onto the xms root like an
+nginx `internal; alias <root>/;` location; X-Sendfile is read from the absolute path it names.
+Running the script switches the server to X-Accel-Redirect, downloads /111.txt through the
+proxy, checks the bytes and the validators and restores the previous offload mode.
+
+@params root string xmsRootPath of the server, defaults to ./root
+"""
+
+import http.server
+import os
+import sys
+import threading
+import urllib.parse
+
+import requests
+
+upstream = "http://localhost:11453"
+root = os.path.abspath(sys.argv[1] if len(sys.argv) > 1 else "./root")
+prefix = "/xms-internal"
+
+
+class proxyHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        headers = {k: v for k, v in self.headers.items() if k.lower() != 'host'}
+        r = requests.get(upstream + self.path, headers=headers, stream=True, allow_redirects=False)
+        location = r.headers.get('X-Accel-Redirect')
+        path = r.headers.get('X-Sendfile')
+        if location is not None:
+            assert location.startswith(prefix + '/'), location
+            path = os.path.join(root, urllib.parse.unquote(location[len(prefix) + 1:]))
+            print(f"X-Accel-Redirect {location} -> {path}")
+        elif path is not None:
+            print(f"X-Sendfile {path}")
+
+        if path is None:
+            body = r.content
+        else:
+            assert len(r.content) == 0, "offloaded response carries a body"
+            with open(path, 'rb') as file:
+                body = file.read()
+
+        self.send_response(r.status_code)
+        for k, v in r.headers.items():
+            if k.lower() not in ['content-length', 'x-accel-redirect', 'x-sendfile', 'transfer-encoding', 'connection']:
+                self.send_header(k, v)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+if __name__ == "__main__":
+    server = http.server.ThreadingHTTPServer(('localhost', 11454), proxyHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    r = requests.post(f"{upstream}/xms/v1/signin", json={"username": "JerryChau", "password": "YoimiyaIsMyWaifu"})
+    cookies = r.cookies
+    config = requests.get(f"{upstream}/xms/v1/config", cookies=cookies).json()['data']
+    previous = config['fileOffloadMode']
+    config['fileOffloadMode'] = 'X-Accel-Redirect'
+    config['fileOffloadPrefix'] = prefix
+    print(requests.post(f"{upstream}/xms/v1/config/update", json=config, cookies=cookies).json())
+
+    try:
+        r = requests.get("http://localhost:11454/xms/v1/drive/file", params={"path": "/111.txt"}, cookies=cookies)
+        print(r.status_code, r.headers.get('Content-Type'))
+        direct = requests.get(f"{upstream}/xms/v1/drive/file", params={"path": "/111.txt"}, cookies=cookies)
+        assert 'X-Accel-Redirect' in direct.headers and len(direct.content) == 0
+        # the validators are set by the server, so a revalidation never reaches the proxy's file
+        assert 'ETag' in direct.headers and 'Last-Modified' in direct.headers, direct.headers
+        r304 = requests.get(f"{upstream}/xms/v1/drive/file", params={"path": "/111.txt"}, cookies=cookies,
+                            headers={'If-None-Match': direct.headers['ETag']})
+        assert r304.status_code == 304 and 'X-Accel-Redirect' not in r304.headers
+        with open("111.txt", "rb") as file:
+            assert r.content == file.read()
+        print("OK")
+    finally:
+        config['fileOffloadMode'] = previous
+        requests.post(f"{upstream}/xms/v1/config/update", json=config, cookies=cookies)
+        server.shutdown()
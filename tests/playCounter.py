@@ -0,0 +1,57 @@
+"""
+Checks the play counter against a scratch database: buffered increments survive a flush whose
+write fails, here because another connection holds the write lock, and land with the next flush.
+a play only counts towards an existing playCount row, it never creates one.
+
+@params busyTimeout float seconds the writer waits for the lock before the flush fails
+"""
+
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, root)
+
+import api.database
+import api.migrations
+import api.playCounter
+
+busyTimeout = 0.2
+
+if __name__ == "__main__":
+    workDir = tempfile.mkdtemp()
+    try:
+        db = api.database.databaseObject(f"{workDir}/xms.db", busyTimeout=busyTimeout)
+        with open(os.path.join(root, 'scripts/init.sql')) as file:
+            db.runScript(file.read())
+        db.transaction(api.migrations.applyMigrations)
+        counter = api.playCounter.playCounter(db, flushInterval=60)
+
+        def plays():
+            return {(i['owner'], i['fileId']): i['plays'] for i in db.query("select owner, fileId, plays from playCount")}
+
+        db.executeMany("insert into playCount (fileId, owner) values (?, ?)", [(10, 1), (11, 2)])
+        counter.increaseSong(1, 10)
+        counter.increaseSong(1, 10)
+        counter.increaseSong(2, 11)
+        other = sqlite3.connect(f"{workDir}/xms.db")
+        other.execute("begin immediate")
+        assert counter.flush() == 0
+        other.execute("rollback")
+        other.close()
+        print(counter.queryStats(), plays())
+        assert counter.pending() == 3 and plays() == {(1, 10): 0, (2, 11): 0}
+
+        counter.increaseSong(2, 11)
+        counter.increaseSong(1, 11)
+        assert counter.flush() == 5
+        print(counter.queryStats(), plays())
+        # (1, 11) has no row, user 1 never added that file to a playlist of their own
+        assert plays() == {(1, 10): 2, (2, 11): 2} and counter.pending() == 0
+        counter.close()
+        print("OK")
+    finally:
+        shutil.rmtree(workDir)
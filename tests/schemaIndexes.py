@@ -0,0 +1,92 @@
+"""
+Checks that the schema migrations give every hot query an index, using EXPLAIN QUERY PLAN
+against a fresh database built from scripts/init.sql, and that migrating an old database with
+duplicated playCount records, or spellings of one path, folds them together.
+"""
+
+import os
+import sqlite3
+import sys
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, root)
+
+import api.migrations
+
+hotQueries = [
+    ("select * from songlist where playlistId = ? order by sortId desc", (1, ), "songlistPlaylistSort"),
+    ("select id from songlist where fileId = ? and playlistId = ?", (1, 1), "songlistFileId"),
+    ("delete from songlist where fileId in (select value from json_each(?))", ('[1]', ), "songlistFileId"),
+    ("select plays from playCount where fileId = ? and owner = ?", (1, 1), "playCountFileOwner"),
+    ("update playCount set plays = plays + ? where fileId = ? and owner = ?", (1, 1, 1), "playCountFileOwner"),
+    ("select * from playCount where owner = ? and plays != 0 order by plays desc limit 100", (1, ), "playCountOwner"),
+    ("delete from playCount where fileId in (select value from json_each(?))", ('[1]', ), "playCountFileOwner"),
+    ("select id from shareLinksList where owner = ? and fileId = ?", (1, 1), "shareLinksOwnerFile"),
+    ("select * from shareLinksList where owner = ?", (1, ), "shareLinksOwnerFile"),
+    ("delete from shareLinksList where fileId in (select value from json_each(?))", ('[1]', ), "shareLinksFileId"),
+    ("select id from files where owner = ? and parentId = ? and name = ?", (1, 0, 'a'), "filesOwnerParentName"),
+    ("""with recursive subtree (id) as (
+            select ? union all select files.id from files join subtree on files.owner = ? and files.parentId = subtree.id
+        ) select id from subtree""", (1, 1), "filesOwnerParentName"),
+    ("select id from playlists where name = ? and owner = ?", ('p', 1), "playlistsOwnerName"),
+    ("select * from playlists where owner = ?", (1, ), "playlistsOwnerName"),
+    ("select id, name from taskList where owner = ? order by id desc", (1, ), "taskListOwner"),
+    ("select * from taskList where state = 'queued' order by id", (), "taskListState"),
+    ("select artist, count(1) from musicLibrary where owner = ? group by artist order by artist", (1, ), "musicLibraryArtist"),
+    ("select * from musicLibrary where owner = ? and artist = ? order by artist, album, title", (1, 'a'), "musicLibraryArtist"),
+    ("select * from musicLibrary where owner = ? and album like ? escape '\\' order by album, title", (1, 'a%'), "musicLibraryAlbum"),
+    ("select * from musicLibrary where owner = ? and title like ? escape '\\' order by title", (1, 'a%'), "musicLibraryTitle"),
+    ("select * from musicLibrary where owner = ? and composer like ? escape '\\' order by composer, title", (1, 'a%'), "musicLibraryComposer"),
+    ("delete from driveIndex where owner = ? and path >= ? and path < ?", (1, '/a/', '/a0'), "driveIndexOwnerPath"),
+    ("select path, name, type, size, mtime, inode from driveIndex where owner = ? and parent = ?", (1, '/a'), "driveIndexOwnerParent"),
+]
+
+
+def freshDatabase():
+    conn = sqlite3.connect(':memory:', isolation_level=None)
+    with open(os.path.join(root, 'scripts/init.sql')) as file:
+        conn.executescript(file.read())
+    return conn
+
+
+def isTableScan(step):
+    # constant rows, json argument lists and recursive cte queues are no tables
+    return step.startswith('SCAN') and step.split()[1] not in ('CONSTANT', 'json_each', 'subtree')
+
+
+def checkQueryPlans():
+    conn = freshDatabase()
+    print(f"applied: {api.migrations.applyMigrations(conn)}")
+    assert api.migrations.getSchemaVersion(conn) == api.migrations.latestVersion
+
+    for query, args, index in hotQueries:
+        plan = ' | '.join(i[3] for i in conn.execute(f"explain query plan {query}", args))
+        print(f"{query}\n    {plan}")
+        assert index in plan, f"expected {index} in plan"
+        assert not any(isTableScan(i) for i in plan.split(' | ')), "unexpected table scan"
+
+    # applying again is a no-op
+    assert api.migrations.applyMigrations(conn) == []
+
+
+def checkDuplicatedPlayCount():
+    conn = freshDatabase()
+    conn.executemany("insert into playCount (path, owner, plays) values (?, ?, ?)",
+                     [('/a.mp3', 1, 2), ('/a.mp3', 1, 1), ('a.mp3', 1, 2), ('/a.mp3', 2, 1), ('/b.mp3', 1, 0)])
+    api.migrations.applyMigrations(conn)
+    rows = conn.execute(
+        "select files.name, playCount.owner, plays from playCount join files on files.id = playCount.fileId order by files.name, playCount.owner").fetchall()
+    print(rows)
+    assert rows == [('a.mp3', 1, 5), ('a.mp3', 2, 1), ('b.mp3', 1, 0)]
+
+    try:
+        conn.execute("insert into playCount (fileId, owner) select id, 1 from files where owner = 1 and name = 'a.mp3'")
+        assert False, "duplicated playCount record accepted"
+    except sqlite3.IntegrityError:
+        pass
+
+
+if __name__ == "__main__":
+    checkQueryPlans()
+    checkDuplicatedPlayCount()
+    print("OK")
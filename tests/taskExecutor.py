@@ -0,0 +1,161 @@
+"""
+Checks the task executor against a scratch database: the worker, plugin and user limits hold,
+queued tasks start in priority order, and cancelling a running task kills the whole process group
+its handler started, grandchildren included.
+
+@params workers int worker threads of the executor under test
+"""
+
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, root)
+
+import api.database
+import api.dataManager
+import api.migrations
+import api.taskExecutor
+import api.taskLogs
+
+workers = 3
+
+
+def insertTask(db, owner, plugin):
+    return db.executeInsert("insert into taskList (owner, name, plugin, handler, creationTime) values (?, 't', ?, 'h', '')",
+                            (owner, plugin))
+
+
+def isAlive(pid):
+    # a killed orphan stays a zombie until init reaps it, which some containers never do
+    try:
+        with open(f"/proc/{pid}/stat") as file:
+            return file.read().rsplit(')', 1)[1].split()[0] != 'Z'
+    except FileNotFoundError:
+        return False
+
+
+def states(db):
+    return {i['id']: i['state'] for i in db.query("select id, state from taskList")}
+
+
+if __name__ == "__main__":
+    workDir = tempfile.mkdtemp()
+    try:
+        db = api.database.databaseObject(f"{workDir}/xms.db")
+        with open(os.path.join(root, 'scripts/init.sql')) as file:
+            db.runScript(file.read())
+        db.transaction(api.migrations.applyMigrations)
+        executor = api.taskExecutor.taskExecutor(db, workers=workers, userLimit=2)
+        executor.pluginLimits['slow'] = 1
+        logs = api.taskLogs.taskLogStore(db)
+
+        lock = threading.Lock()
+        release = threading.Event()
+        running = set()
+        peaks = {'all': 0, 'slow': 0, 'user1': 0}
+        started = []
+
+        def job(taskId, owner, plugin, priority=0):
+            def run():
+                with lock:
+                    running.add((taskId, owner, plugin))
+                    started.append(taskId)
+                    peaks['all'] = max(peaks['all'], len(running))
+                    peaks['slow'] = max(peaks['slow'], sum(1 for i in running if i[2] == 'slow'))
+                    peaks['user1'] = max(peaks['user1'], sum(1 for i in running if i[1] == 1))
+                release.wait()
+                with lock:
+                    running.discard((taskId, owner, plugin))
+            return {'id': taskId, 'owner': owner, 'plugin': plugin, 'priority': priority,
+                    'taskInfo': api.dataManager.dataManager.taskInfo(db, taskId, logs), 'run': run}
+
+        # limits: 3 workers, 1 'slow' task at once, 2 tasks of one user at once
+        jobs = [job(insertTask(db, owner, plugin), owner, plugin)
+                for owner, plugin in [(1, 'slow'), (1, 'slow'), (1, 'fast'), (1, 'fast'), (2, 'fast'), (3, 'fast')]]
+        for i in jobs:
+            executor.submit(i)
+        time.sleep(0.5)
+        print(executor.queryStats(), peaks)
+        assert peaks == {'all': 3, 'slow': 1, 'user1': 2}, peaks
+        release.set()
+        deadline = time.time() + 10
+        while executor.queryStats()['done'] < len(jobs) and time.time() < deadline:
+            time.sleep(0.05)
+        assert set(states(db).values()) == {'done'}, states(db)
+
+        # priorities: behind a busy single worker, the queue drains highest first, oldest first
+        release.clear()
+        started.clear()
+        single = api.taskExecutor.taskExecutor(db, workers=1)
+        single.submit(job(insertTask(db, 10, 'fast'), 10, 'fast'))
+        time.sleep(0.2)
+        queued = [job(insertTask(db, 20 + i, 'fast'), 20 + i, 'fast', priority) for i, priority in enumerate([0, 5, -1, 5])]
+        for i in queued:
+            single.submit(i)
+        release.set()
+        deadline = time.time() + 10
+        while len(started) < 1 + len(queued) and time.time() < deadline:
+            time.sleep(0.05)
+        order = started[1:]
+        print(order)
+        assert order == [queued[1]['id'], queued[3]['id'], queued[0]['id'], queued[2]['id']], order
+
+        # cancellation: a shell started through taskInfo.popen and the sleep it spawned both die
+        taskId = insertTask(db, 1, 'rce')
+        taskInfo = api.dataManager.dataManager.taskInfo(db, taskId, logs)
+        pids = []
+
+        def runShell():
+            process = taskInfo.popen("sleep 60 & echo $!; wait", shell=True, stdout=subprocess.PIPE, text=True)
+            pids.append(int(process.stdout.readline()))
+            process.wait()
+
+        executor.submit({'id': taskId, 'owner': 1, 'plugin': 'rce', 'priority': 0, 'taskInfo': taskInfo, 'run': runShell})
+        deadline = time.time() + 10
+        while not pids and time.time() < deadline:
+            time.sleep(0.05)
+        assert executor.cancel(taskId)
+        deadline = time.time() + 10
+        while states(db)[taskId] != 'cancelled' and time.time() < deadline:
+            time.sleep(0.05)
+        assert states(db)[taskId] == 'cancelled', states(db)[taskId]
+        time.sleep(0.2)
+        assert not isAlive(pids[0]), "grandchild survived the cancellation"
+
+        # the delayed SIGKILL is not sent once the group leader was reaped, its pid may be reused by then
+        process = subprocess.Popen(["sleep", "60"], start_new_session=True)
+        signals = []
+        killpg = os.killpg
+        os.killpg = lambda pid, sig: (signals.append(sig), killpg(pid, sig))
+        try:
+            timer = api.taskExecutor.killProcessGroup(process, grace=0.2)
+            os.wait4(process.pid, 0)
+            timer.join(5)
+        finally:
+            os.killpg = killpg
+        assert signals == [signal.SIGTERM], signals
+
+        # a queued task is cancelled without ever starting
+        release.clear()
+        executor.pluginLimits['blocker'] = workers
+        blockers = [job(insertTask(db, 30 + i, 'fast'), 30 + i, 'blocker') for i in range(workers)]
+        for i in blockers:
+            executor.submit(i)
+        pending = job(insertTask(db, 40, 'fast'), 40, 'fast')
+        executor.submit(pending)
+        time.sleep(0.2)
+        assert executor.cancel(pending['id'])
+        release.set()
+        time.sleep(0.2)
+        assert pending['id'] not in started and states(db)[pending['id']] == 'cancelled'
+        print(executor.queryStats())
+        print("OK")
+    finally:
+        shutil.rmtree(workDir)
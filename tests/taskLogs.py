@@ -0,0 +1,74 @@
+"""
+Checks the task log ring buffer against a scratch database: lines are numbered, since= returns only
+newer lines, the oldest lines fall out once the buffer is full and readers behind them see
+truncated, and a checkpoint lets a new store, as after a restart, carry on the numbering.
+
+@params capacity int lines kept per task by the store under test
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, root)
+
+import api.database
+import api.migrations
+import api.taskLogs
+
+capacity = 5
+
+
+def texts(log):
+    return [i['text'] for i in log['lines']]
+
+
+if __name__ == "__main__":
+    workDir = tempfile.mkdtemp()
+    try:
+        db = api.database.databaseObject(f"{workDir}/xms.db")
+        with open(os.path.join(root, 'scripts/init.sql')) as file:
+            db.runScript(file.read())
+        db.transaction(api.migrations.applyMigrations)
+        taskId = db.executeInsert(
+            "insert into taskList (owner, name, plugin, handler, creationTime) values (1, 't', 'test', 'test', '')")
+        logs = api.taskLogs.taskLogStore(db, checkpointInterval=60, capacity=capacity)
+
+        logs.append(taskId, "a\nb\n")
+        logs.append(taskId, "c")
+        log = logs.read(taskId)
+        assert texts(log) == ['a', 'b', 'c'] and log['next'] == 3 and not log['truncated'], log
+        assert texts(logs.read(taskId, 2)) == ['c']
+        assert logs.read(taskId, 3)['lines'] == []
+
+        logs.append(taskId, "d\ne\nf\ng")
+        log = logs.read(taskId, 1)
+        print(log)
+        assert log['truncated'] and [i['seq'] for i in log['lines']] == [2, 3, 4, 5, 6]
+        assert not logs.read(taskId, 5)['truncated']
+
+        # nothing reaches the table before a checkpoint
+        assert db.query("select logText from taskList where id = ?", (taskId, ), one=True)['logText'] == ''
+        assert logs.checkpoint() == 1
+        assert logs.checkpoint() == 0
+        row = db.query("select logText, logSeq from taskList where id = ?", (taskId, ), one=True)
+        assert row == {'logText': 'c\nd\ne\nf\ng', 'logSeq': 7}, row
+
+        # a new store picks up the numbering from the checkpoint
+        restarted = api.taskLogs.taskLogStore(db, checkpointInterval=60, capacity=capacity)
+        restarted.append(taskId, "h")
+        assert [(i['seq'], i['text']) for i in restarted.read(taskId, 6)['lines']] == [(6, 'g'), (7, 'h')]
+        restarted.finish(taskId)
+        assert restarted.queryStats()['live'] == 0
+        assert texts(restarted.read(taskId, 7)) == ['h']
+
+        # a replaced text keeps counting, older cursors see truncated
+        restarted.replace(taskId, "x\ny")
+        log = restarted.read(taskId, 7)
+        assert log['truncated'] and [(i['seq'], i['text']) for i in log['lines']] == [(8, 'x'), (9, 'y')], log
+        print(restarted.queryStats())
+        print("OK")
+    finally:
+        shutil.rmtree(workDir)
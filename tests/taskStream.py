@@ -0,0 +1,100 @@
+"""
+Checks the task event stream against a scratch database: a follower receives appended log lines,
+state transitions and progress reports as they happen, heartbeats while the task is quiet, and
+an 'end' event once the task finished. A second follower resumes from a Last-Event-ID cursor and
+only receives the lines after it.
+
+@params heartbeat float seconds of silence before the stream under test sends a heartbeat
+"""
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, root)
+
+import api.database
+import api.migrations
+import api.taskLogs
+import api.taskStream
+
+heartbeat = 0.3
+
+
+def parse(chunk):
+    # (event, id, data) of one server-sent event, ('heartbeat', None, None) for a comment
+    if chunk.startswith(':'):
+        return ('heartbeat', None, None)
+    fields = dict(line.split(': ', 1) for line in chunk.strip().split('\n'))
+    return (fields['event'], int(fields['id']) if 'id' in fields else None, json.loads(fields['data']))
+
+
+if __name__ == "__main__":
+    workDir = tempfile.mkdtemp()
+    try:
+        db = api.database.databaseObject(f"{workDir}/xms.db")
+        with open(os.path.join(root, 'scripts/init.sql')) as file:
+            db.runScript(file.read())
+        db.transaction(api.migrations.applyMigrations)
+        taskId = db.executeInsert(
+            "insert into taskList (owner, name, plugin, handler, creationTime, state) values (1, 't', 'test', 'test', '', 'queued')")
+        db.flush().result()
+        logs = api.taskLogs.taskLogStore(db, checkpointInterval=60)
+
+        def queryState(taskId):
+            row = db.query("select state from taskList where id = ?", (taskId, ), one=True)
+            return row['state'] if row is not None else None
+
+        def setState(state):
+            # what the executor and dataManager.followTaskState do
+            db.execute("update taskList set state = ? where id = ?", (state, taskId))
+            db.flush().result()
+            logs.setState(taskId, state)
+            if state in api.taskStream.finalStates:
+                logs.finish(taskId)
+
+        events = []
+        follower = threading.Thread(target=lambda: events.extend(
+            parse(i) for i in api.taskStream.followTask(logs, queryState, taskId, 0, heartbeat)))
+        follower.start()
+        time.sleep(heartbeat * 2)
+        setState('running')
+        logs.append(taskId, "a\nb")
+        time.sleep(0.05)
+        logs.setProgress(taskId, {'done': 1, 'total': 2})
+        time.sleep(0.05)
+        logs.append(taskId, "c")
+        time.sleep(0.05)
+        setState('done')
+        follower.join(5)
+        assert not follower.is_alive(), "stream did not end"
+
+        kinds = [i[0] for i in events]
+        print(kinds)
+        assert kinds[0] == 'state' and events[0][2] == {'state': 'queued'}
+        assert 'heartbeat' in kinds
+        lines = [line['text'] for event, _, data in events if event == 'log' for line in data['lines']]
+        assert lines == ['a', 'b', 'c'], lines
+        assert [i[2]['state'] for i in events if i[0] == 'state'] == ['queued', 'running', 'done']
+        assert [i[2] for i in events if i[0] == 'progress'] == [{'done': 1, 'total': 2}]
+        assert events[-1][0] == 'end' and events[-1][2] == {'state': 'done'}
+        lastLogId = [i[1] for i in events if i[0] == 'log'][0]
+
+        # reconnecting with the id of the first log event skips the lines already received
+        resumed = [parse(i) for i in api.taskStream.followTask(logs, queryState, taskId, lastLogId, heartbeat)]
+        print(resumed)
+        assert [line['text'] for event, _, data in resumed if event == 'log' for line in data['lines']] == ['c']
+        assert resumed[-1][0] == 'end'
+
+        db.execute("delete from taskList where id = ?", (taskId, ))
+        logs.discard(taskId)
+        gone = [parse(i) for i in api.taskStream.followTask(logs, queryState, taskId, 0, heartbeat)]
+        assert gone == [('end', None, {'state': None, 'message': 'task not exist'})], gone
+        print("OK")
+    finally:
+        shutil.rmtree(workDir)
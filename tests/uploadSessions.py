@@ -0,0 +1,68 @@
+"""
+Checks resumable upload sessions against a scratch database: a chunk that fails its checksum or
+arrives truncated never reaches the part file, so a bad retry of a range that was already
+received leaves the good bytes in place, and a session whose only copy of a range was bad cannot
+be finalized.
+
+@params size int bytes of every chunk
+"""
+
+import hashlib
+import io
+import os
+import shutil
+import sys
+import tempfile
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, root)
+
+import api.database
+import api.migrations
+import api.uploadSessions
+
+size = 64 * 1024
+
+
+def put(sessions, sessionId, offset, data, checksum=None, length=None):
+    return sessions.writeChunk(1, sessionId, offset, len(data) if length is None else length,
+                               checksum or hashlib.sha256(data).hexdigest(), io.BytesIO(data))
+
+
+if __name__ == "__main__":
+    workDir = tempfile.mkdtemp()
+    try:
+        db = api.database.databaseObject(f"{workDir}/xms.db")
+        with open(os.path.join(root, 'scripts/init.sql')) as file:
+            db.runScript(file.read())
+        db.transaction(api.migrations.applyMigrations)
+        os.makedirs(f"{workDir}/drive")
+        sessions = api.uploadSessions.uploadSessionManager(db, lambda: f"{workDir}/blob")
+        good = [os.urandom(size), os.urandom(size)]
+
+        # a retry with bad bytes over a received range is refused and leaves that range intact
+        sessionId = sessions.create(1, '/a', f"{workDir}/drive/a", 2 * size)['data']['id']
+        assert put(sessions, sessionId, 0, good[0])['ok']
+        r = put(sessions, sessionId, 0, os.urandom(size), hashlib.sha256(good[0]).hexdigest())
+        print(r)
+        assert not r['ok'] and r['data'] == "chunk checksum mismatch"
+        r = put(sessions, sessionId, 0, good[0][:size // 2], length=size)
+        assert not r['ok'] and r['data'] == "chunk truncated"
+        assert put(sessions, sessionId, size, good[1])['ok']
+        assert sessions.finalize(1, sessionId)['ok']
+        with open(f"{workDir}/drive/a", 'rb') as file:
+            assert file.read() == good[0] + good[1], "bad retry reached the part file"
+
+        # a range that only ever arrived bad is not received, finalize refuses the session
+        sessionId = sessions.create(1, '/b', f"{workDir}/drive/b", 2 * size)['data']['id']
+        assert put(sessions, sessionId, 0, good[0])['ok']
+        assert not put(sessions, sessionId, size, os.urandom(size), hashlib.sha256(good[1]).hexdigest())['ok']
+        r = sessions.finalize(1, sessionId)
+        print(r)
+        assert not r['ok'] and r['data'] == "upload incomplete"
+        assert not os.path.exists(f"{workDir}/drive/b")
+        assert os.listdir(f"{workDir}/blob/uploads") == [f"{sessionId}.part"], "spool left behind"
+        db.close()
+        print("OK")
+    finally:
+        shutil.rmtree(workDir)